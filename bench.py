@@ -0,0 +1,268 @@
+from argparse import ArgumentParser
+from json import dump, load
+from platform import python_implementation, python_version
+from random import Random
+from statistics import median
+from sys import exit
+from time import perf_counter_ns
+from typing import Callable
+from crc import crc16
+from lcd import LCD, LCDPacket
+from output import LCDOutput
+from page import LCDPage
+from replay import ReplaySerial
+
+BENCH_SEED = 635
+BENCH_MIN_REPEAT_NS = 50_000_000
+BENCH_REPEATS = 7
+BENCH_WARMUP_REPEATS = 1
+BENCH_THRESHOLD = 0.2
+
+LCD_WIDTH = 20
+LCD_HEIGHT = 4
+LCD_LED_COUNT = 4
+
+class EchoSerial(ReplaySerial):
+    lcd: LCD
+
+    def __init__(self, lcd: LCD):
+        super().__init__()
+        self.lcd = lcd
+
+    def write(self, data: bytes) -> int:
+        # Answer instantly, so only the encoding and bookkeeping get measured
+        self.lcd._last_response = LCDPacket(data[0] | 0x40, [])
+        return len(data)
+
+def _bench_output() -> LCDOutput:
+    lcd = LCD("bench")
+    lcd._serial = EchoSerial(lcd)
+    output = LCDOutput(lcd)
+    output._lcd_mem_is = bytearray(b" " * output.lcd_pixel_count)
+    output._lcd_led_is = [None] * output.lcd_led_count
+    return output
+
+class BenchPageDriver():
+    lcd_width: int
+    lcd_height: int
+    lcd_led_count: int
+
+    def __init__(self):
+        self.lcd_width = LCD_WIDTH
+        self.lcd_height = LCD_HEIGHT
+        self.lcd_led_count = LCD_LED_COUNT
+
+def _packet(command: int, data: bytes) -> bytes:
+    packet = bytearray([command, len(data)]) + data
+    crc = crc16(packet)
+    return bytes(packet + bytes([crc & 0xFF, crc >> 8]))
+
+def _stream(corrupt: bool) -> bytes:
+    rng = Random(BENCH_SEED)
+    stream = bytearray()
+    for i in range(64):
+        if i % 4 == 0:
+            stream += _packet(0x80, bytes([rng.randint(1, 12)]))
+        else:
+            stream += _packet(0x40 | 0x1F, b"")
+        if corrupt and i % 8 == 0:
+            # Line noise forces the parser to resync byte by byte
+            stream += bytes(rng.randint(0, 255) for _ in range(5))
+    return bytes(stream)
+
+def bench_crc16() -> Callable[[], None]:
+    data = bytes(Random(BENCH_SEED).randint(0, 255) for _ in range(24))
+    return lambda: crc16(data)
+
+def _bench_check_buffer(corrupt: bool) -> Callable[[], None]:
+    stream = _stream(corrupt)
+    lcd = LCD("bench")
+
+    def run():
+        lcd._buffer = bytearray(stream)
+        while lcd._buffer:
+            before = len(lcd._buffer)
+            lcd._check_buffer()
+            if len(lcd._buffer) == before:
+                break
+    return run
+
+def bench_check_buffer_clean() -> Callable[[], None]:
+    return _bench_check_buffer(corrupt=False)
+
+def bench_check_buffer_corrupt() -> Callable[[], None]:
+    return _bench_check_buffer(corrupt=True)
+
+def bench_send_encode() -> Callable[[], None]:
+    lcd = LCD("bench")
+    lcd._serial = EchoSerial(lcd)
+    data = list(b"Hello, world! 123456")
+    return lambda: lcd._send(0x1F, [0, 1] + data, 1.0)
+
+def _bench_render_send_display(frames: list[bytes], damages: list) -> Callable[[], None]:
+    output = _bench_output()
+    output._lcd_mem_is[:] = frames[-1]
+    state = [0]
+
+    def run():
+        # Cycle through the frames so every call has the same amount of work
+        idx = state[0]
+        output._render_send_display(frames[idx], damages[idx])
+        state[0] = (idx + 1) % len(frames)
+    return run
+
+def bench_render_full() -> Callable[[], None]:
+    size = LCD_WIDTH * LCD_HEIGHT
+    return _bench_render_send_display([b"A" * size, b"B" * size], [None, None])
+
+def bench_render_single_char() -> Callable[[], None]:
+    size = LCD_WIDTH * LCD_HEIGHT
+    base = b" " * size
+    changed = base[:45] + b"X" + base[46:]
+    return _bench_render_send_display([changed, base], [None, None])
+
+def bench_render_single_char_damage() -> Callable[[], None]:
+    size = LCD_WIDTH * LCD_HEIGHT
+    base = b" " * size
+    changed = base[:45] + b"X" + base[46:]
+    return _bench_render_send_display([changed, base], [[(45, 46)], [(45, 46)]])
+
+def bench_render_scattered() -> Callable[[], None]:
+    size = LCD_WIDTH * LCD_HEIGHT
+    base = bytearray(b" " * size)
+    changed = bytearray(base)
+    for i in range(0, size, 7):
+        changed[i] = ord("*")
+    return _bench_render_send_display([bytes(changed), bytes(base)], [None, None])
+
+def bench_render_unchanged() -> Callable[[], None]:
+    size = LCD_WIDTH * LCD_HEIGHT
+    base = b" " * size
+    return _bench_render_send_display([base], [None])
+
+def _bench_page() -> LCDPage:
+    page = LCDPage({}, BenchPageDriver(), "BENCH")
+    page.init_arrays(LCD_HEIGHT, LCD_WIDTH, LCD_LED_COUNT)
+    return page
+
+def bench_write_at() -> Callable[[], None]:
+    page = _bench_page()
+    values = ["12.3ms", "45.6ms"]
+    state = [0]
+
+    def run():
+        state[0] ^= 1
+        page.write_at(8, 2, values[state[0]])
+    return run
+
+def bench_set_line() -> Callable[[], None]:
+    page = _bench_page()
+    values = ["Ping 12.3ms", "Ping 45.6ms"]
+    state = [0]
+
+    def run():
+        state[0] ^= 1
+        page.set_line(1, values[state[0]])
+    return run
+
+def bench_format_text_center() -> Callable[[], None]:
+    page = _bench_page()
+    return lambda: page.format_text_center("UPS POWER", "=")
+
+def bench_commit_status_overlay() -> Callable[[], None]:
+    page = _bench_page()
+    page.title_layer.write_at(0, 0, page.format_text_center("BENCH", "="))
+    page.commit()
+    glyphs = ["=", "\xBB"]
+    state = [0]
+
+    def run():
+        state[0] ^= 1
+        page.status_layer.write_at(0, 0, glyphs[state[0]])
+        page.commit()
+    return run
+
+BENCHMARKS: dict[str, Callable[[], Callable[[], None]]] = {
+    "crc16": bench_crc16,
+    "check_buffer_clean": bench_check_buffer_clean,
+    "check_buffer_corrupt": bench_check_buffer_corrupt,
+    "send_encode": bench_send_encode,
+    "render_full": bench_render_full,
+    "render_single_char": bench_render_single_char,
+    "render_single_char_damage": bench_render_single_char_damage,
+    "render_scattered": bench_render_scattered,
+    "render_unchanged": bench_render_unchanged,
+    "write_at": bench_write_at,
+    "set_line": bench_set_line,
+    "format_text_center": bench_format_text_center,
+    "commit_status_overlay": bench_commit_status_overlay,
+}
+
+def _time_loops(func: Callable[[], None], loops: int) -> int:
+    start = perf_counter_ns()
+    for _ in range(loops):
+        func()
+    return perf_counter_ns() - start
+
+def measure(func: Callable[[], None], repeats: int = BENCH_REPEATS) -> dict[str, float]:
+    # Grow the loop count until one repeat is long enough to time reliably
+    loops = 1
+    while _time_loops(func, loops) < BENCH_MIN_REPEAT_NS:
+        loops *= 2
+
+    for _ in range(BENCH_WARMUP_REPEATS):
+        _time_loops(func, loops)
+    timings = [_time_loops(func, loops) / loops for _ in range(repeats)]
+    return {"min_ns": min(timings), "median_ns": median(timings), "loops": loops}
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], threshold: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name}: no baseline", flush=True)
+            continue
+        # min is the least noisy estimate of the real cost
+        before = baseline[name]["min_ns"]
+        after = result["min_ns"]
+        change = (after - before) / before
+        marker = ""
+        if change > threshold:
+            marker = " REGRESSION"
+            regressions.append(name)
+        print(f"{name}: {before:.0f}ns -> {after:.0f}ns ({change * 100:+.1f}%){marker}", flush=True)
+    return regressions
+
+def main():
+    parser = ArgumentParser(description="Microbenchmarks for the serial protocol and rendering hot paths")
+    parser.add_argument("names", nargs="*", help="Benchmarks to run, all by default")
+    parser.add_argument("--repeats", type=int, default=BENCH_REPEATS)
+    parser.add_argument("--save", help="Write the results to this JSON baseline")
+    parser.add_argument("--compare", help="Compare against this JSON baseline and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=BENCH_THRESHOLD, help="Allowed slowdown as a fraction of the baseline")
+    args = parser.parse_args()
+
+    names = args.names or list(BENCHMARKS.keys())
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"Unknown benchmark {name}, choose from {', '.join(BENCHMARKS.keys())}")
+
+    results = {}
+    for name in names:
+        results[name] = measure(BENCHMARKS[name](), args.repeats)
+        print(f"{name}: min {results[name]['min_ns']:.0f}ns, median {results[name]['median_ns']:.0f}ns per call", flush=True)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            dump({"python": f"{python_implementation()} {python_version()}", "results": results}, f, indent=2)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = load(f)
+        regressions = compare(results, baseline["results"], args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold * 100:.0f}%: {', '.join(regressions)}", flush=True)
+            exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,27 @@
+from os import stat
 from yaml import safe_load
 
+CONFIG_FILE = "config.yml"
+
 CONFIG = None
+_config_mtime = None
+
+def _mtime():
+    try:
+        return stat(CONFIG_FILE).st_mtime_ns
+    except OSError:
+        return None
 
 def load():
-    global CONFIG
-    with open("config.yml", "r") as f:
+    global CONFIG, _config_mtime
+    _config_mtime = _mtime()
+    with open(CONFIG_FILE, "r") as f:
         CONFIG = safe_load(f)
 
-load()
+def changed_on_disk() -> bool:
+    return _mtime() != _config_mtime
+
+def reload() -> bool:
+    old_config = CONFIG
+    load()
+    return CONFIG != old_config
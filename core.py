@@ -1,14 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
-from time import sleep
+from signal import SIGHUP, SIGTERM, signal
+from threading import Event, Lock
+from traceback import print_exc
 from typing import Optional
-from config import CONFIG
+import config
 from driver import LCDDriver
-from lcd import LCD_KEY_MASK_ALL, LCDWithID
+from lcd import LCD, LCD_KEY_MASK_ALL, LCDWithID
 from serial.tools.list_ports import comports
 from importlib import import_module
+from memory import apply_low_footprint
+from mirror import MirrorServer, create_mirror_server
+from timing import STARTUP
+import page_state
+import prometheus
 
 LCD_INITIAL_CONFIG_VERSION = 0x01
 
+CONFIG_POLL_INTERVAL = 2.0
+
 def initial_config(lcd: LCDWithID, id: int):
     lcd.open()
     lcd.set_backlight(10)
@@ -27,52 +37,63 @@ def initial_config(lcd: LCDWithID, id: int):
     lcd.write_id_and_version(id, LCD_INITIAL_CONFIG_VERSION)
     lcd.close()
 
-def serve_core(override_glob: Optional[str]) -> None:
-    ports = None
-    if override_glob:
-        from serial.tools.list_ports_linux import SysFS
-        ports = [SysFS(p) for p in glob(override_glob)]
-    else:
-        ports = comports()
+def splash_frame(lcd: LCD, id: int) -> bytes:
+    width = lcd.width()
+    lines = [" FoxDen Industries", "=" * width, f"ID {id}", "Starting..."]
+    return b"".join(line.ljust(width)[:width].encode("latin-1") for line in lines[:lcd.height()])
 
-    ports_by_id = {}
-    ports_without_id = []
-    for port in ports:
-        print(f"Found port \"{port.device}\" which is \"{port.description}\"", flush=True)
-        if "CFA635-USB" not in port.description:
-            continue
-        lcd = LCDWithID(port.device)
-        lcd.open()
+def probe_port(device: str) -> tuple[str, Optional[int], Optional[int], Optional[bytes]]:
+    lcd = LCDWithID(device)
+    lcd.open()
+    try:
         id, version = lcd.read_id_and_version()
+        splash = None
+        if id is not None and version == LCD_INITIAL_CONFIG_VERSION:
+            splash = splash_frame(lcd, id)
+            width = lcd.width()
+            for row in range(lcd.height()):
+                lcd.write(0, row, splash[row * width:(row + 1) * width])
+            # Same connection, so the stale LEDs go out with the splash instead of delaying the first frame
+            for idx in range(lcd.led_count()):
+                lcd.write_led(idx, 0, 0)
+            STARTUP.mark(f"splash on {device}")
+    finally:
         lcd.close()
-        if id is not None:
-            ports_by_id[id] = (port.device, version)
-        else:
-            ports_without_id.append(port.device)
+    return device, id, version, splash
 
-    def find_port_by_id(id: int):
-        if id in ports_by_id:
-            return ports_by_id[id]
-        return None, None
+class PortPool():
+    ports_by_id: dict[int, tuple[str, int, Optional[bytes]]]
+    ports_without_id: list[str]
+    _lock: Lock
 
-    def find_first_free_port():
-        if len(ports_without_id) < 1:
-            return None
-        return ports_without_id.pop(0)
+    def __init__(self):
+        self.ports_by_id = {}
+        self.ports_without_id = []
+        self._lock = Lock()
 
-    drivers = []
+    def find_port_by_id(self, id: int):
+        with self._lock:
+            if id in self.ports_by_id:
+                return self.ports_by_id[id]
+            return None, None, None
 
-    for config in CONFIG["displays"]:
-        id = config["id"]
-        name = config["name"]
-        port, version = find_port_by_id(id)
+    def find_first_free_port(self):
+        with self._lock:
+            if len(self.ports_without_id) < 1:
+                return None
+            return self.ports_without_id.pop(0)
+
+    def assign(self, display_config) -> tuple[Optional[str], Optional[bytes]]:
+        id = display_config["id"]
+        name = display_config["name"]
+        port, version, splash = self.find_port_by_id(id)
 
         if port is None:
             print(f"No port found for display {name} (ID {id}). Trying to find a free port.", flush=True)
-            port = find_first_free_port()
+            port = self.find_first_free_port()
             if port is None:
                 print("No free ports found, either!", flush=True)
-                return
+                return None, None
 
             print(f"Found free port {port}. Writing ID...", flush=True)
             lcd = LCDWithID(port)
@@ -82,16 +103,184 @@ def serve_core(override_glob: Optional[str]) -> None:
 
         if version != LCD_INITIAL_CONFIG_VERSION:
             initial_config(LCDWithID(port), id)
+            version = LCD_INITIAL_CONFIG_VERSION
+            splash = None
 
-        driver_config = config["driver"]
-        DriverClass = import_module(f"drivers.{driver_config['type']}", package=".").DRIVER
-        driver: LCDDriver = DriverClass(config=driver_config)
-        drivers.append(driver)
-        driver.set_port(port)
-        driver.start()
+        with self._lock:
+            # The splash is only on the display right after probing
+            self.ports_by_id[id] = (port, version, None)
+        return port, splash
+
+    def assign_all(self, display_config) -> Optional[list[tuple[str, Optional[bytes]]]]:
+        # The display's own LCD first, then any LCDs mirroring it
+        port, splash = self.assign(display_config)
+        if port is None:
+            return None
+        ports = [(port, splash)]
+        for mirror_id in display_config.get("mirror_ids", []):
+            mirror_port, mirror_splash = self.assign({"id": mirror_id, "name": f"{display_config['name']} mirror"})
+            if mirror_port is None:
+                print(f"No port for mirror ID {mirror_id} of display {display_config['name']}, running without it", flush=True)
+                continue
+            ports.append((mirror_port, mirror_splash))
+        return ports
+
+def discover_ports(override_glob: Optional[str]) -> PortPool:
+    with STARTUP.phase("port scan"):
+        ports = None
+        if override_glob:
+            from serial.tools.list_ports_linux import SysFS
+            ports = [SysFS(p) for p in glob(override_glob)]
+        else:
+            ports = comports()
+
+    devices = []
+    for port in ports:
+        print(f"Found port \"{port.device}\" which is \"{port.description}\"", flush=True)
+        if "CFA635-USB" not in port.description:
+            continue
+        devices.append(port.device)
+
+    pool = PortPool()
+    with ThreadPoolExecutor(max_workers=max(len(devices), 1), thread_name_prefix="LCD probe") as executor:
+        probes = [executor.submit(probe_port, device) for device in devices]
+
+        # Parse the config while the ports are being probed
+        with STARTUP.phase("config load"):
+            config.load()
+
+        with STARTUP.phase("port probe"):
+            for probe in probes:
+                device, id, version, splash = probe.result()
+                if id is not None:
+                    pool.ports_by_id[id] = (device, version, splash)
+                else:
+                    pool.ports_without_id.append(device)
+    return pool
+
+def create_driver(display_config, ports: list[tuple[str, Optional[bytes]]], mirror_server: Optional[MirrorServer] = None) -> LCDDriver:
+    driver_config = display_config["driver"]
+    DriverClass = import_module(f"drivers.{driver_config['type']}", package=".").DRIVER
+    driver: LCDDriver = DriverClass(config=driver_config)
+    driver.set_ports(ports)
+    if mirror_server is not None:
+        driver.mirror = mirror_server.add_display(display_config["id"], display_config["name"])
+    return driver
+
+def watch_config(apply_config, tick=None) -> None:
+    reload_requested = Event()
+    stop_requested = Event()
+    signal(SIGHUP, lambda signum, frame: reload_requested.set())
+
+    def request_stop(signum, frame):
+        stop_requested.set()
+        reload_requested.set()
+
+    # docker stop sends SIGTERM, which ends the loop like Ctrl-C so the caller can clean up
+    signal(SIGTERM, request_stop)
 
     while True:
         try:
-            sleep(1000)
+            reload_requested.wait(CONFIG_POLL_INTERVAL)
         except KeyboardInterrupt:
             break
+        if stop_requested.is_set():
+            break
+
+        if tick is not None:
+            tick()
+
+        if not reload_requested.is_set() and not config.changed_on_disk():
+            continue
+        reload_requested.clear()
+
+        try:
+            if not config.reload():
+                continue
+            print("Config changed, applying it", flush=True)
+            prometheus.configure(config.CONFIG.get("prometheus"))
+            apply_config(config.CONFIG["displays"])
+        except Exception:
+            print("Error reloading config, keeping the running one", flush=True)
+            print_exc()
+
+def serve_core(override_glob: Optional[str]) -> None:
+    port_pool = discover_ports(override_glob)
+    prometheus.configure(config.CONFIG.get("prometheus"))
+    memory_reporter = apply_low_footprint(config.CONFIG.get("low_footprint"))
+
+    if config.CONFIG.get("multiprocess", False):
+        from supervisor import serve_supervisor
+        serve_supervisor(port_pool, memory_reporter)
+        return
+
+    page_state.configure(config.CONFIG.get("page_state"))
+    mirror_server = create_mirror_server(config.CONFIG.get("mirror"))
+    if mirror_server is not None:
+        mirror_server.start()
+
+    # Display ID -> (display config, driver)
+    drivers: dict[int, tuple[dict, LCDDriver]] = {}
+
+    def start_display(display_config) -> bool:
+        ports = port_pool.assign_all(display_config)
+        if ports is None:
+            return False
+        driver = create_driver(display_config, ports, mirror_server)
+        drivers[display_config["id"]] = (display_config, driver)
+        driver.start()
+        return True
+
+    def stop_display(id: int) -> None:
+        _, driver = drivers.pop(id)
+        driver.stop()
+        if mirror_server is not None:
+            mirror_server.remove_display(id)
+
+    def apply_config(displays) -> None:
+        new_ids = set(display_config["id"] for display_config in displays)
+        for id in list(drivers.keys()):
+            if id not in new_ids:
+                print(f"Display ID {id} removed from config, stopping it", flush=True)
+                stop_display(id)
+
+        for display_config in displays:
+            id = display_config["id"]
+            if id not in drivers:
+                print(f"Display {display_config['name']} (ID {id}) added to config", flush=True)
+                start_display(display_config)
+                continue
+
+            old_config, driver = drivers[id]
+            if old_config == display_config:
+                continue
+
+            if old_config.get("mirror_ids") != display_config.get("mirror_ids"):
+                print(f"Mirrors of display {display_config['name']} (ID {id}) changed, restarting it", flush=True)
+                stop_display(id)
+                start_display(display_config)
+            elif old_config["driver"] == display_config["driver"]:
+                drivers[id] = (display_config, driver)
+            elif old_config["driver"]["type"] == display_config["driver"]["type"]:
+                print(f"Reconfiguring display {display_config['name']} (ID {id}) in place", flush=True)
+                driver.reconfigure(display_config["driver"])
+                drivers[id] = (display_config, driver)
+            else:
+                print(f"Driver type of display {display_config['name']} (ID {id}) changed, restarting it", flush=True)
+                stop_display(id)
+                start_display(display_config)
+
+    with STARTUP.phase("display start"):
+        displays = config.CONFIG["displays"]
+        with ThreadPoolExecutor(max_workers=max(len(displays), 1), thread_name_prefix="LCD start") as pool:
+            started = list(pool.map(start_display, displays))
+    if not all(started):
+        return
+
+    if memory_reporter is not None:
+        memory_reporter.rebase()
+        watch_config(apply_config, memory_reporter.tick)
+    else:
+        watch_config(apply_config)
+    # One last snapshot, so a restart picks up right where this left off
+    page_state.shutdown()
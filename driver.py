@@ -1,22 +1,40 @@
 from abc import ABC, abstractmethod
-from threading import Thread
-from time import sleep
-from lcd import LCD, LCDKey, LCDKeyEvent
+from threading import Event, Lock, Thread
+from typing import Optional
+from time import monotonic
+from histogram import LatencyHistogram
+from keys import KEY_LONG_PRESS, KEY_REPEAT_DELAY, KEY_REPEAT_INTERVAL
+from log import LOG
+from lcd import LCD, LCDFanReport, LCDKey, LCDKeyEvent, LCDTemperatureReport
+from mirror import FrameMirror
+from link import LinkBudget
+from output import LCDOutput, RegionPriority
 from utils import critical_call
-from renderable import DEFAULT_CHAR
-
-MIN_SPACING_BETWEEN_DIFFS = 5
-
-_MIN_SPACING_VAR = MIN_SPACING_BETWEEN_DIFFS - 1
 
 class LCDDriver(ABC):
     _lcd: LCD
     _should_run: bool
     _render_period: float
+    _record_dir: Optional[str]
+    _bandwidth_config: Optional[dict]
+    _keys_config: dict
     _render_thread: Thread
+    _outputs: list[LCDOutput]
+    _active_outputs: list[LCDOutput]
     _lines: list[str]
-    _lcd_mem_is: bytearray
-    _lcd_led_is: list[tuple[int, int]]
+    _render_wake: Event
+    _priority_key_time: Optional[float]
+    # Set on the key thread, taken on the render thread
+    _priority_lock: Lock
+
+    mirror: Optional[FrameMirror]
+    key_latency: LatencyHistogram
+    fan_rpm: dict[int, float]
+    temperatures: dict[int, float]
+    _fan_report_mask: int
+    _temperature_report_mask: int
+    _fan_report_handlers: list
+    _temperature_report_handlers: list
 
     lcd_width: int
     lcd_height: int
@@ -26,44 +44,176 @@ class LCDDriver(ABC):
     def __init__(self, config):
         self.lcd = None
         self._should_run = False
-        self._render_period = 1.0 / 30.0
-        if "render_period" in config:
-            self._render_period = config["render_period"]
         self._render_thread = None
+        self._outputs = []
+        self._active_outputs = []
         self._lines = []
         self._lcd = None
+        self._render_wake = Event()
+        self._priority_key_time = None
+        self._priority_lock = Lock()
+        self.mirror = None
+        self.key_latency = LatencyHistogram("key to frame")
+        self.fan_rpm = {}
+        self.temperatures = {}
+        self._fan_report_mask = 0
+        self._temperature_report_mask = 0
+        self._fan_report_handlers = []
+        self._temperature_report_handlers = []
+        self.reconfigure(config)
+
+    def reconfigure(self, config):
+        self._render_period = 1.0 / 30.0
+        if "render_period" in config:
+            self._render_period = config["render_period"]
+        self._record_dir = None
+        if "record_dir" in config:
+            self._record_dir = config["record_dir"]
+        self._bandwidth_config = None
+        if "bandwidth" in config:
+            self._bandwidth_config = config["bandwidth"]
+        self._keys_config = {}
+        if "keys" in config:
+            self._keys_config = config["keys"]
+        for output in self._outputs:
+            self._configure_output(output)
+
+    def _configure_output(self, output: LCDOutput):
+        output.render_period = self._render_period
+
+        keys = output.lcd.keys
+        keys.long_press = self._keys_config.get("long_press", KEY_LONG_PRESS)
+        keys.repeat_delay = self._keys_config.get("repeat_delay", KEY_REPEAT_DELAY)
+        keys.repeat_interval = self._keys_config.get("repeat_interval", KEY_REPEAT_INTERVAL)
+        keys.repeat_keys = set(LCDKey[name.upper()] for name in self._keys_config.get("repeat", []))
+
+        bandwidth = self._bandwidth_config
+        if bandwidth is None:
+            output.set_budget(None, [])
+            return
+
+        budget = LinkBudget(
+            bytes_per_second=bandwidth.get("bytes_per_second"),
+            commands_per_second=bandwidth.get("commands_per_second"),
+        )
+        if "burst" in bandwidth:
+            budget.burst = bandwidth["burst"]
+            budget.reset()
 
-    def set_port(self, port):
+        # The title row is high priority unless a region says otherwise
+        width = output.lcd_width
+        regions = [(0, width, RegionPriority.HIGH)]
+        for region in bandwidth.get("regions", []):
+            col = region.get("col", 0)
+            start = region["row"] * width + col
+            end = start + region.get("length", width - col)
+            regions.append((start, end, RegionPriority[region["priority"].upper()]))
+        output.set_budget(budget, regions)
+
+    def set_port(self, port, initial_frame: Optional[bytes] = None):
+        self.set_ports([(port, initial_frame)])
+
+    def set_ports(self, ports: list[tuple[str, Optional[bytes]]]):
+        # The first port is the primary: it sets the geometry and provides the sensors
         self.stop()
-        self._lcd = LCD(port)
-        self._lcd.register_key_event_handler(self._key_event_handler)
+        self._outputs = []
+        for port, initial_frame in ports:
+            lcd = LCD(port, record_dir=self._record_dir)
+            # Keys on any of the panels drive the shared pages
+            lcd.register_key_event_handler(self._key_event_handler)
+            output = LCDOutput(lcd, initial_frame, self.key_latency)
+            self._configure_output(output)
+            self._outputs.append(output)
+        self._lcd = self._outputs[0].lcd
+        self._lcd.register_fan_report_handler(self._fan_report_handler)
+        self._lcd.register_temperature_report_handler(self._temperature_report_handler)
 
     def start(self):
         self._lcd.open()
+        self._active_outputs = [self._outputs[0]]
+        for output in self._outputs[1:]:
+            try:
+                output.lcd.open()
+            except Exception:
+                # A missing mirrored panel must not take the primary down with it
+                LOG.exception("Could not open mirrored LCD, continuing without it", port=output.lcd.port)
+                continue
+            if (output.lcd_width, output.lcd_height) != (self._outputs[0].lcd_width, self._outputs[0].lcd_height):
+                LOG.info("Mirrored LCD has a different size than the primary, ignoring it", port=output.lcd.port)
+                output.lcd.close()
+                continue
+            self._active_outputs.append(output)
+        self._outputs[0].mirror = self.mirror
+
         self.lcd_width = self._lcd.width()
         self.lcd_height = self._lcd.height()
         self.lcd_led_count = self._lcd.led_count()
         self.lcd_change_max_len = self._lcd.max_write_len()
+        self._outputs[0].set_report_masks(self._fan_report_mask, self._temperature_report_mask)
         self._should_run = True
         self._render_thread = Thread(name=f"LCD render {self._lcd.port}", target=critical_call, args=(self._loop,), daemon=True)
         self._render_thread.start()
 
     def stop(self):
         self._should_run = False
+        self._render_wake.set()
 
         if self._render_thread is not None:
             self._render_thread.join()
             self._render_thread = None
 
-        if self._lcd is not None:
-            self._lcd.close()
+        for output in self._outputs:
+            output.lcd.close()
 
-    def _key_event_handler(self, key: LCDKey, event: LCDKeyEvent):
+    def _key_event_handler(self, key: LCDKey, event: LCDKeyEvent, received_at: float):
         if event == LCDKeyEvent.PRESSED:
             self.on_key_down(key=key)
             self.on_key_press(key=key)
+        elif event == LCDKeyEvent.REPEAT:
+            self.on_key_press(key=key)
+        elif event == LCDKeyEvent.LONG_PRESS:
+            self.on_key_long_press(key=key)
         elif event == LCDKeyEvent.RELEASED:
             self.on_key_up(key=key)
+        # Latency counts from when the reader saw the key, including any queueing
+        self.request_priority_frame(received_at)
+
+    def request_priority_frame(self, key_time: float = None):
+        if key_time is None:
+            key_time = monotonic()
+        with self._priority_lock:
+            if self._priority_key_time is None:
+                self._priority_key_time = key_time
+        self._render_wake.set()
+
+    def request_sensor_reports(self, fan_mask: int = 0, temperature_mask: int = 0):
+        # Only recorded here: the primary's transmit thread sends them, so pages never touch the serial line
+        self._fan_report_mask |= fan_mask
+        self._temperature_report_mask |= temperature_mask
+        if self._outputs:
+            self._outputs[0].set_report_masks(self._fan_report_mask, self._temperature_report_mask)
+
+    def register_fan_report_handler(self, handler):
+        self._fan_report_handlers.append(handler)
+
+    def unregister_fan_report_handler(self, handler):
+        self._fan_report_handlers.remove(handler)
+
+    def register_temperature_report_handler(self, handler):
+        self._temperature_report_handlers.append(handler)
+
+    def unregister_temperature_report_handler(self, handler):
+        self._temperature_report_handlers.remove(handler)
+
+    def _fan_report_handler(self, report: LCDFanReport):
+        self.fan_rpm[report.fan] = report.rpm()
+        for handler in self._fan_report_handlers:
+            handler(report=report)
+
+    def _temperature_report_handler(self, report: LCDTemperatureReport):
+        self.temperatures[report.sensor] = report.celsius
+        for handler in self._temperature_report_handlers:
+            handler(report=report)
 
     def on_key_down(self, key: LCDKey):
         pass
@@ -74,82 +224,50 @@ class LCDDriver(ABC):
     def on_key_press(self, key: LCDKey):
         pass
 
-    def _loop(self):
-        self._lcd.clear()
-        for i in range(self.lcd_led_count):
-            self._lcd.write_led(i, 0, 0)
+    def on_key_long_press(self, key: LCDKey):
+        pass
 
-        self.lcd_pixel_count = self.lcd_width * self.lcd_height
-        self._lcd_mem_is = bytearray(self.lcd_pixel_count)
-        for i in range(self.lcd_pixel_count):
-            self._lcd_mem_is[i] = DEFAULT_CHAR
+    # Totals over all panels, read like the counters on each output
+    @property
+    def frames_dropped(self) -> int:
+        return sum(output.frames_dropped for output in self._outputs)
+
+    @property
+    def frames_preempted(self) -> int:
+        return sum(output.frames_preempted for output in self._outputs)
 
-        self._lcd_led_is = [(0, 0)] * self.lcd_led_count
+    @property
+    def changes_deferred(self) -> int:
+        return sum(output.changes_deferred for output in self._outputs)
 
+    def _loop(self):
+        self.lcd_pixel_count = self.lcd_width * self.lcd_height
         self.render_init()
 
+        for output in self._active_outputs:
+            output.start()
+
         while self._should_run:
-            data, leds = self.render()
+            with self._priority_lock:
+                key_time = self._priority_key_time
+                self._priority_key_time = None
 
-            if data is not None:
-                self._render_send_display(data)
-            if leds is not None:
-                self._render_send_leds(leds)
+            data, leds, damage = self.render(force=False)
 
-            sleep(self._render_period)
+            if data is not None or leds is not None:
+                # Rendered once, every panel diffs it against its own shadow
+                for output in self._active_outputs:
+                    output.put(data, leds, damage, key_time)
 
-        self._lcd.close()
+            self._render_wake.wait(self._render_period)
+            self._render_wake.clear()
 
-    def _render_send_leds(self, leds: list[tuple[int, int]]):
-        for idx, (red, green) in enumerate(leds):
-            old_red, old_green = self._lcd_led_is[idx]
-            if old_red == red and old_green == green:
-                continue
-            self._lcd.write_led(idx, red, green)
-            self._lcd_led_is[idx] = (red, green)
-
-    def _render_send_display(self, data: bytearray):
-        data = data.copy()
-
-        changes: list[tuple[int, int]] = []
-
-        change_start = -1
-        change_end = -1
-        for i in range(self.lcd_pixel_count):
-            diff = self._lcd_mem_is[i] != data[i]
-            if diff:
-                if change_start < 0:
-                    change_start = i
-                elif i - change_start >= self.lcd_change_max_len:
-                    if change_end < 0:
-                        change_end = i
-                    changes.append((change_start, change_end))
-                    change_start = i
-                    change_end = -1
-                elif change_end >= 0:
-                    change_end = -1
-            elif change_start >= 0:
-                if change_end < 0:
-                    change_end = i
-                
-                if i - change_end >= _MIN_SPACING_VAR:
-                    changes.append((change_start, change_end))
-                    change_start = -1
-                    change_end = -1
-
-        if change_start >= 0:
-            if change_end < 0:
-                change_end = self.lcd_pixel_count
-            changes.append((change_start, change_end))
-
-        for start, end in changes:
-            self._lcd.write(start % self.lcd_width, start // self.lcd_width, data[start:end])
-
-        self._lcd_mem_is = data
+        for output in self._active_outputs:
+            output.stop()
 
     def render_init(self):
         pass
 
     @abstractmethod
-    def render(self, force=True) -> tuple[bytearray, list[tuple[int, int]]]:
+    def render(self, force=True) -> tuple[bytes, tuple[tuple[int, int], ...], Optional[list[tuple[int, int]]]]:
         pass
@@ -1,5 +1,6 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
+from threading import Lock
 from importlib import import_module
 from driver import LCDDriver
 from datetime import timedelta, datetime
@@ -10,29 +11,70 @@ if TYPE_CHECKING:
 class PagedLCDDriver(LCDDriver):
     current_page: int
     pages: list[LCDPage]
+    page_configs: list[dict]
     auto_cycle_time: timedelta
     last_cycle_time: datetime
     page_changed: bool
+    # The page and generation the last render was based on
+    _rendered: Optional[tuple[LCDPage, int]]
+    _page_lock: Lock
 
     def __init__(self, config):
+        self.pages = []
+        self.page_configs = []
+        self.current_page = 0
+        self.page_changed = True
+        self._rendered = None
+        self._page_lock = Lock()
         super().__init__(config)
+        self.last_cycle_time = datetime.now()
+
+    def reconfigure(self, config):
+        super().reconfigure(config)
         auto_cycle_time = 5
         if "auto_cycle_time" in config:
             auto_cycle_time = config["auto_cycle_time"]
 
-        pages = config["pages"]
-        self.pages = []
-        for config in pages:
-            PageClass = import_module(f"pages.{config['type']}", package=".").PAGE
-            self.pages.append(PageClass(driver=self, config=config))
-
-        self.current_page = 0
-
         if auto_cycle_time > 0:
             self.auto_cycle_time = timedelta(seconds=auto_cycle_time)
         else:
             self.auto_cycle_time = None
-        self.last_cycle_time = datetime.now()
+
+        # Pages whose config did not change are kept, along with their threads and data
+        old_pages = list(zip(self.page_configs, self.pages))
+        pages = []
+        page_configs = []
+        for page_config in config["pages"]:
+            page = None
+            for idx, (old_config, old_page) in enumerate(old_pages):
+                if old_config == page_config:
+                    page = old_page
+                    old_pages.pop(idx)
+                    break
+            if page is None:
+                PageClass = import_module(f"pages.{page_config['type']}", package=".").PAGE
+                page = PageClass(driver=self, config=page_config)
+                if self._should_run:
+                    page.start()
+            pages.append(page)
+            page_configs.append(page_config)
+
+        current = None
+        if self.pages:
+            current = self.pages[self.current_page % len(self.pages)]
+
+        self.page_configs = page_configs
+        if current in pages:
+            with self._page_lock:
+                self.pages = pages
+                self.current_page = pages.index(current)
+        else:
+            with self._page_lock:
+                self.pages = pages
+            self.set_page(self.current_page)
+
+        for _, page in old_pages:
+            page.stop()
 
     def start(self):
         super().start()
@@ -53,9 +95,11 @@ class PagedLCDDriver(LCDDriver):
             return
 
     def set_page(self, page: int):
-        self.last_cycle_time = datetime.now()
-        self.current_page = page % len(self.pages)
-        self.page_changed = True
+        # Runs on the key thread, so it must not come between render's reads of these
+        with self._page_lock:
+            self.last_cycle_time = datetime.now()
+            self.current_page = page % len(self.pages)
+            self.page_changed = True
 
     def next_page(self):
         self.set_page(self.current_page + 1)
@@ -66,11 +110,26 @@ class PagedLCDDriver(LCDDriver):
     def render(self, force=True):
         if self.auto_cycle_time is not None and datetime.now() - self.last_cycle_time > self.auto_cycle_time:
             self.next_page()
-        page = self.pages[self.current_page]
-        if page.dirty or self.page_changed or force:
-            page.dirty = False
+        with self._page_lock:
+            page = self.pages[self.current_page % len(self.pages)]
+            page_changed = self.page_changed
             self.page_changed = False
-            return page.lcd_mem_set, page.lcd_led_set
-        return None, None
+
+        frame = page.front()
+        if frame is None:
+            if page_changed:
+                # Nothing drawn yet, so the page still needs a full frame
+                with self._page_lock:
+                    self.page_changed = True
+            return None, None, None
+        data, leds, generation = frame
+        if page_changed or force or self._rendered is None or self._rendered[0] is not page:
+            damage = None
+        elif generation != self._rendered[1]:
+            damage = page.damage_since(self._rendered[1])
+        else:
+            return None, None, None
+        self._rendered = (page, generation)
+        return data, leds, damage
 
 DRIVER = PagedLCDDriver
@@ -0,0 +1,148 @@
+from dataclasses import dataclass, field
+from typing import Iterable
+from time import monotonic
+from prometheus import PrometheusDeadlineExceeded, fetch_with_last_good, query_timeout
+
+EXPORTER_CHUNK_SIZE = 16384
+
+@dataclass
+class MetricSelector():
+    name: str
+    labels: dict[str, str] = field(default_factory=dict)
+    first_only: bool = True
+
+    def matches(self, labels: dict[str, str]) -> bool:
+        for label, value in self.labels.items():
+            if labels.get(label) != value:
+                return False
+        return True
+
+Sample = tuple[dict[str, str], float]
+
+def _parse_labels(line: bytes, start: int) -> tuple[dict[str, str], int]:
+    labels = {}
+    i = start
+    line_len = len(line)
+    while i < line_len:
+        c = line[i]
+        if c == 0x7D: # }
+            return labels, i + 1
+        if c == 0x2C or c == 0x20: # , or space
+            i += 1
+            continue
+        eq = line.index(b"=", i)
+        name = line[i:eq].strip().decode("utf-8")
+        # Opening quote follows the equals sign
+        i = eq + 2
+        value = bytearray()
+        while line[i] != 0x22: # "
+            if line[i] == 0x5C: # backslash
+                i += 1
+                escaped = line[i]
+                value.append(0x0A if escaped == 0x6E else escaped) # \n
+            else:
+                value.append(line[i])
+            i += 1
+        labels[name] = value.decode("utf-8")
+        i += 1
+    raise ValueError("Unterminated label set")
+
+def parse_exposition(lines: Iterable[bytes], selectors: dict[str, MetricSelector]) -> dict[str, list[Sample]]:
+    results: dict[str, list[Sample]] = {key: [] for key in selectors}
+
+    by_name: dict[bytes, list[tuple[str, MetricSelector]]] = {}
+    for key, selector in selectors.items():
+        by_name.setdefault(selector.name.encode("utf-8"), []).append((key, selector))
+    # Selectors that only want one value stop mattering once they have it
+    remaining = sum(1 for selector in selectors.values() if selector.first_only)
+    has_map_selectors = remaining < len(selectors)
+
+    for line in lines:
+        if not line or line[0] == 0x23: # comment
+            continue
+
+        name_end = len(line)
+        brace = line.find(b"{")
+        space = line.find(b" ")
+        if brace >= 0 and (space < 0 or brace < space):
+            name_end = brace
+        elif space >= 0:
+            name_end = space
+
+        # Cheap skip: most lines belong to metrics nobody asked for
+        wanted = by_name.get(line[:name_end])
+        if wanted is None:
+            continue
+
+        labels = {}
+        value_start = name_end
+        if name_end == brace:
+            labels, value_start = _parse_labels(line, brace + 1)
+        value_fields = line[value_start:].split()
+        if not value_fields:
+            continue
+        value = float(value_fields[0])
+
+        for key, selector in wanted:
+            if selector.first_only and results[key]:
+                continue
+            if not selector.matches(labels):
+                continue
+            results[key].append((labels, value))
+            if selector.first_only:
+                remaining -= 1
+
+        if remaining == 0 and not has_map_selectors:
+            break
+
+    return results
+
+def _lines_until(res, deadline: float) -> Iterable[bytes]:
+    # The request timeout limits each read, this limits the whole stream. read1 returns
+    # whatever one read brings, so a slowly dripping exporter cannot hold a chunk open.
+    sock = getattr(getattr(res.raw, "connection", None), "sock", None)
+    pending = b""
+    while True:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise PrometheusDeadlineExceeded("Exporter scrape did not finish within the update deadline")
+        if sock is not None:
+            sock.settimeout(remaining)
+        chunk = res.raw.read1(EXPORTER_CHUNK_SIZE, decode_content=True)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+def _scrape_exporter(url: str, selectors: dict[str, MetricSelector]) -> dict[str, list[Sample]]:
+    # requests is slow to import, so only pay for it once a page actually scrapes
+    from requests import get
+    timeout = query_timeout()
+    deadline = monotonic() + timeout
+    with get(url, timeout=timeout, stream=True) as res:
+        res.raise_for_status()
+        return parse_exposition(_lines_until(res, deadline), selectors)
+
+def scrape_exporter(url: str, selectors: dict[str, MetricSelector]) -> dict[str, list[Sample]]:
+    # Same fallback as Prometheus queries: one failed scrape keeps the last good samples on screen
+    key = f"exporter {url} " + repr(sorted((name, selector.name, sorted(selector.labels.items()), selector.first_only) for name, selector in selectors.items()))
+    return fetch_with_last_good(key, lambda: _scrape_exporter(url, selectors))
+
+def scrape_exporter_values(url: str, selectors: dict[str, MetricSelector]) -> dict[str, float]:
+    results = scrape_exporter(url, selectors)
+    values = {}
+    for key, samples in results.items():
+        if not samples:
+            raise KeyError(f"No sample for {selectors[key].name}{selectors[key].labels} at {url}")
+        values[key] = samples[0][1]
+    return values
+
+def samples_map_by(samples: list[Sample], attrib: str = "name") -> dict[str, float]:
+    results = {}
+    for labels, value in samples:
+        if attrib in labels:
+            results[labels[attrib]] = value
+    return results
@@ -0,0 +1,252 @@
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from random import Random
+from re import compile as re_compile
+from sys import exc_info
+from threading import Lock, Thread
+from time import sleep, time
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+from yaml import safe_load
+
+FAKE_PROMETHEUS_HOST = "127.0.0.1"
+FAKE_PROMETHEUS_PORT = 9090
+# How often the scripted values advance, like a scrape interval
+FAKE_PROMETHEUS_STEP = 15.0
+FAKE_PROMETHEUS_MAX_POINTS = 11000
+# Hundreds of pages connect at once in loadbench, the default backlog of 5 would refuse most of them
+FAKE_PROMETHEUS_BACKLOG = 1024
+
+_METRIC_RE = re_compile(r"[a-zA-Z_:][a-zA-Z0-9_:]*")
+_SELECTOR_RE = re_compile(r"\{([^}]*)\}")
+_MATCHER_RE = re_compile(r"([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*\"([^\"]*)\"")
+
+# Every metric the built-in pages query, with values that keep their LEDs moving
+DEFAULT_SERIES = {
+    "ping_average_response_ms": [
+        {"labels": {"name": "internet"}, "values": [12.0, 14.5, 11.2, 60.0]},
+        {"labels": {"name": "wired"}, "values": [0.4, 0.5, 0.4, 0.6]},
+        {"labels": {"name": "lte"}, "values": [45.0, 52.0, 120.0, 48.0]},
+    ],
+    "ping_percent_packet_loss": [
+        {"labels": {"name": "internet"}, "values": [0.0, 0.0, 10.0, 0.0]},
+        {"labels": {"name": "wired"}, "values": [0.0]},
+        {"labels": {"name": "lte"}, "values": [0.0, 2.0]},
+    ],
+    "node_timex_estimated_error_seconds": [{"values": [0.000012, 0.000015, 0.000011]}],
+    "node_timex_frequency_adjustment_ratio": [{"values": [1.0000012, 0.9999991]}],
+    "node_ntp_stratum": [{"values": [1.0, 2.0]}],
+    "node_ntp_sanity": [{"values": [1.0]}],
+    "modem_signal_lte_rsrp": [{"values": [-95.0, -101.0, -110.0]}],
+    "modem_signal_lte_rsrq": [{"values": [-9.0, -12.0]}],
+    "modem_signal_lte_rssi": [{"values": [-65.0, -70.0]}],
+    "modem_signal_lte_snr": [{"values": [12.0, 4.0, 18.0]}],
+    "node_network_receive_bytes_total": [{"values": [512.0 * 1024 * 1024, 1900.0 * 1024 * 1024]}],
+    "node_network_transmit_bytes_total": [{"values": [64.0 * 1024 * 1024, 80.0 * 1024 * 1024]}],
+    "snmp_upsAdvOutputActivePower": [{"values": [420.0, 455.0, 610.0]}],
+    "snmp_upsAdvBatteryRunTimeRemaining": [{"values": [216000.0, 210000.0]}],
+    "snmp_upsHighPrecBatteryCapacity": [{"values": [100.0, 98.5]}],
+    "snmp_upsAdvOutputApparentPower": [{"values": [480.0, 520.0, 700.0]}],
+    "snmp_upsHighPrecInputLineVoltage": [{"values": [230.1, 228.4, 231.0]}],
+    "snmp_upsHighPrecOutputVoltage": [{"values": [230.0]}],
+}
+
+def _selector_labels(query: str, metric_end: int) -> dict[str, str]:
+    match = _SELECTOR_RE.match(query, metric_end)
+    if match is None:
+        return {}
+    return dict(_MATCHER_RE.findall(match.group(1)))
+
+# Not a PromQL engine: a query answers with the scripted series of the first
+# metric it names, narrowed down by that metric's label matchers. Arithmetic,
+# functions and comparisons are ignored, which is enough to drive the pages.
+class FakePrometheus():
+    series: dict[str, list[dict]]
+    step: float
+    latency: float
+    jitter: float
+    error_rate: float
+    queries: int
+    errors: int
+    _lock: Lock
+    _random: Random
+
+    def __init__(self, series: dict[str, list[dict]] = None, step: float = FAKE_PROMETHEUS_STEP, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.series = DEFAULT_SERIES if series is None else series
+        self.step = step
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.queries = 0
+        self.errors = 0
+        self._lock = Lock()
+        self._random = Random(seed)
+
+    def _select(self, query: str) -> list[tuple[dict[str, str], list[float]]]:
+        for match in _METRIC_RE.finditer(query):
+            name = match.group(0)
+            if name not in self.series:
+                continue
+            matchers = _selector_labels(query, match.end())
+            selected = []
+            for series in self.series[name]:
+                labels = series.get("labels", {})
+                if any(label in labels and labels[label] != value for label, value in matchers.items()):
+                    continue
+                # Scripted series without a label stand in for any value of it
+                selected.append(({"__name__": name, **matchers, **labels}, series["values"]))
+            return selected
+        return []
+
+    def _value_at(self, values: list[float], at: float) -> str:
+        return str(values[int(at // self.step) % len(values)])
+
+    def query(self, query: str, at: Optional[float] = None) -> dict:
+        if at is None:
+            at = time()
+        return {
+            "resultType": "vector",
+            "result": [{"metric": labels, "value": [at, self._value_at(values, at)]} for labels, values in self._select(query)],
+        }
+
+    def query_range(self, query: str, start: float, end: float, step: float) -> dict:
+        if step <= 0 or (end - start) / step > FAKE_PROMETHEUS_MAX_POINTS:
+            raise ValueError("exceeded maximum resolution of 11,000 points per timeseries")
+        points = []
+        at = start
+        while at <= end:
+            points.append(at)
+            at += step
+        return {
+            "resultType": "matrix",
+            "result": [{"metric": labels, "values": [[at, self._value_at(values, at)] for at in points]} for labels, values in self._select(query)],
+        }
+
+    def delay(self) -> float:
+        with self._lock:
+            return max(self.latency + self._random.uniform(-self.jitter, self.jitter), 0.0)
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            self.queries += 1
+            if self.error_rate > 0 and self._random.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"queries": self.queries, "errors": self.errors}
+
+class _FakePrometheusRequestHandler(BaseHTTPRequestHandler):
+    server: "FakePrometheusServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        self._handle(url.path, parse_qs(url.query))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        params.update(parse_qs(self.rfile.read(length).decode("utf-8")))
+        self._handle(url.path, params)
+
+    def _handle(self, path: str, params: dict[str, list[str]]):
+        prometheus = self.server.prometheus
+        if path == "/stats":
+            self._reply(200, prometheus.stats())
+            return
+        if path not in ("/api/v1/query", "/api/v1/query_range"):
+            self._reply(404, {"status": "error", "errorType": "not_found", "error": f"unknown path {path}"})
+            return
+        if "query" not in params:
+            self._reply(400, {"status": "error", "errorType": "bad_data", "error": "missing query"})
+            return
+
+        sleep(prometheus.delay())
+        if prometheus.should_fail():
+            self._reply(503, {"status": "error", "errorType": "unavailable", "error": "injected failure"})
+            return
+
+        query = params["query"][0]
+        try:
+            if path == "/api/v1/query":
+                at = float(params["time"][0]) if "time" in params else None
+                data = prometheus.query(query, at)
+            else:
+                data = prometheus.query_range(query, float(params["start"][0]), float(params["end"][0]), float(params["step"][0]))
+        except (KeyError, ValueError) as e:
+            self._reply(400, {"status": "error", "errorType": "bad_data", "error": str(e)})
+            return
+        self._reply(200, {"status": "success", "data": data})
+
+    def _reply(self, status: int, payload: dict):
+        body = dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class FakePrometheusServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = FAKE_PROMETHEUS_BACKLOG
+    prometheus: FakePrometheus
+    _thread: Optional[Thread]
+
+    def __init__(self, prometheus: FakePrometheus, host: str = FAKE_PROMETHEUS_HOST, port: int = FAKE_PROMETHEUS_PORT):
+        super().__init__((host, port), _FakePrometheusRequestHandler)
+        self.prometheus = prometheus
+        self._thread = None
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up on a slow or injected-slow answer are part of the test
+        if isinstance(exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/api/v1/query"
+
+    def start(self) -> None:
+        self._thread = Thread(name="Fake Prometheus", target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+def load_series(path: str) -> dict[str, list[dict]]:
+    with open(path, "r") as f:
+        return safe_load(f)["series"]
+
+def main():
+    parser = ArgumentParser(description="Serve scripted metrics on the Prometheus query API subset the pages use")
+    parser.add_argument("--host", default=FAKE_PROMETHEUS_HOST)
+    parser.add_argument("--port", type=int, default=FAKE_PROMETHEUS_PORT)
+    parser.add_argument("--series", help="YAML file with a top-level series map, replacing the built-in one")
+    parser.add_argument("--step", type=float, default=FAKE_PROMETHEUS_STEP, help="Seconds between scripted values")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Latency varies by up to this many seconds either way")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of queries answered with a 503")
+    args = parser.parse_args()
+
+    series = None
+    if args.series:
+        series = load_series(args.series)
+    prometheus = FakePrometheus(series, step=args.step, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    server = FakePrometheusServer(prometheus, args.host, args.port)
+    print(f"Serving fake Prometheus on {server.url()}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+from threading import Lock
+
+# Bucket upper bounds in seconds, roughly doubling from 0.5ms to ~16s
+HISTOGRAM_BOUNDS = [0.0005 * (2 ** i) for i in range(16)]
+
+class LatencyHistogram():
+    name: str
+    bounds: list[float]
+    counts: list[int]
+    count: int
+    total: float
+    max: float
+    _lock: Lock
+
+    def __init__(self, name: str, bounds: list[float] = HISTOGRAM_BOUNDS):
+        self.name = name
+        self.bounds = bounds
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        idx = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if seconds <= bound:
+                idx = i
+                break
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, pct: float) -> float:
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            target = self.count * pct / 100.0
+            seen = 0
+            for i, count in enumerate(self.counts):
+                seen += count
+                if seen >= target:
+                    if i < len(self.bounds):
+                        return min(self.bounds[i], self.max)
+                    return self.max
+            return self.max
+
+    def mean(self) -> float:
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            return self.total / self.count
+
+    def __str__(self):
+        return f"{self.name}: n={self.count} mean={self.mean() * 1000:.1f}ms p50<={self.percentile(50) * 1000:.1f}ms p99<={self.percentile(99) * 1000:.1f}ms max={self.max * 1000:.1f}ms"
@@ -0,0 +1,231 @@
+from collections import deque
+from enum import Enum
+from threading import Condition, Thread
+from time import monotonic
+from typing import Callable, Optional
+from histogram import LatencyHistogram
+from log import LOG
+
+KEY_QUEUE_SIZE = 32
+KEY_LONG_PRESS = 0.8
+KEY_REPEAT_DELAY = 0.5
+KEY_REPEAT_INTERVAL = 0.2
+
+class LCDKeyEvent(Enum):
+    PRESSED = 0
+    RELEASED = 1
+    LONG_PRESS = 2
+    REPEAT = 3
+
+class KeyDispatcher():
+    name: str
+    long_press: Optional[float]
+    repeat_delay: float
+    repeat_interval: float
+    repeat_keys: Optional[set]
+    handler_latency: LatencyHistogram
+    events_dropped: int
+    events_coalesced: int
+    # Replay drives the dispatcher from the recording's clock, without the thread
+    synchronous: bool
+    clock: Callable[[], float]
+    _handlers: list
+    # key, event, received at
+    _queue: deque
+    _cond: Condition
+    _should_run: bool
+    _busy: bool
+    _thread: Optional[Thread]
+    # key -> [pressed at, next repeat at, long press sent]
+    _held: dict
+    # Keys whose RELEASED fell out of a full queue, forgotten before the next batch
+    _released_dropped: set
+    # Keys whose press was coalesced or dropped, so their next RELEASED goes too
+    _skip_release: set
+
+    def __init__(self, name: str, handlers: list):
+        self.name = name
+        self.long_press = KEY_LONG_PRESS
+        self.repeat_delay = KEY_REPEAT_DELAY
+        self.repeat_interval = KEY_REPEAT_INTERVAL
+        # Keys that auto-repeat while held, none unless configured; None would repeat every key
+        self.repeat_keys = set()
+        self.handler_latency = LatencyHistogram("key handler")
+        self.events_dropped = 0
+        self.events_coalesced = 0
+        self.synchronous = False
+        self.clock = monotonic
+        self._handlers = handlers
+        self._queue = deque()
+        self._cond = Condition()
+        self._should_run = False
+        self._busy = False
+        self._thread = None
+        self._held = {}
+        self._released_dropped = set()
+        self._skip_release = set()
+
+    def start(self) -> None:
+        self.stop()
+        self._should_run = True
+        self._held = {}
+        self._released_dropped = set()
+        self._skip_release = set()
+        self._thread = Thread(name=f"LCD keys {self.name}", target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._should_run = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, key, event: LCDKeyEvent, received_at: float = None) -> None:
+        # Called on the reader thread, so this only ever queues unless replay made it synchronous
+        if received_at is None:
+            received_at = self.clock()
+        if self.synchronous:
+            self.advance(received_at)
+            self._track(key, event, received_at)
+            self._dispatch(key, event, received_at)
+            return
+        with self._cond:
+            if event == LCDKeyEvent.RELEASED and key in self._skip_release:
+                self._skip_release.discard(key)
+                return
+            if self._queue and self._queue[-1][0] == key and self._queue[-1][1] == event:
+                # The handlers have not caught up, a repeat of the same event adds nothing
+                self.events_coalesced += 1
+                return
+            if event == LCDKeyEvent.PRESSED and self._tap_queued(key):
+                # Still busy with the last tap of this key, so this press and its release add nothing
+                self.events_coalesced += 1
+                self._skip_release.add(key)
+                return
+            if len(self._queue) >= KEY_QUEUE_SIZE:
+                self._drop_oldest()
+            self._queue.append((key, event, received_at))
+            self._cond.notify()
+
+    def _tap_queued(self, key) -> bool:
+        # Whether the last queued events of this key are a complete press and release
+        released = False
+        for queued_key, event, _ in reversed(self._queue):
+            if queued_key != key:
+                continue
+            if released:
+                return event == LCDKeyEvent.PRESSED
+            if event != LCDKeyEvent.RELEASED:
+                return False
+            released = True
+        return False
+
+    def _drop_oldest(self) -> None:
+        # A lost press only costs one action, a lost release would leave the key held and repeating
+        self.events_dropped += 1
+        for idx, (key, event, _) in enumerate(self._queue):
+            if event == LCDKeyEvent.RELEASED:
+                continue
+            del self._queue[idx]
+            if event == LCDKeyEvent.PRESSED:
+                # Handlers must not see a key go up that they never saw go down
+                for release_idx in range(idx, len(self._queue)):
+                    if self._queue[release_idx][0] == key and self._queue[release_idx][1] == LCDKeyEvent.RELEASED:
+                        del self._queue[release_idx]
+                        break
+                else:
+                    self._skip_release.add(key)
+            return
+        key, _, _ = self._queue.popleft()
+        self._released_dropped.add(key)
+
+    def advance(self, now: float) -> None:
+        # Synchronous mode: every timer due by now fires at its own time, in order
+        while True:
+            next_timer = self._next_timer()
+            if next_timer is None or next_timer > now:
+                return
+            for key, event, at in self._timers_due(next_timer):
+                self._dispatch(key, event, at)
+
+    def drain(self, timeout: float = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._busy, timeout=timeout)
+
+    def _repeats(self, key) -> bool:
+        return self.repeat_keys is None or key in self.repeat_keys
+
+    def _next_timer(self) -> Optional[float]:
+        next_at = None
+        for key, (pressed_at, repeat_at, long_press_sent) in self._held.items():
+            if self.long_press is not None and not long_press_sent:
+                at = pressed_at + self.long_press
+                if next_at is None or at < next_at:
+                    next_at = at
+            if repeat_at is not None and (next_at is None or repeat_at < next_at):
+                next_at = repeat_at
+        return next_at
+
+    def _timers_due(self, now: float) -> list[tuple[object, LCDKeyEvent, float]]:
+        events = []
+        for key, held in self._held.items():
+            pressed_at, repeat_at, long_press_sent = held
+            if self.long_press is not None and not long_press_sent and now >= pressed_at + self.long_press:
+                held[2] = True
+                events.append((key, LCDKeyEvent.LONG_PRESS, now))
+            if repeat_at is not None and now >= repeat_at:
+                # Skip missed repeats instead of firing a burst of them
+                while held[1] <= now:
+                    held[1] += self.repeat_interval
+                events.append((key, LCDKeyEvent.REPEAT, now))
+        return events
+
+    def _track(self, key, event: LCDKeyEvent, received_at: float) -> None:
+        if event == LCDKeyEvent.PRESSED:
+            repeat_at = None
+            if self._repeats(key):
+                repeat_at = received_at + self.repeat_delay
+            self._held[key] = [received_at, repeat_at, False]
+        elif event == LCDKeyEvent.RELEASED:
+            self._held.pop(key, None)
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while self._should_run and not self._queue:
+                    next_timer = self._next_timer()
+                    timeout = None
+                    if next_timer is not None:
+                        timeout = next_timer - self.clock()
+                        if timeout <= 0:
+                            break
+                    self._cond.wait(timeout)
+                if not self._should_run:
+                    return
+                events = list(self._queue)
+                self._queue.clear()
+                released_dropped = self._released_dropped
+                self._released_dropped = set()
+                self._busy = True
+
+            for key in released_dropped:
+                self._held.pop(key, None)
+            for key, event, received_at in events:
+                self._track(key, event, received_at)
+                self._dispatch(key, event, received_at)
+            for key, event, received_at in self._timers_due(self.clock()):
+                self._dispatch(key, event, received_at)
+
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def _dispatch(self, key, event: LCDKeyEvent, received_at: float) -> None:
+        for handler in self._handlers:
+            try:
+                handler(key=key, event=event, received_at=received_at)
+            except Exception:
+                LOG.exception("Error in key event handler", port=self.name, handler=handler)
+        self.handler_latency.record(self.clock() - received_at)
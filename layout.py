@@ -0,0 +1,106 @@
+from dataclasses import dataclass
+from re import compile as re_compile
+from string import Formatter
+from typing import Any, Callable, Optional
+from renderable import Renderable
+
+LAYOUT_OVERFLOW_CHAR = "#"
+
+_SPEC_WIDTH_RE = re_compile(r"^(?:.?[<>=^])?[+\- ]?#?0?(\d+)")
+
+_FIELD_TYPES: dict[str, Callable[[Any], Any]] = {
+    "": str,
+    "s": str,
+    "d": int,
+    "n": float,
+    "f": float,
+    "F": float,
+    "e": float,
+    "E": float,
+    "g": float,
+    "G": float,
+    "%": float,
+}
+
+@dataclass
+class LayoutField():
+    name: str
+    row: int
+    col: int
+    width: int
+    spec: str
+    convert: Callable[[Any], Any]
+
+    def format(self, value) -> str:
+        text = format(self.convert(value), self.spec)
+        if len(text) > self.width:
+            return LAYOUT_OVERFLOW_CHAR * self.width
+        return text.rjust(self.width)
+
+def layout_rows(templates: Optional[dict]) -> dict[int, str]:
+    # YAML gives 1: and "1": as different keys, but they are the same row
+    if templates is None:
+        return {}
+    return {int(row): template for row, template in templates.items()}
+
+class Layout():
+    background: dict[int, str]
+    fields: dict[str, LayoutField]
+    _values: dict[str, Any]
+    _drawn: bool
+
+    def __init__(self, templates: dict[int, str], width: int):
+        self.background = {}
+        self.fields = {}
+        self._values = {}
+        self._drawn = False
+
+        formatter = Formatter()
+        for row, template in templates.items():
+            row = int(row)
+            line = ""
+            for literal, name, spec, conversion in formatter.parse(template):
+                line += literal
+                if name is None:
+                    continue
+                if conversion is not None:
+                    raise ValueError(f"Layout field \"{name}\" may not use conversions")
+                if name in self.fields:
+                    raise ValueError(f"Duplicate layout field \"{name}\"")
+                width_match = _SPEC_WIDTH_RE.match(spec)
+                if width_match is None:
+                    raise ValueError(f"Layout field \"{name}\" needs a fixed width")
+                field_type = spec[-1:] if not spec[-1:].isdigit() else ""
+                if field_type not in _FIELD_TYPES:
+                    raise ValueError(f"Layout field \"{name}\" has unsupported type \"{field_type}\"")
+                field_width = int(width_match.group(1))
+                self.fields[name] = LayoutField(name=name, row=row, col=len(line), width=field_width, spec=spec, convert=_FIELD_TYPES[field_type])
+                line += " " * field_width
+
+            if len(line) > width:
+                raise ValueError(f"Layout row {row} longer than LCD line width of {width}")
+            self.background[row] = line.ljust(width)
+
+    def values(self) -> dict[str, Any]:
+        return dict(self._values)
+
+    def invalidate(self) -> None:
+        self._drawn = False
+
+    def draw(self, target: Renderable) -> None:
+        for row, line in self.background.items():
+            target.write_at(0, row, line)
+        self._values = {}
+        self._drawn = True
+
+    def set(self, target: Renderable, name: str, value) -> None:
+        if not self._drawn:
+            self.draw(target)
+        elif name in self._values and self._values[name] == value:
+            return
+        field = self.fields.get(name)
+        if field is None:
+            # Configured layouts may leave out fields the page provides
+            return
+        target.write_at(field.col, field.row, field.format(value))
+        self._values[name] = value
@@ -1,10 +1,15 @@
 from dataclasses import dataclass
 from threading import Condition, Thread
 from enum import Enum
-from time import sleep
-from traceback import print_exc
+from time import monotonic, sleep, strftime
+from typing import Optional
 from serial import Serial
 from crc import crc16
+from keys import KeyDispatcher, LCDKeyEvent
+from link import CircuitBreaker, CircuitState, RTTEstimator
+from log import LOG
+from recorder import RECORD_READ, RECORD_WRITE, SerialRecorder, recording_path
+from reports import ReportDispatcher
 from utils import critical_call
 
 LCD_BAUDRATE = 115200
@@ -13,6 +18,24 @@ MAX_DATA_LENGTH = 22
 PACKET_CONST_ELEM_LEN = 1 + 1 + 2
 PACKET_LEN = PACKET_CONST_ELEM_LEN + MAX_DATA_LENGTH
 
+LCD_SEND_RETRIES = 5
+LCD_SEND_BUDGET = 0.5
+LCD_RTO_INITIAL = 0.25
+# The reader thread polls every 10ms, so anything lower would cause spurious timeouts
+LCD_RTO_MIN = 0.03
+LCD_RTO_MAX = 0.25
+LCD_CIRCUIT_FAILURE_THRESHOLD = 3
+LCD_CIRCUIT_RESET_TIMEOUT = 1.0
+LCD_CIRCUIT_MAX_RESET_TIMEOUT = 30.0
+
+FAN_COUNT = 4
+TEMPERATURE_SENSOR_COUNT = 32
+# Fan timer runs at 27,692,308 ticks per minute; most fans give 2 pulses per revolution
+FAN_TIMER_TICKS_PER_MINUTE = 27692308
+FAN_PULSES_PER_REVOLUTION = 2
+# Below this many tach cycles the fan is stopped or too slow to measure
+FAN_MIN_TACH_CYCLES = 4
+
 class LCDPacketType(Enum):
     RESPONSE = 0b01
     ERROR = 0b11
@@ -27,10 +50,6 @@ class LCDKey(Enum):
     RIGHT = 0x10
     DOWN = 0x20
 
-class LCDKeyEvent(Enum):
-    PRESSED = 0
-    RELEASED = 1
-
 class LCDCursorType(Enum):
     NONE = 0
     BLINKING_BLOCK = 1
@@ -67,14 +86,18 @@ class LCDKeyMask():
 LCD_KEY_MASK_NONE = LCDKeyMask(0)
 LCD_KEY_MASK_ALL = LCDKeyMask(0).add_all()
 
+# Enum construction by value is slow, and the reader builds a packet for every response
+_PACKET_TYPES = tuple(LCDPacketType(value) for value in range(4))
+
 class LCDPacket():
+    __slots__ = ("type", "command", "data")
     type:  LCDPacketType
     command: int
     data: bytearray
 
     def __init__(self, command, data):
         self.command = command & 0b00111111
-        self.type = LCDPacketType((command & 0b11000000) >> 6)
+        self.type = _PACKET_TYPES[(command & 0b11000000) >> 6]
         self.data = bytearray(data)
 
     def data_as_str(self):
@@ -83,6 +106,22 @@ class LCDPacket():
     def __str__(self):
         return f"LCDPacket(type={self.type.name}, command=0x{self.command:02x}, data=[{', '.join(list(map(lambda x: f'0x{x:02x}', self.data)))}])"
 
+@dataclass(slots=True)
+class LCDFanReport():
+    fan: int
+    tach_cycles: int
+    timer_ticks: int
+
+    def rpm(self, pulses_per_revolution: int = FAN_PULSES_PER_REVOLUTION) -> float:
+        if self.tach_cycles < FAN_MIN_TACH_CYCLES or self.timer_ticks == 0:
+            return 0.0
+        return (FAN_TIMER_TICKS_PER_MINUTE / pulses_per_revolution) * (self.tach_cycles - 3) / self.timer_ticks
+
+@dataclass(slots=True)
+class LCDTemperatureReport():
+    sensor: int
+    celsius: float
+
 @dataclass
 class LCDKeyPollResult():
     current: LCDKeyMask
@@ -95,6 +134,9 @@ class LCDException(Exception):
 class LCDTimeoutException(LCDException):
     pass
 
+class LCDCircuitOpenException(LCDTimeoutException):
+    pass
+
 class LCDResponseException(LCDException):
     def __init__(self, packet):
         super().__init__(f"LCDResponseException: {packet.data_as_str()}")
@@ -142,20 +184,48 @@ class LCD():
     _serial: Serial
     _last_response: LCDPacket
     _command_response_cond: Condition
-    _buffer: list[int]
+    _buffer: bytearray
+    _packet_buffer: bytearray
+    _packet_view: memoryview
     _reader_thread_var: Thread
-
-    def __init__(self, port: str, baudrate: int = LCD_BAUDRATE):
+    send_retries: int
+    send_budget: float
+    rtt: RTTEstimator
+    circuit: CircuitBreaker
+    record_dir: Optional[str]
+    recorder: Optional[SerialRecorder]
+    resyncs: int
+    keys: KeyDispatcher
+    reports: ReportDispatcher
+
+    def __init__(self, port: str, baudrate: int = LCD_BAUDRATE, send_retries: int = LCD_SEND_RETRIES, send_budget: float = LCD_SEND_BUDGET, record_dir: Optional[str] = None):
         self.port = port
+        self.record_dir = record_dir
+        self.recorder = None
+        self.resyncs = 0
         self.baudrate = baudrate
+        self.send_retries = send_retries
+        self.send_budget = send_budget
+        self.rtt = RTTEstimator(initial_rto=LCD_RTO_INITIAL, min_rto=LCD_RTO_MIN, max_rto=LCD_RTO_MAX)
+        self.circuit = CircuitBreaker(
+            failure_threshold=LCD_CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=LCD_CIRCUIT_RESET_TIMEOUT,
+            max_reset_timeout=LCD_CIRCUIT_MAX_RESET_TIMEOUT,
+        )
         self._serial = None
         self._last_response = None
         self._command_response_cond = Condition()
-        self._buffer = []
+        self._buffer = bytearray()
+        self._packet_buffer = bytearray(PACKET_LEN)
+        self._packet_view = memoryview(self._packet_buffer)
         self._reader_thread_var = None
         self._should_run = False
 
         self._key_event_handlers = []
+        self._fan_report_handlers = []
+        self._temperature_report_handlers = []
+        self.keys = KeyDispatcher(port, self._key_event_handlers)
+        self.reports = ReportDispatcher(port)
 
     def width(self) -> int:
         return 20
@@ -172,15 +242,26 @@ class LCD():
     def open(self) -> None:
         self.close()
         self._serial = Serial(self.port, self.baudrate, timeout=1)
+        if self.record_dir is not None:
+            try:
+                self.recorder = SerialRecorder(recording_path(self.record_dir, self.port, strftime("%Y%m%d-%H%M%S")))
+            except OSError:
+                LOG.exception("Could not start recording", port=self.port, record_dir=self.record_dir)
+        self.rtt.reset()
+        self.circuit.reset()
         self._should_run = True
         self._reader_thread_var = Thread(name=f"LCD reader {self.port}", target=critical_call, args=(self._reader_thread,), daemon=True)
         self._reader_thread_var.start()
+        self.keys.start()
+        self.reports.start()
 
     def close(self) -> None:
         self._should_run = False
         if self._reader_thread_var is not None:
             self._reader_thread_var.join()
             self._reader_thread_var = None
+        self.keys.stop()
+        self.reports.stop()
 
     def register_key_event_handler(self, handler) -> None:
         self._key_event_handlers.append(handler)
@@ -188,6 +269,18 @@ class LCD():
     def unregister_key_event_handler(self, handler) -> None:
         self._key_event_handlers.remove(handler)
 
+    def register_fan_report_handler(self, handler) -> None:
+        self._fan_report_handlers.append(handler)
+
+    def unregister_fan_report_handler(self, handler) -> None:
+        self._fan_report_handlers.remove(handler)
+
+    def register_temperature_report_handler(self, handler) -> None:
+        self._temperature_report_handlers.append(handler)
+
+    def unregister_temperature_report_handler(self, handler) -> None:
+        self._temperature_report_handlers.remove(handler)
+
     def ping(self) -> None:
         self.send(0x00)
 
@@ -221,6 +314,12 @@ class LCD():
     def set_backlight(self, level: int) -> None:
         self.send(0x0E, [level])
 
+    def set_fan_reporting(self, fan_mask: int) -> None:
+        self.send(0x10, [fan_mask & 0x0F])
+
+    def set_temperature_reporting(self, sensor_mask: int) -> None:
+        self.send(0x13, list(sensor_mask.to_bytes(4, "little")))
+
     def set_key_reporting(self, press_mask: LCDKeyMask, release_mask: LCDKeyMask) -> None:
         self.send(0x17, [press_mask.mask, release_mask.mask])
 
@@ -232,7 +331,7 @@ class LCD():
         self.write(col, row, bytearray(data, "latin-1"))
 
     def write(self, col: int, row: int, data: bytearray) -> None:
-        self.send(0x1F, [col, row] + list(data))
+        self.send(0x1F, bytes((col, row)) + bytes(data))
 
     def write_gpio(self, idx: int, value: int, drive: int = None) -> None:
         if drive is not None:
@@ -249,111 +348,173 @@ class LCD():
         return self.send(0x23, [idx])
 
     def _reader_thread(self) -> None:
-        self._buffer = []
+        self._buffer = bytearray()
 
         while self._should_run:
             try:
                 self._read()
             except Exception:
-                print(f"Error reading from LCD on port {self.port}", flush=True)
-                print_exc()
+                LOG.exception("Error reading from LCD", port=self.port)
             sleep(0.01)
     
         self._serial.close()
         self._serial = None
-        self._buffer = []
+        self._buffer = bytearray()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
     def _read(self) -> None:
-        self._buffer += self._serial.read(self._serial.in_waiting)
+        received = self._serial.read(self._serial.in_waiting)
+        if received:
+            if self.recorder is not None:
+                self.recorder.record(RECORD_READ, received)
+            self._buffer += received
         packet = self._check_buffer()
         if packet is None:
             return
         if packet.type == LCDPacketType.REQUEST:
-            print("REQUEST type packet from LCD. This should never happen!", flush=True)
+            LOG.info("REQUEST type packet from LCD. This should never happen!", port=self.port)
             return
         if packet.type == LCDPacketType.REPORT:
             if packet.command == REPORT_KEY:
                 self._handle_key_report(packet.data)
+            elif packet.command == REPORT_FAN:
+                self._handle_fan_report(packet.data)
+            elif packet.command == REPORT_TEMPERATURE:
+                self._handle_temperature_report(packet.data)
             return
-        self._command_response_cond.acquire()
-        if self._last_response is not None:
-            print("Got a response while another one was already buffered", self._last_response, packet, flush=True)
-        self._last_response = packet
-        self._command_response_cond.notify_all()
-        self._command_response_cond.release()
+        with self._command_response_cond:
+            if self._last_response is not None:
+                LOG.info("Got a response while another one was already buffered", port=self.port, buffered=self._last_response, received=packet)
+            self._last_response = packet
+            self._command_response_cond.notify_all()
 
-    def _skip_buffer(self, num: int = 1) -> LCDPacket:
-        self._buffer = self._buffer[num:]
-        return self._check_buffer()
+    def _skip_buffer(self, num: int = 1) -> None:
+        self.resyncs += 1
+        del self._buffer[:num]
 
     def _check_buffer(self) -> LCDPacket:
-        if len(self._buffer) < 4:
-            return None
-
-        cmd = self._buffer[0]
-        data_len = self._buffer[1]
-        if data_len > MAX_DATA_LENGTH:
-            return self._skip_buffer()
-
-        if len(self._buffer) < data_len + 4:
-            return None
-
-        crcBytes = self._buffer[2+data_len:4+data_len]
-        presentedCrc = crcBytes[0] | (crcBytes[1] << 8)
-        calculatedCrc = crc16(self._buffer[:2+data_len])
-        if presentedCrc != calculatedCrc:
-            return self._skip_buffer()
-
-        data = self._buffer[2:2+data_len]
-        self._buffer = self._buffer[4+data_len:]
-        return LCDPacket(cmd, data)
+        # Loops instead of recursing, so a long burst of line noise cannot blow the stack
+        buffer = self._buffer
+        while len(buffer) >= 4:
+            cmd = buffer[0]
+            data_len = buffer[1]
+            if data_len > MAX_DATA_LENGTH:
+                self._skip_buffer()
+                continue
+
+            if len(buffer) < data_len + 4:
+                return None
+
+            presentedCrc = buffer[2+data_len] | (buffer[3+data_len] << 8)
+            calculatedCrc = crc16(buffer[:2+data_len])
+            if presentedCrc != calculatedCrc:
+                self._skip_buffer()
+                continue
+
+            data = buffer[2:2+data_len]
+            # Consumed in place, the buffer is never reallocated
+            del buffer[:4+data_len]
+            return LCDPacket(cmd, data)
+        return None
 
     def _handle_key_report(self, data: bytearray) -> None:
         key, pressed = REPORT_KEY_MAP_TO_LCD_KEY[data[0]]
-        for handler in self._key_event_handlers:
-            if pressed:
-                event = LCDKeyEvent.PRESSED
-            else:
-                event = LCDKeyEvent.RELEASED
-            try:
-                handler(key=key, event=event)
-            except Exception:
-                print(f"Error in key event handler on port {self.port} with handler {handler}", flush=True)
-                print_exc()
+        # Handlers run on the key dispatcher, the reader thread only parses
+        if pressed:
+            self.keys.submit(key, LCDKeyEvent.PRESSED)
+        else:
+            self.keys.submit(key, LCDKeyEvent.RELEASED)
 
-    def send(self, command: int, data: bytearray = []) -> bytearray:
-        retries = 5
-        while retries > 0:
-            try:
-                return self._send(command, data)
-            except LCDTimeoutException:
-                print(f"LCD timeout on {self.port}...", flush=True)
-            retries -= 1
+    def _handle_fan_report(self, data: bytearray) -> None:
+        if len(data) < 4:
+            return
+        report = LCDFanReport(fan=data[0], tach_cycles=data[1], timer_ticks=(data[2] << 8) | data[3])
+        # Like keys, handlers run off the reader thread so they cannot hold up responses
+        self.reports.submit("fan", report.fan, self._fan_report_handlers, report)
+
+    def _handle_temperature_report(self, data: bytearray) -> None:
+        if len(data) < 3:
+            return
+        raw = data[1] | (data[2] << 8)
+        if raw & 0x8000:
+            raw -= 0x10000
+        report = LCDTemperatureReport(sensor=data[0], celsius=raw / 16.0)
+        self.reports.submit("temperature", report.sensor, self._temperature_report_handlers, report)
+
+    def send(self, command: int, data: bytearray = [], retries: int = None) -> bytearray:
+        if not self.circuit.allow():
+            raise LCDCircuitOpenException(f"Circuit open on {self.port}")
+
+        if retries is None:
+            retries = self.send_retries
+        if self.circuit.state == CircuitState.HALF_OPEN:
+            retries = 1
+
+        timeout = self.rtt.rto
+        deadline = monotonic() + self.send_budget
+        try:
+            for attempt in range(retries):
+                start = monotonic()
+                if attempt > 0 and start + timeout > deadline:
+                    break
+                try:
+                    resp = self._send(command, data, timeout)
+                except LCDTimeoutException:
+                    LOG.info("LCD timeout", port=self.port, timeout_ms=round(timeout * 1000), attempt=f"{attempt + 1}/{retries}")
+                    if attempt == 0:
+                        self.rtt.backoff()
+                    timeout = min(timeout * 2.0, self.rtt.max_rto)
+                    continue
+                except LCDResponseException:
+                    self.circuit.record_success()
+                    raise
+
+                # Karn's algorithm: retransmitted commands give ambiguous samples
+                if attempt == 0:
+                    self.rtt.sample(monotonic() - start)
+                self.circuit.record_success()
+                return resp
+        except LCDResponseException:
+            raise
+        except Exception:
+            # A failing port counts too, or a half-open probe would never be recorded and the circuit never close
+            if self.circuit.record_failure():
+                LOG.info("LCD send failed, opening circuit", port=self.port)
+            raise
+
+        if self.circuit.record_failure():
+            LOG.info("LCD stopped responding, opening circuit", port=self.port)
         raise LCDTimeoutException()
 
-    def _send(self, command: int, data: bytearray = []) -> bytearray:
+    def _send(self, command: int, data: bytearray = [], timeout: float = LCD_RTO_MAX) -> bytearray:
         data_len = len(data)
         if data_len > MAX_DATA_LENGTH:
             raise ValueError(f"Data length too long: {data_len} > {MAX_DATA_LENGTH}")
-        packet = bytearray(PACKET_CONST_ELEM_LEN + data_len)
-        packet[0] = command
-        packet[1] = data_len
-        for i in range(data_len):
-            packet[2 + i] = data[i]
-        crc = crc16(packet[:-2])
-        packet[2 + data_len] = crc & 0xFF
-        packet[3 + data_len] = crc >> 8
-        
-        self._command_response_cond.acquire()
-
-        self._serial.write(packet)
-        if not self._command_response_cond.wait_for(lambda: self._last_response and self._last_response.command == command, timeout=0.25):
-            self._command_response_cond.release()
-            raise LCDTimeoutException()
-
-        resp = self._last_response
-        self._last_response = None
-        self._command_response_cond.release()
+        packet_len = PACKET_CONST_ELEM_LEN + data_len
+
+        with self._command_response_cond:
+            # One packet buffer per LCD, reused under the lock
+            buffer = self._packet_buffer
+            buffer[0] = command
+            buffer[1] = data_len
+            buffer[2:2 + data_len] = data
+            crc = crc16(self._packet_view[:2 + data_len])
+            buffer[2 + data_len] = crc & 0xFF
+            buffer[3 + data_len] = crc >> 8
+            packet = self._packet_view[:packet_len]
+
+            # A late reply to an earlier, timed out command must not answer this one
+            self._last_response = None
+            self._serial.write(packet)
+            if self.recorder is not None:
+                self.recorder.record(RECORD_WRITE, packet)
+            if not self._command_response_cond.wait_for(lambda: self._last_response and self._last_response.command == command, timeout=timeout):
+                raise LCDTimeoutException()
+
+            resp = self._last_response
+            self._last_response = None
 
         if resp.type == LCDPacketType.ERROR:
             raise LCDResponseException(resp)
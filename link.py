@@ -0,0 +1,159 @@
+from enum import Enum
+from threading import Lock
+from time import monotonic
+from typing import Optional
+
+# RFC 6298 smoothing factors
+RTT_ALPHA = 1.0 / 8.0
+RTT_BETA = 1.0 / 4.0
+RTT_K = 4.0
+
+class RTTEstimator():
+    srtt: float
+    rttvar: float
+    rto: float
+    initial_rto: float
+    min_rto: float
+    max_rto: float
+    samples: int
+
+    def __init__(self, initial_rto: float, min_rto: float, max_rto: float):
+        self.initial_rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.reset()
+
+    def reset(self) -> None:
+        self.srtt = None
+        self.rttvar = None
+        self.rto = self.initial_rto
+        self.samples = 0
+
+    def sample(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = (1.0 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1.0 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        self.samples += 1
+        self.rto = self._clamp(self.srtt + RTT_K * self.rttvar)
+
+    def backoff(self) -> None:
+        self.rto = self._clamp(self.rto * 2.0)
+
+    def _clamp(self, value: float) -> float:
+        return max(self.min_rto, min(self.max_rto, value))
+
+    def __str__(self):
+        if self.srtt is None:
+            return f"RTTEstimator(rto={self.rto * 1000:.1f}ms)"
+        return f"RTTEstimator(srtt={self.srtt * 1000:.1f}ms, rttvar={self.rttvar * 1000:.1f}ms, rto={self.rto * 1000:.1f}ms)"
+
+class CircuitState(Enum):
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+class CircuitBreaker():
+    state: CircuitState
+    failure_threshold: int
+    reset_timeout: float
+    max_reset_timeout: float
+    _failures: int
+    _current_reset_timeout: float
+    _opened_at: float
+    _lock: Lock
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 1.0, max_reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.state = CircuitState.CLOSED
+        self._failures = 0
+        self._current_reset_timeout = self.reset_timeout
+        self._opened_at = 0.0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CircuitState.CLOSED:
+                return True
+            if self.state == CircuitState.HALF_OPEN:
+                # Only a single probe may be in flight
+                return False
+            if monotonic() - self._opened_at < self._current_reset_timeout:
+                return False
+            self.state = CircuitState.HALF_OPEN
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CircuitState.CLOSED
+            self._failures = 0
+            self._current_reset_timeout = self.reset_timeout
+
+    def record_failure(self) -> bool:
+        with self._lock:
+            if self.state == CircuitState.HALF_OPEN:
+                self._current_reset_timeout = min(self._current_reset_timeout * 2.0, self.max_reset_timeout)
+                self._open()
+                return True
+
+            self._failures += 1
+            if self.state == CircuitState.CLOSED and self._failures >= self.failure_threshold:
+                self._open()
+                return True
+            return False
+
+    def _open(self) -> None:
+        self.state = CircuitState.OPEN
+        self._opened_at = monotonic()
+
+class LinkBudget():
+    bytes_per_second: Optional[float]
+    commands_per_second: Optional[float]
+    burst: float
+    _byte_tokens: float
+    _command_tokens: float
+    _refilled_at: float
+
+    def __init__(self, bytes_per_second: Optional[float] = None, commands_per_second: Optional[float] = None, burst: float = 0.25):
+        self.bytes_per_second = bytes_per_second
+        self.commands_per_second = commands_per_second
+        # Seconds worth of traffic that may go out back to back
+        self.burst = burst
+        self.reset()
+
+    def reset(self) -> None:
+        self._byte_tokens = (self.bytes_per_second or 0.0) * self.burst
+        self._command_tokens = (self.commands_per_second or 0.0) * self.burst
+        self._refilled_at = monotonic()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.bytes_per_second is not None:
+            self._byte_tokens = min(self._byte_tokens + elapsed * self.bytes_per_second, self.bytes_per_second * self.burst)
+        if self.commands_per_second is not None:
+            self._command_tokens = min(self._command_tokens + elapsed * self.commands_per_second, self.commands_per_second * self.burst)
+
+    def available(self, cost: int) -> bool:
+        self._refill()
+        if self.bytes_per_second is not None and self._byte_tokens < cost:
+            return False
+        if self.commands_per_second is not None and self._command_tokens < 1:
+            return False
+        return True
+
+    def spend(self, cost: int) -> None:
+        # May go into debt: urgent traffic is always sent, but still delays what comes after it
+        self._refill()
+        if self.bytes_per_second is not None:
+            self._byte_tokens -= cost
+        if self.commands_per_second is not None:
+            self._command_tokens -= 1
@@ -0,0 +1,203 @@
+from argparse import ArgumentParser
+from collections import Counter
+from importlib import import_module
+from json import dump, loads
+from multiprocessing import get_context
+from threading import Lock, active_count, enumerate as enumerate_threads
+from time import monotonic, sleep
+from urllib.request import urlopen
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from bench import BenchPageDriver
+from fake_prometheus import FakePrometheus, FakePrometheusServer, load_series
+from histogram import LatencyHistogram
+from memory import format_bytes, process_rss
+from page_updating import UpdatingLCDPage
+import prometheus
+
+LOAD_PAGE_TYPES = ["ping", "ntp", "lte", "upspower"]
+LOAD_PAGES = 200
+LOAD_DURATION = 30.0
+LOAD_UPDATE_PERIOD = 5.0
+LOAD_SAMPLE_INTERVAL = 0.5
+LOAD_PORT = 19090
+
+_CONTEXT = get_context("fork")
+
+def _serve(port: int, series, latency: float, jitter: float, error_rate: float, seed: int) -> None:
+    prometheus_server = FakePrometheus(series, latency=latency, jitter=jitter, error_rate=error_rate, seed=seed)
+    FakePrometheusServer(prometheus_server, port=port).serve_forever()
+
+def _wait_for_server(url: str, timeout: float = 5.0) -> None:
+    deadline = monotonic() + timeout
+    while True:
+        try:
+            urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            if monotonic() > deadline:
+                raise
+            sleep(0.05)
+
+def _page_config(page_type: str, idx: int, update_period: float) -> dict:
+    page_config = {"type": page_type, "update_period": update_period}
+    # Distinct filters, so every instance sends its own queries like separate hosts would
+    if page_type == "ntp":
+        page_config["filter"] = {"instance": f"ntp{idx}:9100"}
+    elif page_type == "lte":
+        page_config["filter"] = {"instance": f"lte{idx}"}
+    elif page_type == "upspower":
+        page_config["filter"] = {"hostname": f"ups{idx}"}
+    return page_config
+
+class ConnectFailureCounter():
+    count: int
+    _lock: Lock
+    _query_url: object
+
+    def __init__(self):
+        self.count = 0
+        self._lock = Lock()
+        self._query_url = None
+
+    def install(self) -> None:
+        # Injected errors come back as 503 answers; a failed connect means the bench itself is the bottleneck
+        self._query_url = prometheus._query_prometheus_url
+        prometheus._query_prometheus_url = self._counting_query_url
+
+    def uninstall(self) -> None:
+        prometheus._query_prometheus_url = self._query_url
+
+    def _counting_query_url(self, url: str, query, timeout: float):
+        try:
+            return self._query_url(url, query, timeout)
+        except RequestsConnectionError:
+            with self._lock:
+                self.count += 1
+            raise
+
+def _thread_groups() -> Counter:
+    groups = Counter()
+    for thread in enumerate_threads():
+        # "LCDPage update NTP" and "Prometheus hedge_3" both group by their prefix
+        groups[" ".join(thread.name.split("_")[0].split(" ")[:2])] += 1
+    return groups
+
+def main():
+    parser = ArgumentParser(description="Run page instances against a local fake Prometheus and report data-path throughput")
+    parser.add_argument("--pages", type=int, default=LOAD_PAGES, help="Total page instances, spread over the page types")
+    parser.add_argument("--types", default=",".join(LOAD_PAGE_TYPES))
+    parser.add_argument("--duration", type=float, default=LOAD_DURATION)
+    parser.add_argument("--update-period", type=float, default=LOAD_UPDATE_PERIOD)
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake Prometheus answer latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--replicas", type=int, default=1, help="Fake Prometheus replicas, more than one exercises hedging")
+    parser.add_argument("--series", help="YAML series script for the fake Prometheus")
+    parser.add_argument("--port", type=int, default=LOAD_PORT, help="First fake Prometheus port")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    series = None
+    if args.series:
+        series = load_series(args.series)
+
+    # The servers run in their own processes, so their threads and GIL time stay out of the numbers
+    servers = []
+    urls = []
+    for replica in range(args.replicas):
+        port = args.port + replica
+        server = _CONTEXT.Process(name=f"Fake Prometheus {port}", target=_serve, args=(port, series, args.latency, args.jitter, args.error_rate, replica), daemon=True)
+        server.start()
+        servers.append((server, f"http://127.0.0.1:{port}"))
+        urls.append(f"http://127.0.0.1:{port}/api/v1/query")
+    for _, base_url in servers:
+        _wait_for_server(f"{base_url}/stats")
+    prometheus.configure({"urls": urls})
+    connect_failures = ConnectFailureCounter()
+    connect_failures.install()
+
+    driver = BenchPageDriver()
+    update_latency = LatencyHistogram("page update")
+    types = args.types.split(",")
+    pages: list[UpdatingLCDPage] = []
+    for idx in range(args.pages):
+        page_type = types[idx % len(types)]
+        PageClass = import_module(f"pages.{page_type}", package=".").PAGE
+        page = PageClass(driver=driver, config=_page_config(page_type, idx, args.update_period))
+        # All instances feed one histogram
+        page.update_latency = update_latency
+        pages.append(page)
+
+    base_threads = active_count()
+    base_rss = process_rss()
+    start = monotonic()
+    for page in pages:
+        page.start()
+
+    peak_threads = 0
+    peak_groups = Counter()
+    peak_rss = 0
+    while monotonic() - start < args.duration:
+        sleep(LOAD_SAMPLE_INTERVAL)
+        threads = active_count()
+        if threads > peak_threads:
+            peak_threads = threads
+            peak_groups = _thread_groups()
+        peak_rss = max(peak_rss, process_rss() or 0)
+
+    for page in pages:
+        page.should_run = False
+    for page in pages:
+        page.stop()
+    elapsed = monotonic() - start
+    connect_failures.uninstall()
+
+    queries = 0
+    errors = 0
+    for server, base_url in servers:
+        with urlopen(f"{base_url}/stats", timeout=5) as res:
+            stats = loads(res.read())
+        queries += stats["queries"]
+        errors += stats["errors"]
+        server.terminate()
+        server.join()
+
+    updates = update_latency.count
+    failures = sum(page.update_failures for page in pages)
+    results = {
+        "pages": args.pages,
+        "types": types,
+        "duration": elapsed,
+        "updates": updates,
+        "updates_per_second": updates / elapsed,
+        "update_failures": failures,
+        "queries": queries,
+        "queries_per_second": queries / elapsed,
+        "errors_injected": errors,
+        "connect_failures": connect_failures.count,
+        "update_p50": update_latency.percentile(50),
+        "update_p90": update_latency.percentile(90),
+        "update_p99": update_latency.percentile(99),
+        "update_max": update_latency.max,
+        "peak_threads": peak_threads,
+        "added_threads": peak_threads - base_threads,
+        "rss_growth": peak_rss - (base_rss or 0),
+    }
+
+    print(f"{args.pages} pages ({', '.join(types)}) for {elapsed:.1f}s against {args.replicas} fake Prometheus replica(s)", flush=True)
+    print(f"Updates: {updates} ({results['updates_per_second']:.1f}/s), {failures} failed", flush=True)
+    print(f"Queries: {queries} ({results['queries_per_second']:.1f}/s), {errors} answered with injected errors", flush=True)
+    if connect_failures.count > 0:
+        print(f"Connect failures: {connect_failures.count}, not injected, the numbers above undercount the load", flush=True)
+    print(f"Update latency: mean {update_latency.mean() * 1000:.1f}ms p50<={results['update_p50'] * 1000:.1f}ms p90<={results['update_p90'] * 1000:.1f}ms p99<={results['update_p99'] * 1000:.1f}ms max {update_latency.max * 1000:.1f}ms", flush=True)
+    print(f"Threads: peak {peak_threads} ({results['added_threads']} added), RSS grew {format_bytes(results['rss_growth'])}", flush=True)
+    for name, count in peak_groups.most_common():
+        print(f"  {name}: {count}", flush=True)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            dump(results, f, indent=2)
+            f.write("\n")
+
+if __name__ == "__main__":
+    main()
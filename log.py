@@ -0,0 +1,132 @@
+from os import register_at_fork
+from queue import Empty, Full, Queue
+from sys import exc_info, stderr, stdout
+from threading import Lock, Thread
+from time import monotonic
+from traceback import print_exception
+from typing import Optional
+
+LOG_QUEUE_SIZE = 1024
+# Identical records within this window are counted instead of written
+LOG_DEDUP_WINDOW = 10.0
+
+# message, fields, exception info, suppressed count
+LogRecord = tuple[str, dict, Optional[tuple], int]
+
+class LogPipeline():
+    dedup_window: float
+    dropped: int
+    _queue: Queue
+    _lock: Lock
+    # dedup key -> [window start, suppressed count, last record]
+    _recent: dict[tuple, list]
+    _writer_thread: Optional[Thread]
+
+    def __init__(self, queue_size: int = LOG_QUEUE_SIZE, dedup_window: float = LOG_DEDUP_WINDOW):
+        self.dedup_window = dedup_window
+        self.dropped = 0
+        self._queue = Queue(maxsize=queue_size)
+        self._lock = Lock()
+        self._recent = {}
+        self._writer_thread = None
+
+    def info(self, message: str, **fields) -> None:
+        self._log(message, fields, None)
+
+    def exception(self, message: str, **fields) -> None:
+        self._log(message, fields, exc_info())
+
+    def _log(self, message: str, fields: dict, exc: Optional[tuple]) -> None:
+        # Runs on the hot threads: no I/O and no formatting, just dedup and enqueue
+        key = (message, fields.get("port"), fields.get("page"), None if exc is None else (exc[0], str(exc[1])))
+        now = monotonic()
+        with self._lock:
+            recent = self._recent.get(key)
+            if recent is not None and now - recent[0] < self.dedup_window:
+                recent[1] += 1
+                recent[2] = (message, fields, exc)
+                return
+            suppressed = 0
+            if recent is not None:
+                suppressed = recent[1]
+            self._recent[key] = [now, 0, None]
+            if self._writer_thread is None:
+                self._writer_thread = Thread(name="Log writer", target=self._writer, daemon=True)
+                self._writer_thread.start()
+        self._enqueue((message, fields, exc, suppressed))
+
+    def _enqueue(self, record: LogRecord) -> None:
+        try:
+            self._queue.put_nowait(record)
+        except Full:
+            # Never block the caller on a slow stdout
+            with self._lock:
+                self.dropped += 1
+
+    def _expire(self) -> list[LogRecord]:
+        # Summaries for errors that stopped repeating, so their counts are not lost
+        now = monotonic()
+        summaries = []
+        with self._lock:
+            for key, recent in list(self._recent.items()):
+                if now - recent[0] < self.dedup_window:
+                    continue
+                del self._recent[key]
+                if recent[1] > 0:
+                    message, fields, exc = recent[2]
+                    summaries.append((message, fields, exc, recent[1]))
+        return summaries
+
+    def _write(self, record: LogRecord) -> None:
+        message, fields, exc, suppressed = record
+        line = message
+        for name, value in fields.items():
+            line += f" {name}={value}"
+        if suppressed > 0:
+            line += f" (suppressed {suppressed} times)"
+        print(line, flush=exc is None and self._queue.empty())
+        if exc is not None:
+            stdout.flush()
+            print_exception(*exc)
+            stderr.flush()
+
+    def _writer(self) -> None:
+        while True:
+            try:
+                record = self._queue.get(timeout=self.dedup_window)
+            except Empty:
+                record = None
+            try:
+                if record is not None:
+                    self._write(record)
+                for summary in self._expire():
+                    self._write(summary)
+                with self._lock:
+                    dropped = self.dropped
+                    self.dropped = 0
+                if dropped > 0:
+                    print(f"Log queue full, dropped {dropped} records", flush=True)
+            except Exception:
+                # The writer must outlive anything a record can throw at it
+                pass
+
+    def after_fork(self) -> None:
+        # The writer thread does not survive a fork, the child starts its own on first use
+        self._queue = Queue(maxsize=self._queue.maxsize)
+        self._lock = Lock()
+        self._recent = {}
+        self._writer_thread = None
+
+    def flush(self) -> None:
+        # Synchronous drain, for when the process is about to exit
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except Empty:
+                break
+            self._write(record)
+        stdout.flush()
+        stderr.flush()
+
+LOG = LogPipeline()
+register_at_fork(after_in_child=LOG.after_fork)
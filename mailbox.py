@@ -0,0 +1,126 @@
+from threading import Condition
+from typing import Optional
+
+Damage = Optional[list[tuple[int, int]]]
+Frame = tuple[Optional[bytes], Optional[tuple[tuple[int, int], ...]], Damage, Optional[float]]
+
+def _earliest(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+class FrameMailbox():
+    frames_put: int
+    frames_taken: int
+    frames_dropped: int
+    _data: Optional[bytes]
+    _leds: Optional[tuple[tuple[int, int], ...]]
+    _damage: Damage
+    _key_time: Optional[float]
+    _full: bool
+    _closed: bool
+    _cond: Condition
+
+    def __init__(self):
+        self.frames_put = 0
+        self.frames_taken = 0
+        self.frames_dropped = 0
+        self._data = None
+        self._leds = None
+        self._damage = None
+        self._key_time = None
+        self._full = False
+        self._closed = False
+        self._cond = Condition()
+
+    def put(self, data: Optional[bytes], leds: Optional[tuple[tuple[int, int], ...]], damage: Damage = None, key_time: Optional[float] = None) -> None:
+        with self._cond:
+            if self._full:
+                if data is not None and self._data is not None:
+                    self.frames_dropped += 1
+                    # The skipped frame's damage still has to reach the device
+                    if damage is not None and self._damage is not None:
+                        damage = self._damage + damage
+                    else:
+                        damage = None
+                # Parts the new frame does not carry are still pending
+                if data is None:
+                    data = self._data
+                    damage = self._damage
+                if leds is None:
+                    leds = self._leds
+                key_time = _earliest(self._key_time, key_time)
+            self._data = data
+            self._leds = leds
+            self._damage = damage
+            self._key_time = key_time
+            self._full = True
+            self.frames_put += 1
+            self._cond.notify()
+
+    def put_back(self, data: Optional[bytes], leds: Optional[tuple[tuple[int, int], ...]], key_time: Optional[float] = None) -> None:
+        with self._cond:
+            if self._full:
+                # A newer frame superseded the one that failed, but the device
+                # may hold part of the failed one, so rescan all of it
+                if data is not None:
+                    if self._data is None:
+                        self._data = data
+                    self._damage = None
+                if self._leds is None:
+                    self._leds = leds
+                self._key_time = _earliest(self._key_time, key_time)
+                return
+            self._data = data
+            self._leds = leds
+            # Only part of the frame may have reached the device, so rescan all of it
+            self._damage = None
+            self._key_time = key_time
+            self._full = True
+            self._cond.notify()
+
+    def carry_over(self, data: bytes, spans: list[tuple[int, int]]) -> None:
+        # Spans a preempted frame never sent; the pending frame gets them rescanned against its newer content
+        with self._cond:
+            if self._full and self._data is not None:
+                if self._damage is not None:
+                    self._damage = self._damage + spans
+                return
+            self._data = data
+            self._damage = list(spans)
+            self._full = True
+            self._cond.notify()
+
+    def priority_pending(self) -> bool:
+        return self._full and self._key_time is not None
+
+    def take(self, timeout: Optional[float] = None) -> Optional[Frame]:
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._full or self._closed, timeout=timeout):
+                return None
+            if not self._full:
+                return None
+            frame = (self._data, self._leds, self._damage, self._key_time)
+            self._data = None
+            self._leds = None
+            self._damage = None
+            self._key_time = None
+            self._full = False
+            self.frames_taken += 1
+            return frame
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def reopen(self) -> None:
+        with self._cond:
+            self._closed = False
+            self._data = None
+            self._leds = None
+            self._damage = None
+            self._key_time = None
+            self._full = False
@@ -0,0 +1,113 @@
+import tracemalloc
+from os import getpid, path, sysconf
+from threading import active_count, stack_size
+from time import monotonic
+from typing import Optional
+from log import LOG
+
+LOW_FOOTPRINT_STACK_SIZE = 256 * 1024
+MEMORY_TRACE_FRAMES = 1
+
+_APP_DIR = path.dirname(path.abspath(__file__))
+
+def process_rss(pid: int = None) -> Optional[int]:
+    if pid is None:
+        pid = getpid()
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
+
+def _subsystem(filename: str) -> str:
+    # App modules by name, everything else by the package it came from
+    if filename.startswith(_APP_DIR):
+        relative = path.relpath(filename, _APP_DIR)
+        return relative[:-3] if relative.endswith(".py") else relative
+    parts = filename.split(path.sep)
+    for marker in ("site-packages", "dist-packages"):
+        if marker in parts:
+            idx = parts.index(marker)
+            if idx + 1 < len(parts):
+                return parts[idx + 1].removesuffix(".py")
+    return "stdlib"
+
+class MemoryReporter():
+    interval: float
+    _baseline: Optional[tracemalloc.Snapshot]
+    _baseline_rss: Optional[int]
+    _last_report: float
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._baseline = None
+        self._baseline_rss = None
+        self._last_report = 0.0
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_TRACE_FRAMES)
+        self.rebase()
+
+    def rebase(self) -> None:
+        # Call once startup is done, so the report shows steady-state growth only
+        self._baseline = self._snapshot()
+        self._baseline_rss = process_rss()
+        self._last_report = monotonic()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+    def report(self) -> str:
+        snapshot = self._snapshot()
+        sizes: dict[str, list[int]] = {}
+        for stat in snapshot.compare_to(self._baseline, "filename"):
+            name = _subsystem(stat.traceback[0].filename)
+            totals = sizes.setdefault(name, [0, 0])
+            totals[0] += stat.size
+            totals[1] += stat.size_diff
+
+        rss = process_rss()
+        traced, peak = tracemalloc.get_traced_memory()
+        lines = [f"Memory: rss={format_bytes(rss or 0)} traced={format_bytes(traced)} peak={format_bytes(peak)} threads={active_count()}"]
+        if rss is not None and self._baseline_rss is not None:
+            lines[0] += f" rss_change={format_bytes(rss - self._baseline_rss)}"
+        for name, (size, diff) in sorted(sizes.items(), key=lambda item: -item[1][0]):
+            lines.append(f"  {name}: {format_bytes(size)} ({'+' if diff >= 0 else ''}{format_bytes(diff)})")
+        return "\n".join(lines)
+
+    def due(self) -> bool:
+        if monotonic() - self._last_report < self.interval:
+            return False
+        self._last_report = monotonic()
+        return True
+
+    def tick(self) -> None:
+        if self.due():
+            LOG.info(self.report())
+
+def apply_low_footprint(footprint_config) -> Optional[MemoryReporter]:
+    if footprint_config is None:
+        return None
+    # Only threads started from here on get the smaller stack
+    size = LOW_FOOTPRINT_STACK_SIZE
+    if "thread_stack_size" in footprint_config:
+        size = footprint_config["thread_stack_size"]
+    stack_size(size)
+
+    if "memory_report_interval" not in footprint_config:
+        return None
+    reporter = MemoryReporter(footprint_config["memory_report_interval"])
+    reporter.start()
+    return reporter
@@ -0,0 +1,218 @@
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from threading import Condition, Lock, Thread
+from typing import Optional
+from utils import critical_call
+
+MIRROR_HOST = "127.0.0.1"
+MIRROR_PORT = 8635
+# Viewers further behind than this many events get a fresh keyframe instead
+MIRROR_HISTORY = 256
+MIRROR_CLIENT_TIMEOUT = 5.0
+MIRROR_KEEPALIVE = 15.0
+
+def _encode_event(kind: str, seq: int, payload) -> bytes:
+    return f"event: {kind}\nid: {seq}\ndata: {dumps(payload, separators=(',', ':'))}\n\n".encode("utf-8")
+
+def _encode_leds(leds: list[Optional[tuple[int, int]]]) -> list:
+    return [None if led is None else list(led) for led in leds]
+
+class FrameMirror():
+    name: str
+    width: int
+    height: int
+    clients: int
+    _mem: bytearray
+    _leds: list[Optional[tuple[int, int]]]
+    _seq: int
+    _events: deque
+    _keyframe: Optional[tuple[int, bytes]]
+    _cond: Condition
+
+    def __init__(self, name: str):
+        self.name = name
+        self.width = 0
+        self.height = 0
+        self.clients = 0
+        self._mem = bytearray()
+        self._leds = []
+        self._seq = 0
+        self._events = deque(maxlen=MIRROR_HISTORY)
+        self._keyframe = None
+        self._cond = Condition()
+
+    def reset(self, width: int, height: int, mem: bytes, leds: list[Optional[tuple[int, int]]]) -> None:
+        with self._cond:
+            self.width = width
+            self.height = height
+            self._mem = bytearray(mem)
+            self._leds = list(leds)
+            self._seq += 1
+            # Everyone has to start over from the new keyframe
+            self._events.clear()
+            self._keyframe = None
+            self._cond.notify_all()
+
+    def publish(self, spans: list[tuple[int, bytes]], leds: dict[int, tuple[int, int]]) -> None:
+        if not spans and not leds:
+            return
+        with self._cond:
+            for start, data in spans:
+                self._mem[start:start + len(data)] = data
+            for idx, led in leds.items():
+                self._leds[idx] = led
+            self._seq += 1
+            self._keyframe = None
+            if self.clients == 0:
+                # Nobody is watching, so there is no stream to encode
+                self._events.clear()
+                return
+
+            payload = {}
+            if spans:
+                payload["spans"] = [[start, data.decode("latin-1")] for start, data in spans]
+            if leds:
+                payload["leds"] = {str(idx): list(led) for idx, led in leds.items()}
+            # Encoded once here, every viewer sends the same bytes
+            self._events.append((self._seq, _encode_event("delta", self._seq, payload)))
+            self._cond.notify_all()
+
+    def keyframe(self) -> tuple[int, bytes]:
+        with self._cond:
+            if self._keyframe is None:
+                payload = {
+                    "name": self.name,
+                    "width": self.width,
+                    "height": self.height,
+                    "text": self._mem.decode("latin-1"),
+                    "leds": _encode_leds(self._leds),
+                }
+                self._keyframe = (self._seq, _encode_event("keyframe", self._seq, payload))
+            return self._keyframe
+
+    def events_after(self, seq: int, timeout: float) -> Optional[list[bytes]]:
+        # Returns None when the viewer fell out of the history and needs a keyframe
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq != seq, timeout=timeout)
+            if self._seq == seq:
+                return []
+            if not self._events or self._events[0][0] > seq + 1:
+                return None
+            return [event for event_seq, event in self._events if event_seq > seq]
+
+    def add_client(self) -> None:
+        with self._cond:
+            self.clients += 1
+
+    def remove_client(self) -> None:
+        with self._cond:
+            self.clients -= 1
+
+class _MirrorRequestHandler(BaseHTTPRequestHandler):
+    server: "MirrorServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        if parts == ["displays"]:
+            body = dumps(self.server.display_names()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if len(parts) == 3 and parts[0] == "displays" and parts[2] == "stream":
+            mirror = self.server.get_display(parts[1])
+            if mirror is not None:
+                self._stream(mirror)
+                return
+
+        self.send_error(404)
+
+    def _stream(self, mirror: FrameMirror):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        # A viewer that cannot take a write within the timeout gets dropped
+        self.connection.settimeout(MIRROR_CLIENT_TIMEOUT)
+
+        mirror.add_client()
+        try:
+            seq, event = mirror.keyframe()
+            self.wfile.write(event)
+            self.wfile.flush()
+            while not self.server.stopping:
+                events = mirror.events_after(seq, MIRROR_KEEPALIVE)
+                if events is None:
+                    # Too slow to follow the deltas, skip ahead to the current frame
+                    seq, event = mirror.keyframe()
+                    events = [event]
+                elif events:
+                    seq += len(events)
+                else:
+                    events = [b":\n\n"]
+                self.wfile.write(b"".join(events))
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            mirror.remove_client()
+
+class MirrorServer(ThreadingHTTPServer):
+    daemon_threads = True
+    stopping: bool
+    _displays: dict[str, FrameMirror]
+    _displays_lock: Lock
+    _thread: Thread
+
+    def __init__(self, host: str = MIRROR_HOST, port: int = MIRROR_PORT):
+        super().__init__((host, port), _MirrorRequestHandler)
+        self.stopping = False
+        self._displays = {}
+        self._displays_lock = Lock()
+        self._thread = None
+
+    def add_display(self, id, name: str) -> FrameMirror:
+        mirror = FrameMirror(name)
+        with self._displays_lock:
+            self._displays[str(id)] = mirror
+        return mirror
+
+    def remove_display(self, id) -> None:
+        with self._displays_lock:
+            self._displays.pop(str(id), None)
+
+    def get_display(self, id: str) -> Optional[FrameMirror]:
+        with self._displays_lock:
+            return self._displays.get(id)
+
+    def display_names(self) -> dict[str, str]:
+        with self._displays_lock:
+            return {id: mirror.name for id, mirror in self._displays.items()}
+
+    def start(self) -> None:
+        self._thread = Thread(name="LCD mirror server", target=critical_call, args=(self.serve_forever,), daemon=True)
+        self._thread.start()
+        print(f"Serving display mirror on http://{self.server_address[0]}:{self.server_address[1]}/displays", flush=True)
+
+    def stop(self) -> None:
+        self.stopping = True
+        self.shutdown()
+        self.server_close()
+
+def create_mirror_server(mirror_config) -> Optional[MirrorServer]:
+    if mirror_config is None:
+        return None
+    host = MIRROR_HOST
+    if "host" in mirror_config:
+        host = mirror_config["host"]
+    port = MIRROR_PORT
+    if "port" in mirror_config:
+        port = mirror_config["port"]
+    return MirrorServer(host, port)
@@ -0,0 +1,312 @@
+from enum import Enum
+from threading import Thread
+from time import monotonic, sleep
+from typing import Optional
+from histogram import LatencyHistogram
+from lcd import LCD, PACKET_CONST_ELEM_LEN, LCDCircuitOpenException, LCDTimeoutException
+from link import LinkBudget
+from log import LOG
+from mailbox import Damage, FrameMailbox
+from mirror import FrameMirror
+from renderable import DEFAULT_CHAR
+from timing import STARTUP
+from utils import critical_call
+
+MIN_SPACING_BETWEEN_DIFFS = 5
+
+_MIN_SPACING_VAR = MIN_SPACING_BETWEEN_DIFFS - 1
+
+# Command and response framing around the payload of a display write
+_WRITE_OVERHEAD = PACKET_CONST_ELEM_LEN * 2 + 2
+_LED_WRITE_COST = (PACKET_CONST_ELEM_LEN * 2 + 2) * 2
+
+class RegionPriority(Enum):
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+def _merge_deferred(damage: Damage, deferred: Damage) -> Damage:
+    if damage is None or deferred is None:
+        return None
+    return damage + deferred
+
+# One physical display: its own shadow of the device memory, mailbox and
+# transmit thread, so a slow panel never holds up rendering or other panels
+class LCDOutput():
+    lcd: LCD
+    mirror: Optional[FrameMirror]
+    key_latency: LatencyHistogram
+    render_period: float
+    budget: Optional[LinkBudget]
+    priorities: bytearray
+    frames_preempted: int
+    changes_deferred: int
+    _should_run: bool
+    _mailbox: FrameMailbox
+    _transmit_thread: Optional[Thread]
+    _lcd_mem_is: bytearray
+    _lcd_led_is: list[Optional[tuple[int, int]]]
+    _initial_frame: Optional[bytes]
+    _first_frame_sent: bool
+    _deferred: Optional[tuple[bytes, Damage]]
+    # Fan and temperature reporting masks: wanted, and last acknowledged by the panel
+    _report_masks: tuple[int, int]
+    _report_masks_sent: tuple[int, int]
+
+    lcd_width: int
+    lcd_height: int
+    lcd_led_count: int
+    lcd_change_max_len: int
+    lcd_pixel_count: int
+
+    def __init__(self, lcd: LCD, initial_frame: Optional[bytes] = None, key_latency: LatencyHistogram = None):
+        self.lcd = lcd
+        self.mirror = None
+        self.key_latency = key_latency
+        if self.key_latency is None:
+            self.key_latency = LatencyHistogram("key to frame")
+        self.render_period = 1.0 / 30.0
+        self.budget = None
+        self.frames_preempted = 0
+        self.changes_deferred = 0
+        self._should_run = False
+        self._mailbox = FrameMailbox()
+        self._transmit_thread = None
+        self._lcd_mem_is = bytearray()
+        self._lcd_led_is = []
+        self._initial_frame = initial_frame
+        self._first_frame_sent = False
+        self._deferred = None
+        self._report_masks = (0, 0)
+        self._report_masks_sent = (0, 0)
+        self.lcd_width = lcd.width()
+        self.lcd_height = lcd.height()
+        self.lcd_led_count = lcd.led_count()
+        self.lcd_change_max_len = lcd.max_write_len()
+        self.lcd_pixel_count = self.lcd_width * self.lcd_height
+        self.priorities = bytearray([RegionPriority.NORMAL.value]) * self.lcd_pixel_count
+
+    @property
+    def frames_dropped(self) -> int:
+        return self._mailbox.frames_dropped
+
+    def set_budget(self, budget: Optional[LinkBudget], regions: list[tuple[int, int, RegionPriority]]) -> None:
+        priorities = bytearray([RegionPriority.NORMAL.value]) * self.lcd_pixel_count
+        for start, end, priority in regions:
+            priorities[start:end] = bytes([priority.value]) * (end - start)
+        self.priorities = priorities
+        self.budget = budget
+
+    def set_report_masks(self, fan_mask: int, temperature_mask: int) -> None:
+        # Sent by the transmit thread, which already owns the serial line
+        self._report_masks = (fan_mask, temperature_mask)
+
+    def _send_report_masks(self) -> None:
+        fan_mask, temperature_mask = self._report_masks
+        try:
+            if fan_mask != self._report_masks_sent[0]:
+                self.lcd.set_fan_reporting(fan_mask)
+                self._report_masks_sent = (fan_mask, self._report_masks_sent[1])
+            if temperature_mask != self._report_masks_sent[1]:
+                self.lcd.set_temperature_reporting(temperature_mask)
+                self._report_masks_sent = (self._report_masks_sent[0], temperature_mask)
+        except (LCDCircuitOpenException, LCDTimeoutException):
+            # Still differs from what was wanted, so the next pass tries again
+            LOG.info("LCD did not accept the sensor report masks, retrying", port=self.lcd.port)
+
+    def start(self) -> None:
+        self._should_run = True
+        self._mailbox.reopen()
+        self._transmit_thread = Thread(name=f"LCD transmit {self.lcd.port}", target=critical_call, args=(self._transmit_loop,), daemon=True)
+        self._transmit_thread.start()
+
+    def stop(self) -> None:
+        self._should_run = False
+        self._mailbox.close()
+        if self._transmit_thread is not None:
+            self._transmit_thread.join()
+            self._transmit_thread = None
+        self.lcd.close()
+
+    def put(self, data: Optional[bytes], leds: Optional[tuple[tuple[int, int], ...]], damage: Damage = None, key_time: Optional[float] = None) -> None:
+        self._mailbox.put(data, leds, damage, key_time)
+
+    def _init_shadow(self) -> None:
+        if self._initial_frame is not None and len(self._initial_frame) == self.lcd_pixel_count:
+            # Keep showing the splash until the first page frame replaces it, the probe already turned the LEDs off
+            self._lcd_mem_is = bytearray(self._initial_frame)
+            self._lcd_led_is = [(0, 0)] * self.lcd_led_count
+        else:
+            try:
+                self.lcd.clear()
+                self._lcd_mem_is = bytearray([DEFAULT_CHAR]) * self.lcd_pixel_count
+                # Whatever the LEDs showed before a restart is stale
+                for idx in range(self.lcd_led_count):
+                    self.lcd.write_led(idx, 0, 0)
+                self._lcd_led_is = [(0, 0)] * self.lcd_led_count
+            except LCDTimeoutException:
+                # Contents unknown, so the first frame has to rewrite every cell and LED
+                LOG.info("LCD did not answer the initial clear", port=self.lcd.port)
+                self._lcd_mem_is = bytearray(self.lcd_pixel_count)
+                self._lcd_led_is = [None] * self.lcd_led_count
+        self._initial_frame = None
+        if self.mirror is not None:
+            self.mirror.reset(self.lcd_width, self.lcd_height, self._lcd_mem_is, self._lcd_led_is)
+
+    def _transmit_loop(self):
+        self._init_shadow()
+        self._deferred = None
+        self._report_masks_sent = (0, 0)
+        if self.budget is not None:
+            self.budget.reset()
+
+        while self._should_run:
+            if self._report_masks != self._report_masks_sent:
+                self._send_report_masks()
+            frame = self._mailbox.take(timeout=self.render_period)
+            if frame is None:
+                if self._deferred is None:
+                    continue
+                # Nothing new, but the budget has refilled a bit for what was held back
+                frame = (None, None, [], None)
+            data, leds, damage, key_time = frame
+
+            if self._deferred is not None:
+                # Cells held back last time are rescanned against the newest content
+                deferred_data, deferred_damage = self._deferred
+                self._deferred = None
+                if data is None:
+                    data = deferred_data
+                    damage = deferred_damage
+                else:
+                    damage = _merge_deferred(damage, deferred_damage)
+
+            try:
+                if data is not None:
+                    if not self._render_send_display(data, damage, preemptible=key_time is None, urgent=key_time is not None):
+                        # A key-triggered frame is waiting and already carries the unsent rest of this one
+                        self.frames_preempted += 1
+                        self._mailbox.put_back(None, leds)
+                        continue
+                    data = None
+                    if not self._first_frame_sent:
+                        self._first_frame_sent = True
+                        STARTUP.mark(f"first frame on {self.lcd.port}")
+                if key_time is not None:
+                    self.key_latency.record(monotonic() - key_time)
+                    key_time = None
+                if leds is not None:
+                    if not self._render_send_leds(leds, preemptible=True):
+                        self._mailbox.put_back(None, leds)
+                    leds = None
+            except LCDCircuitOpenException:
+                self._mailbox.put_back(data, leds, key_time)
+                sleep(self.render_period)
+            except LCDTimeoutException:
+                LOG.info("LCD timed out during transmit, retrying with latest frame", port=self.lcd.port)
+                self._mailbox.put_back(data, leds, key_time)
+
+    def _render_send_leds(self, leds: tuple[tuple[int, int], ...], preemptible: bool = False) -> bool:
+        sent = {}
+        try:
+            for idx, (red, green) in enumerate(leds):
+                if self._lcd_led_is[idx] == (red, green):
+                    continue
+                if preemptible and self._mailbox.priority_pending():
+                    return False
+                if self.budget is not None:
+                    # LEDs are status, so they always go out
+                    self.budget.spend(_LED_WRITE_COST)
+                self.lcd.write_led(idx, red, green)
+                self._lcd_led_is[idx] = (red, green)
+                sent[idx] = (red, green)
+            return True
+        finally:
+            if self.mirror is not None:
+                self.mirror.publish([], sent)
+
+    def _merge_damage(self, damage: Damage) -> list[tuple[int, int]]:
+        if damage is None:
+            return [(0, self.lcd_pixel_count)]
+
+        merged: list[tuple[int, int]] = []
+        for start, end in sorted(damage):
+            # Gaps shorter than the diff spacing get scanned so changes merge like a full scan would
+            if merged and start - merged[-1][1] < MIN_SPACING_BETWEEN_DIFFS:
+                if end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], end)
+                continue
+            merged.append((start, end))
+        return merged
+
+    def _plan_changes(self, data: bytes, damage: Damage = None) -> list[tuple[int, int]]:
+        changes: list[tuple[int, int]] = []
+
+        change_start = -1
+        change_end = -1
+        for span_start, span_end in self._merge_damage(damage):
+            for i in range(span_start, span_end):
+                diff = self._lcd_mem_is[i] != data[i]
+                if diff:
+                    if change_start < 0:
+                        change_start = i
+                    elif i - change_start >= self.lcd_change_max_len:
+                        if change_end < 0:
+                            change_end = i
+                        changes.append((change_start, change_end))
+                        change_start = i
+                        change_end = -1
+                    elif change_end >= 0:
+                        change_end = -1
+                elif change_start >= 0:
+                    if change_end < 0:
+                        change_end = i
+
+                    if i - change_end >= _MIN_SPACING_VAR:
+                        changes.append((change_start, change_end))
+                        change_start = -1
+                        change_end = -1
+
+            # Undamaged cells past the span match the device, so any open change ends here
+            if change_start >= 0:
+                if change_end < 0:
+                    change_end = span_end
+                changes.append((change_start, change_end))
+                change_start = -1
+                change_end = -1
+
+        return changes
+
+    def _render_send_display(self, data: bytes, damage: Damage = None, preemptible: bool = False, urgent: bool = False) -> bool:
+        changes = self._plan_changes(data, damage)
+
+        budget = self.budget
+        if budget is not None and not urgent:
+            # Most important first, so a tight budget runs out on the cheap stuff
+            changes.sort(key=lambda change: -max(self.priorities[change[0]:change[1]]))
+
+        sent = []
+        deferred = []
+        try:
+            for idx, (start, end) in enumerate(changes):
+                if preemptible and self._mailbox.priority_pending():
+                    # The damage tracking only knows what changed in the page, not what the device is missing
+                    self._mailbox.carry_over(data, changes[idx:])
+                    return False
+                if budget is not None:
+                    cost = _WRITE_OVERHEAD + end - start
+                    if not urgent and max(self.priorities[start:end]) < RegionPriority.HIGH.value and not budget.available(cost):
+                        deferred.append((start, end))
+                        continue
+                    budget.spend(cost)
+                self.lcd.write(start % self.lcd_width, start // self.lcd_width, data[start:end])
+                self._lcd_mem_is[start:end] = data[start:end]
+                sent.append((start, bytes(data[start:end])))
+            return True
+        finally:
+            if deferred:
+                self.changes_deferred += len(deferred)
+                self._deferred = (data, deferred)
+            # The mirror follows what actually reached the device, including partial frames
+            if self.mirror is not None:
+                self.mirror.publish(sent, {})
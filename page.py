@@ -1,5 +1,7 @@
+from typing import Optional
 from drivers.paged import PagedLCDDriver
-from renderable import Renderable
+from layout import Layout, layout_rows
+from renderable import Renderable, RenderLayer
 from utils import LEDColorPreset
 
 class LCDPage(Renderable):
@@ -7,14 +9,30 @@ class LCDPage(Renderable):
     driver: PagedLCDDriver
     formatted_title: str
     title: str
+    layout_templates: dict[int, str]
+    layout: Layout
+    title_layer: RenderLayer
+    status_layer: RenderLayer
+    alert_layer: RenderLayer
+    _alert: Optional[tuple[str, int]]
 
-    def __init__(self, config, driver: PagedLCDDriver, default_title: str = "UNTITLED"):
+    def __init__(self, config, driver: PagedLCDDriver, default_title: str = "UNTITLED", default_layout: dict[int, str] = None):
+        super().__init__()
         self.driver = driver
         self.title = default_title
         if "title" in config:
             self.title = config["title"]
+        self.layout_templates = default_layout
+        if "layout" in config:
+            self.layout_templates = {**layout_rows(default_layout), **layout_rows(config["layout"])}
         self.should_run = False
         self.formatted_title = None
+        self.layout = None
+        # Above the page content, bottom to top
+        self.title_layer = self.add_layer("title")
+        self.status_layer = self.add_layer("status")
+        self.alert_layer = self.add_layer("alert")
+        self._alert = None
 
     def is_current(self) -> bool:
         return self.driver.pages[self.driver.current_page] == self
@@ -39,11 +57,31 @@ class LCDPage(Renderable):
         self.init_arrays(self.driver.lcd_height, self.driver.lcd_width, self.driver.lcd_led_count)
         self.should_run = True
         self.formatted_title = self.format_text_center(self.title, "=")
-        self.set_line(0, self.formatted_title)
+        self.title_layer.write_at(0, 0, self.formatted_title)
+        self._alert = None
+        if self.layout_templates is not None:
+            self.layout = Layout(self.layout_templates, self.driver.lcd_width)
+        self.commit()
 
     def stop(self):
         self.should_run = False
 
+    def set_alert(self, text: Optional[str], row: int = 1) -> None:
+        alert = None if text is None else (text, row)
+        if alert == self._alert:
+            return
+        self._alert = alert
+        self.alert_layer.clear()
+        if text is not None:
+            self.alert_layer.write_at(0, row, self.format_text_center(text, " "))
+
+    def set_field(self, name: str, value) -> None:
+        self.layout.set(self, name, value)
+
+    def set_fields(self, **values) -> None:
+        for name, value in values.items():
+            self.layout.set(self, name, value)
+
     def format_text_center(self, text: str, pad_char: str) -> str:
         text_len = len(text)
         if text_len > self.driver.lcd_width:
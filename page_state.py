@@ -0,0 +1,183 @@
+from dataclasses import dataclass
+from hashlib import sha1
+from json import dump, dumps, load
+from os import fsync, makedirs, path, replace
+from random import uniform
+from threading import Event, Lock, Thread
+from time import time
+from typing import Optional
+from log import LOG
+
+PAGE_STATE_PATH = "/var/lib/lcdify/page_state.json"
+PAGE_STATE_VERSION = 1
+PAGE_STATE_INTERVAL = 30.0
+PAGE_STATE_MAX_AGE = 24 * 60 * 60
+# Restored pages start their first update somewhere within this window
+PAGE_STATE_SPREAD = 10.0
+
+@dataclass
+class PageState():
+    width: int
+    height: int
+    mem: bytes
+    leds: list[tuple[int, int]]
+    values: dict
+    # Wall clock, so the age survives the restart
+    data_time: float
+
+    def to_json(self) -> dict:
+        return {
+            "width": self.width,
+            "height": self.height,
+            "mem": self.mem.decode("latin-1"),
+            "leds": [list(led) for led in self.leds],
+            "values": self.values,
+            "data_time": self.data_time,
+        }
+
+    @staticmethod
+    def from_json(entry: dict) -> "PageState":
+        return PageState(
+            width=entry["width"],
+            height=entry["height"],
+            mem=entry["mem"].encode("latin-1"),
+            leds=[tuple(led) for led in entry["leds"]],
+            values=entry["values"],
+            data_time=entry["data_time"],
+        )
+
+def page_state_key(page_config) -> str:
+    # Pages with the same config show the same data, whichever display they are on
+    return sha1(dumps(page_config, sort_keys=True, default=str).encode()).hexdigest()
+
+class PageStateStore():
+    path: str
+    interval: float
+    max_age: float
+    spread: float
+    _lock: Lock
+    # Loaded from disk and not claimed by a running page yet
+    _saved: dict[str, PageState]
+    _pages: dict[str, object]
+    _written: dict[str, tuple]
+    _stop: Event
+    _thread: Optional[Thread]
+
+    def __init__(self, file_path: str, interval: float = PAGE_STATE_INTERVAL, max_age: float = PAGE_STATE_MAX_AGE, spread: float = PAGE_STATE_SPREAD):
+        self.path = file_path
+        self.interval = interval
+        self.max_age = max_age
+        self.spread = spread
+        self._lock = Lock()
+        self._saved = {}
+        self._pages = {}
+        self._written = {}
+        self._stop = Event()
+        self._thread = None
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                data = load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            LOG.exception("Could not read page state, starting cold", path=self.path)
+            return
+        if data.get("version") != PAGE_STATE_VERSION:
+            return
+
+        now = time()
+        saved = {}
+        for key, entry in data.get("pages", {}).items():
+            try:
+                state = PageState.from_json(entry)
+            except (KeyError, TypeError, ValueError):
+                continue
+            if now - state.data_time > self.max_age:
+                continue
+            saved[key] = state
+        with self._lock:
+            self._saved = saved
+
+    def register(self, key: str, page) -> Optional[PageState]:
+        with self._lock:
+            self._pages[key] = page
+            return self._saved.pop(key, None)
+
+    def unregister(self, key: str, page) -> None:
+        with self._lock:
+            if self._pages.get(key) is page:
+                del self._pages[key]
+
+    def initial_delay(self, update_period: float) -> float:
+        return uniform(0, min(self.spread, update_period))
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = Thread(name="Page state writer", target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self) -> None:
+        with self._lock:
+            pages = list(self._pages.items())
+            entries = dict(self._saved)
+
+        for key, page in pages:
+            state = page.snapshot_state()
+            if state is not None:
+                entries[key] = state
+
+        # Only touch the disk when something on screen actually changed
+        written = {key: (state.mem, tuple(state.leds), round(state.data_time)) for key, state in entries.items()}
+        if written == self._written:
+            return
+
+        try:
+            makedirs(path.dirname(self.path) or ".", exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                dump({"version": PAGE_STATE_VERSION, "pages": {key: state.to_json() for key, state in entries.items()}}, f)
+                f.flush()
+                fsync(f.fileno())
+            # Readers see either the old snapshot or the new one, never half of one
+            replace(temp_path, self.path)
+            self._written = written
+        except (OSError, TypeError, ValueError):
+            LOG.exception("Could not write page state", path=self.path)
+
+_store: Optional[PageStateStore] = None
+
+def configure(page_state_config, suffix: str = "") -> None:
+    global _store
+    if _store is not None:
+        _store.stop()
+        _store = None
+    if page_state_config is None:
+        return
+    store = PageStateStore(
+        page_state_config.get("path", PAGE_STATE_PATH) + suffix,
+        interval=page_state_config.get("interval", PAGE_STATE_INTERVAL),
+        max_age=page_state_config.get("max_age", PAGE_STATE_MAX_AGE),
+        spread=page_state_config.get("spread", PAGE_STATE_SPREAD),
+    )
+    store.load()
+    store.start()
+    _store = store
+
+def current() -> Optional[PageStateStore]:
+    return _store
+
+def shutdown() -> None:
+    configure(None)
@@ -1,46 +1,83 @@
 from enum import Enum
 from threading import Condition, Thread
-from traceback import print_exc
+from time import monotonic, time
+from typing import Optional
 from drivers.paged import PagedLCDDriver
+from histogram import LatencyHistogram
+from log import LOG
 from page import LCDPage
-from utils import LEDColorPreset, critical_call
+from page_state import PageState, page_state_key
+import page_state
+from prometheus import query_scope
+from utils import LEDColorPreset, critical_call, format_age
+
+UPDATE_DEADLINE = 10
+AGE_INDICATOR_WIDTH = 3
+# Data older than this many update periods gets an age indicator
+STALE_AFTER_PERIODS = 2
+# How often the age indicator ticks between updates
+AGE_REFRESH_INTERVAL = 1.0
 
 class UpdateStatus(Enum):
     NONE = (LEDColorPreset.OFF.value, "?")
     RUNNING = (LEDColorPreset.WARNING.value, "\xBB")
     SUCCESS = (LEDColorPreset.OFF.value, "=")
+    STALE = (LEDColorPreset.WARNING.value, "~")
     ERROR = (LEDColorPreset.CRITICAL.value, "!")
 
 class UpdatingLCDPage(LCDPage):
     update_period: float
+    update_deadline: float
     use_led0_for_updates: bool
     use_char0_for_updates: bool
+    update_latency: LatencyHistogram
+    update_failures: int
     _update_wait: Condition
     _update_thread: Thread
     _update_status: UpdateStatus
+    _data_time: Optional[float]
+    _restored: bool
+    state_key: str
 
-    def __init__(self, config, driver: PagedLCDDriver, default_title: str = None):
-        super().__init__(config, driver, default_title)
+    def __init__(self, config, driver: PagedLCDDriver, default_title: str = None, default_layout: dict[int, str] = None):
+        super().__init__(config, driver, default_title, default_layout)
 
         self.use_led0_for_updates = True
         self.use_char0_for_updates = True
         self._update_status = UpdateStatus.NONE
+        self._data_time = None
+        self.update_latency = LatencyHistogram("page update")
+        self.update_failures = 0
+        self._restored = False
+        self.state_key = page_state_key(config)
 
         self.update_period = 30
         if "update_period" in config:
             self.update_period = config["update_period"]
 
+        self.update_deadline = min(self.update_period, UPDATE_DEADLINE)
+        if "update_deadline" in config:
+            self.update_deadline = config["update_deadline"]
+
         self._update_wait = Condition()
         self._update_thread = None
 
     def start(self):
         super().start()
-        self.write_at(0, 1, "Loading...")
+        self._restored = self._restore_state()
+        if self._restored:
+            self._set_update_status(UpdateStatus.STALE)
+        else:
+            self.write_at(0, 1, "Loading...")
+            self.commit()
         self._update_thread = Thread(name=f"LCDPage update {self.title}", target=critical_call, args=(self._update_loop,), daemon=True)
         self._update_thread.start()
 
     def stop(self):
         super().stop()
+        store = page_state.current()
+        if store is not None:
+            store.unregister(self.state_key, self)
         self._update_wait.acquire()
         self._update_wait.notify()
         self._update_wait.release()
@@ -48,26 +85,106 @@ class UpdatingLCDPage(LCDPage):
             self._update_thread.join()
             self._update_thread = None
 
+    def _restore_state(self) -> bool:
+        store = page_state.current()
+        if store is None:
+            return False
+        state = store.register(self.state_key, self)
+        if state is None:
+            return False
+        if (state.width, state.height, len(state.leds)) != (self.lcd_width, self.lcd_height, self.lcd_led_count):
+            return False
+
+        self.lcd_mem_set[:] = state.mem
+        self.add_damage()
+        for idx, color in enumerate(state.leds):
+            self.set_led(idx, color)
+        if self.layout is not None and state.values:
+            # Redrawn through the current layout, in case it changed since the snapshot
+            self.layout.invalidate()
+            self.set_fields(**state.values)
+        self._data_time = monotonic() - max(time() - state.data_time, 0)
+        return True
+
+    def snapshot_state(self) -> Optional[PageState]:
+        # Called from the state writer, so it only reads what commit() published. Only the content
+        # layer is saved: the restarted page redraws its overlays, baked into the content they would stick
+        data_time = self._data_time
+        committed = self.front_content()
+        if data_time is None or committed is None:
+            return None
+        data, (_, leds, _) = committed
+        values = {}
+        if self.layout is not None:
+            values = {name: value for name, value in self.layout.values().items() if isinstance(value, (str, int, float))}
+        return PageState(
+            width=self.lcd_width,
+            height=self.lcd_height,
+            mem=data,
+            leds=list(leds),
+            values=values,
+            data_time=time() - (monotonic() - data_time),
+        )
+
     def _update_loop(self):
+        store = page_state.current()
+        if self._restored and store is not None:
+            # The restored frame is already useful, so these queries need not all go out at once
+            self._update_wait.acquire()
+            self._update_wait.wait(store.initial_delay(self.update_period))
+            self._update_wait.release()
+
         while self.should_run:
             self._set_update_status(UpdateStatus.RUNNING)
+            update_start = monotonic()
             try:
-                self.update()
-                self._set_update_status(UpdateStatus.SUCCESS)
+                with query_scope(self.update_deadline) as scope:
+                    self.update()
+                # Values that fell back to stale query results are only as fresh as the oldest of them
+                self._data_time = monotonic() - scope.stale_age
+                if scope.stale_age > 0:
+                    self._set_update_status(UpdateStatus.STALE)
+                else:
+                    self._set_update_status(UpdateStatus.SUCCESS)
             except Exception:
+                # The last good values stay on screen, marked by the status and their age
+                self.update_failures += 1
                 self._set_update_status(UpdateStatus.ERROR)
-                print_exc()
+                LOG.exception("Page update failed", page=self.title)
+            self.update_latency.record(monotonic() - update_start)
+            self._wait_for_next_update()
 
-            self._update_wait.acquire()
-            self._update_wait.wait(self.update_period)
-            self._update_wait.release()
+    def _wait_for_next_update(self):
+        next_update = monotonic() + self.update_period
+        with self._update_wait:
+            while self.should_run:
+                remaining = next_update - monotonic()
+                if remaining <= 0:
+                    return
+                self._update_wait.wait(min(remaining, AGE_REFRESH_INTERVAL))
+                # Stale data keeps showing its growing age, not the age at the last update
+                if self._data_time is not None:
+                    self._show_data_age()
+                    self.commit()
 
     def _set_update_status(self, status: UpdateStatus):
         self._update_status = status
         if self.use_led0_for_updates:
             self.set_led(0, self._update_status.value[0])
         if self.use_char0_for_updates:
-            self.write_at(0, 0, self._update_status.value[1])
+            self.status_layer.write_at(0, 0, self._update_status.value[1])
+        self._show_data_age()
+        self.commit()
+
+    def _show_data_age(self):
+        start = self.lcd_width - AGE_INDICATOR_WIDTH
+        if self._data_time is None:
+            return
+        age = monotonic() - self._data_time
+        if age <= self.update_period * STALE_AFTER_PERIODS:
+            self.status_layer.clear_at(start, 0, AGE_INDICATOR_WIDTH)
+            return
+        self.status_layer.write_at(start, 0, format_age(age).rjust(AGE_INDICATOR_WIDTH))
 
     def update(self):
         pass
@@ -16,6 +16,6 @@ class DiffTestLCDPage(UpdatingLCDPage):
         self.clear()
         for i in range(self.i):
             self.lcd_mem_set[self.lcd_pixel_count - (self.x + i)] = (self.i % 10) + ord('0')
-        self.dirty = True
+        self.add_damage()
 
 PAGE = DiffTestLCDPage
@@ -0,0 +1,99 @@
+from threading import Condition, Lock, Thread
+from typing import Optional
+from drivers.paged import PagedLCDDriver
+from log import LOG
+from page import LCDPage
+from shared_framebuffer import SharedFramebuffer, framebuffer_path
+from utils import critical_call
+
+FRAMEBUFFER_POLL_INTERVAL = 0.05
+
+class FramebufferLCDPage(LCDPage):
+    path: str
+    first_row: int
+    poll_interval: float
+    _framebuffer: Optional[SharedFramebuffer]
+    _sequence: int
+    _framebuffer_lock: Lock
+    _poll_wait: Condition
+    _poll_thread: Optional[Thread]
+
+    def __init__(self, config, driver: PagedLCDDriver):
+        super().__init__(config, driver, "EXTERNAL")
+        self.path = framebuffer_path(self.title)
+        if "path" in config:
+            self.path = config["path"]
+        # Row 0 keeps the title unless the external writer wants the whole display
+        self.first_row = 1
+        if "first_row" in config:
+            self.first_row = config["first_row"]
+        self.poll_interval = FRAMEBUFFER_POLL_INTERVAL
+        if "poll_interval" in config:
+            self.poll_interval = config["poll_interval"]
+        self._framebuffer = None
+        self._sequence = -1
+        self._framebuffer_lock = Lock()
+        self._poll_wait = Condition()
+        self._poll_thread = None
+
+    def start(self):
+        super().start()
+        if self.first_row == 0:
+            self.title_layer.clear()
+        try:
+            framebuffer = SharedFramebuffer(
+                self.path,
+                width=self.driver.lcd_width,
+                height=self.driver.lcd_height - self.first_row,
+                led_count=self.driver.lcd_led_count,
+            )
+        except (OSError, ValueError):
+            # The rest of the display keeps working, this page just says what is wrong
+            LOG.exception("Could not open framebuffer", page=self.title, path=self.path)
+            self.set_alert("NO FRAMEBUFFER")
+            self.commit()
+            return
+        with self._framebuffer_lock:
+            self._sequence = -1
+            self._framebuffer = framebuffer
+        self._poll_thread = Thread(name=f"LCDPage poll {self.title}", target=critical_call, args=(self._poll_loop,), daemon=True)
+        self._poll_thread.start()
+
+    def stop(self):
+        super().stop()
+        with self._poll_wait:
+            self._poll_wait.notify()
+        if self._poll_thread is not None:
+            self._poll_thread.join()
+            self._poll_thread = None
+        with self._framebuffer_lock:
+            if self._framebuffer is not None:
+                self._framebuffer.close()
+                self._framebuffer = None
+
+    def _poll_loop(self) -> None:
+        # Off the render thread, like the updating pages; an unchanged sequence costs one 4-byte read
+        while self.should_run:
+            self._poll()
+            with self._poll_wait:
+                if self.should_run:
+                    self._poll_wait.wait(self.poll_interval)
+
+    def _poll(self) -> None:
+        with self._framebuffer_lock:
+            framebuffer = self._framebuffer
+            if framebuffer is None:
+                return
+            frame = framebuffer.read(self._sequence)
+            if frame is None:
+                return
+            self._sequence, mem, leds = frame
+
+        width = framebuffer.width
+        for row in range(framebuffer.height):
+            self.write_at(0, self.first_row + row, mem[row * width:(row + 1) * width].decode("latin-1"))
+        for idx, led in enumerate(leds):
+            self.set_led(idx, led)
+        self.commit()
+
+PAGE = FramebufferLCDPage
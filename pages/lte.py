@@ -7,9 +7,15 @@ CONVERT_BYTES_TO_MB = 1024 * 1024
 
 LTE_DATA_LIMIT = 2000
 
+LTE_LAYOUT = {
+    1: "RSRP {rsrp:4.0f} / RSRQ {rsrq:3.0f}",
+    2: "RSSI {rssi:4.0f} / SNR  {snr:3.0f}",
+    3: "RX  {rx:5.0f} / TX {tx:5.0f}",
+}
+
 class LTELCDPage(UpdatingLCDPage):
     def __init__(self, config, driver: PagedLCDDriver):
-        super().__init__(config, driver, "LTE (MB)")
+        super().__init__(config, driver, "LTE (MB)", LTE_LAYOUT)
         self.filter = build_prometheus_filter(config["filter"])
 
     def update(self):
@@ -25,15 +31,15 @@ class LTELCDPage(UpdatingLCDPage):
             self.calc_led_lower_threshhold(lte_rsrp, -90, -100),
             self.calc_led_lower_threshhold(lte_rsrq, -15, -20)
         ]).value)
-        self.set_line(1, f"RSRP {lte_rsrp:4.0f} / RSRQ {lte_rsrq:3.0f}")
+        self.set_fields(rsrp=lte_rsrp, rsrq=lte_rsrq)
         
         self.set_led(2, LEDColorPreset.get_most_critical([
             self.calc_led_lower_threshhold(lte_rssi, -75, -85),
             self.calc_led_lower_threshhold(lte_snr, 13, 0)
         ]).value)
-        self.set_line(2, f"RSSI {lte_rssi:4.0f} / SNR  {lte_snr:3.0f}")
+        self.set_fields(rssi=lte_rssi, snr=lte_snr)
         
         self.set_led(3, self.calc_led_upper_threshhold(lte_rx + lte_tx, LTE_DATA_LIMIT * 0.75, LTE_DATA_LIMIT).value)
-        self.set_line(3, f"RX  {lte_rx:5.0f} / TX {lte_tx:5.0f}")
+        self.set_fields(rx=lte_rx, tx=lte_tx)
 
 PAGE = LTELCDPage
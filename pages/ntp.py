@@ -1,26 +1,63 @@
 from drivers.paged import PagedLCDDriver
+from exporter import MetricSelector, scrape_exporter_values
 from page_updating import UpdatingLCDPage
 from prometheus import build_prometheus_filter, query_prometheus_first_value
 from utils import LEDColorPreset
 
+NTP_LAYOUT = {
+    1: "Err {error:12.6f} ms",
+    2: "Adj {adjustment:12.6f} ppm",
+    3: "Str {stratum:2.0f}    /  San {sanity:3.0f}",
+}
+
 class NTPLCDPage(UpdatingLCDPage):
     def __init__(self, config, driver: PagedLCDDriver):
-        super().__init__(config, driver, "NTP")
-        self.filter = build_prometheus_filter(config["filter"])
+        super().__init__(config, driver, "NTP", NTP_LAYOUT)
+        self.exporter_url = None
+        if "exporter" in config:
+            # Scrape node_exporter directly instead of going through Prometheus
+            self.exporter_url = config["exporter"]["url"]
+            exporter_filter = config["exporter"].get("filter", {})
+            self.selectors = {
+                "error": MetricSelector("node_timex_estimated_error_seconds", exporter_filter),
+                "frequency": MetricSelector("node_timex_frequency_adjustment_ratio", exporter_filter),
+                "stratum": MetricSelector("node_ntp_stratum", exporter_filter),
+                "sanity": MetricSelector("node_ntp_sanity", exporter_filter),
+            }
+        else:
+            self.filter = build_prometheus_filter(config["filter"])
+
+    def _fetch_prometheus(self):
+        return (
+            query_prometheus_first_value(f"node_timex_estimated_error_seconds{self.filter}") * 1_000,
+            query_prometheus_first_value(f"(node_timex_frequency_adjustment_ratio{self.filter} - 1) * 1000000"),
+            query_prometheus_first_value(f"node_ntp_stratum{self.filter}"),
+            query_prometheus_first_value(f"node_ntp_sanity{self.filter}") * 100,
+        )
+
+    def _fetch_exporter(self):
+        values = scrape_exporter_values(self.exporter_url, self.selectors)
+        return (
+            values["error"] * 1_000,
+            (values["frequency"] - 1) * 1000000,
+            values["stratum"],
+            values["sanity"] * 100,
+        )
 
     def update(self):
-        ntp_estimated_error_res = query_prometheus_first_value(f"node_timex_estimated_error_seconds{self.filter}") * 1_000
-        ntp_ppm_adjustment_res = query_prometheus_first_value(f"(node_timex_frequency_adjustment_ratio{self.filter} - 1) * 1000000")
-        ntp_stratum_res = query_prometheus_first_value(f"node_ntp_stratum{self.filter}")
-        ntp_sanity_res = query_prometheus_first_value(f"node_ntp_sanity{self.filter}") * 100
+        if self.exporter_url is not None:
+            fetch = self._fetch_exporter
+        else:
+            fetch = self._fetch_prometheus
+        ntp_estimated_error_res, ntp_ppm_adjustment_res, ntp_stratum_res, ntp_sanity_res = fetch()
 
-        self.set_line(1, f"Err {ntp_estimated_error_res:12.6f} ms")
+        self.set_field("error", ntp_estimated_error_res)
         self.set_led(1, self.calc_led_upper_threshhold(ntp_estimated_error_res, 0.001, 1).value)
 
-        self.set_line(2, f"Adj {ntp_ppm_adjustment_res:12.6f} ppm")
+        self.set_field("adjustment", ntp_ppm_adjustment_res)
         self.set_led(2, self.calc_led_upper_threshhold(abs(ntp_ppm_adjustment_res), 20, 100).value)
 
-        self.set_line(3, f"Str {ntp_stratum_res:2.0f}    /  San {ntp_sanity_res:3.0f}")
+        self.set_fields(stratum=ntp_stratum_res, sanity=ntp_sanity_res)
         led3_color = LEDColorPreset.NORMAL
         if ntp_stratum_res != 1:
             led3_color = LEDColorPreset.WARNING
@@ -1,16 +1,31 @@
 from drivers.paged import PagedLCDDriver
+from exporter import MetricSelector, samples_map_by, scrape_exporter
 from page_updating import UpdatingLCDPage
 from prometheus import query_prometheus_map_by
 from utils import LEDColorPreset
 
+PING_LAYOUT = {
+    1: "WAN {internet_rtt:4.0f} ms / {internet_loss:4.0f} %",
+    2: "ETH {wired_rtt:4.0f} ms / {wired_loss:4.0f} %",
+    #3: "LTE {lte_rtt:4.0f} ms / {lte_loss:4.0f} %",
+}
+
 class PingLCDPage(UpdatingLCDPage):
     def __init__(self, config, driver: PagedLCDDriver):
-        super().__init__(config, driver, "PING RTT / LOSS")
+        super().__init__(config, driver, "PING RTT / LOSS", PING_LAYOUT)
+        self.exporter_url = None
+        if "exporter" in config:
+            self.exporter_url = config["exporter"]["url"]
+            exporter_filter = config["exporter"].get("filter", {})
+            self.selectors = {
+                "rtt": MetricSelector("ping_average_response_ms", exporter_filter, first_only=False),
+                "loss": MetricSelector("ping_percent_packet_loss", exporter_filter, first_only=False),
+            }
 
     def _calc_loss_led(self, packet_loss_res, iface: str, loss: float):
         return self.calc_led_upper_threshhold(loss, 5, 90)
 
-    def _make_line_res(self, idx: int, name: str, ping_rtt_res, packet_loss_res, iface: str, ping_warn: int, ping_crit: int):
+    def _make_line_res(self, idx: int, ping_rtt_res, packet_loss_res, iface: str, ping_warn: int, ping_crit: int):
         packet_loss = 100
         ping_rtt = 9999
         if iface in ping_rtt_res:
@@ -23,14 +38,23 @@ class PingLCDPage(UpdatingLCDPage):
             self.calc_led_upper_threshhold(ping_rtt, ping_warn, ping_crit)
         ]).value)
 
-        self.set_line(idx, f"{name} {ping_rtt:4.0f} ms / {packet_loss:4.0f} %")
+        self.set_field(f"{iface}_rtt", ping_rtt)
+        self.set_field(f"{iface}_loss", packet_loss)
 
-    def update(self):
-        ping_rtt_res = query_prometheus_map_by("ping_average_response_ms > 0")
-        packet_loss_res = query_prometheus_map_by("ping_percent_packet_loss")
+    def _fetch_exporter(self):
+        results = scrape_exporter(self.exporter_url, self.selectors)
+        ping_rtt_res = {name: rtt for name, rtt in samples_map_by(results["rtt"]).items() if rtt > 0}
+        return ping_rtt_res, samples_map_by(results["loss"])
 
-        self._make_line_res(1, "WAN", ping_rtt_res, packet_loss_res, "internet", 10, 50)
-        self._make_line_res(2, "ETH", ping_rtt_res, packet_loss_res, "wired", 10, 50)
-        #self._make_line_res(3, "LTE", ping_rtt_res, packet_loss_res, "lte", 100, 300)
+    def update(self):
+        if self.exporter_url is not None:
+            ping_rtt_res, packet_loss_res = self._fetch_exporter()
+        else:
+            ping_rtt_res = query_prometheus_map_by("ping_average_response_ms > 0")
+            packet_loss_res = query_prometheus_map_by("ping_percent_packet_loss")
+
+        self._make_line_res(1, ping_rtt_res, packet_loss_res, "internet", 10, 50)
+        self._make_line_res(2, ping_rtt_res, packet_loss_res, "wired", 10, 50)
+        #self._make_line_res(3, ping_rtt_res, packet_loss_res, "lte", 100, 300)
 
 PAGE = PingLCDPage
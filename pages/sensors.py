@@ -0,0 +1,89 @@
+from drivers.paged import PagedLCDDriver
+from lcd import FAN_COUNT, TEMPERATURE_SENSOR_COUNT, LCDFanReport, LCDTemperatureReport
+from page import LCDPage
+
+SENSORS_PER_ROW = 2
+SENSOR_ROWS = 3
+
+def _build_layout(fans: list[int], sensors: list[int], width: int = 20) -> dict[int, str]:
+    # (template, rendered width)
+    items = [(f"F{fan} {{fan{fan}:5.0f}}", len(f"F{fan} ") + 5) for fan in fans]
+    items += [(f"T{sensor} {{temp{sensor}:5.1f}}C", len(f"T{sensor} ") + 6) for sensor in sensors]
+    item_width = width // SENSORS_PER_ROW
+    rows = []
+    row, row_width, row_items = "", 0, 0
+    for template, rendered_width in items:
+        if rendered_width > width:
+            raise ValueError(f"Sensor item {template} does not fit a line of {width} characters")
+        # Items share a row in columns while they fit, two-digit sensor IDs may need a row each
+        gap = max(item_width * row_items - row_width, 1)
+        if row_items > 0 and (row_items >= SENSORS_PER_ROW or row_width + gap + rendered_width > width):
+            rows.append(row)
+            row, row_width, row_items = "", 0, 0
+            gap = 0
+        if row_items > 0:
+            row += " " * gap
+            row_width += gap
+        row += template
+        row_width += rendered_width
+        row_items += 1
+    if row_items > 0:
+        rows.append(row)
+    if len(rows) > SENSOR_ROWS:
+        raise ValueError(f"The configured fans and sensors need {len(rows)} rows, only {SENSOR_ROWS} fit on one page")
+    return {1 + idx: row for idx, row in enumerate(rows)}
+
+class SensorsLCDPage(LCDPage):
+    fans: list[int]
+    sensors: list[int]
+    _subscribed: bool
+
+    def __init__(self, config, driver: PagedLCDDriver):
+        self.fans = config.get("fans", [])
+        self.sensors = config.get("sensors", [])
+        # Checked here so a bad config fails when it is loaded, not when the page starts
+        for fan in self.fans:
+            if not 0 <= fan < FAN_COUNT:
+                raise ValueError(f"Fan {fan} does not exist, the LCD has fans 0 to {FAN_COUNT - 1}")
+        for sensor in self.sensors:
+            if not 0 <= sensor < TEMPERATURE_SENSOR_COUNT:
+                raise ValueError(f"Temperature sensor {sensor} does not exist, the LCD has sensors 0 to {TEMPERATURE_SENSOR_COUNT - 1}")
+        self._subscribed = False
+        super().__init__(config, driver, "SENSORS", _build_layout(self.fans, self.sensors))
+
+    def start(self):
+        super().start()
+        self.write_at(0, 1, "Waiting for reports")
+        self.commit()
+        self.driver.register_fan_report_handler(self._on_fan_report)
+        self.driver.register_temperature_report_handler(self._on_temperature_report)
+        self._subscribed = True
+        fan_mask = 0
+        for fan in self.fans:
+            fan_mask |= 1 << fan
+        temperature_mask = 0
+        for sensor in self.sensors:
+            temperature_mask |= 1 << sensor
+        self.driver.request_sensor_reports(fan_mask, temperature_mask)
+
+    def stop(self):
+        super().stop()
+        if not self._subscribed:
+            return
+        self.driver.unregister_fan_report_handler(self._on_fan_report)
+        self.driver.unregister_temperature_report_handler(self._on_temperature_report)
+        self._subscribed = False
+
+    def _on_fan_report(self, report: LCDFanReport):
+        if report.fan not in self.fans:
+            return
+        self.set_field(f"fan{report.fan}", report.rpm())
+        self.commit()
+
+    def _on_temperature_report(self, report: LCDTemperatureReport):
+        if report.sensor not in self.sensors:
+            return
+        self.set_field(f"temp{report.sensor}", report.celsius)
+        self.commit()
+
+PAGE = SensorsLCDPage
@@ -1,25 +1,70 @@
 from drivers.paged import PagedLCDDriver
+from exporter import MetricSelector, scrape_exporter_values
 from page_updating import UpdatingLCDPage
 from prometheus import build_prometheus_filter, query_prometheus_first_value
 
+# The names the Prometheus queries below use, scraped exporters may expose them under another prefix
+UPS_METRIC_PREFIX = "snmp_"
+
+UPS_POWER_LAYOUT = {
+    1: "PWR {power:4.0f} W / {apparent_power:4.0f} VA",
+    2: "BAT {runtime:4.0f} m / {capacity:4.0f} %",
+    3: "VIO {input_voltage:4.0f} V / {output_voltage:4.0f} V",
+}
+
 class UPSPowerLCDPage(UpdatingLCDPage):
     def __init__(self, config, driver: PagedLCDDriver):
-        super().__init__(config, driver, "UPS Power")
-        self.filter = build_prometheus_filter(config["filter"])
+        super().__init__(config, driver, "UPS Power", UPS_POWER_LAYOUT)
+        self.exporter_url = None
+        if "exporter" in config:
+            # Scrape the SNMP exporter directly instead of going through Prometheus
+            self.exporter_url = config["exporter"]["url"]
+            exporter_filter = config["exporter"].get("filter", {})
+            prefix = config["exporter"].get("metric_prefix", UPS_METRIC_PREFIX)
+            self.selectors = {
+                "power": MetricSelector(f"{prefix}upsAdvOutputActivePower", exporter_filter),
+                "runtime": MetricSelector(f"{prefix}upsAdvBatteryRunTimeRemaining", exporter_filter),
+                "capacity": MetricSelector(f"{prefix}upsHighPrecBatteryCapacity", exporter_filter),
+                "apparent_power": MetricSelector(f"{prefix}upsAdvOutputApparentPower", exporter_filter),
+                "input_voltage": MetricSelector(f"{prefix}upsHighPrecInputLineVoltage", exporter_filter),
+                "output_voltage": MetricSelector(f"{prefix}upsHighPrecOutputVoltage", exporter_filter),
+            }
+        else:
+            self.filter = build_prometheus_filter(config["filter"])
+
+    def _fetch_prometheus(self):
+        return (
+            query_prometheus_first_value(f"snmp_upsAdvOutputActivePower{self.filter}"),
+            query_prometheus_first_value(f"snmp_upsAdvBatteryRunTimeRemaining{self.filter} / 6000"),
+            query_prometheus_first_value(f"snmp_upsHighPrecBatteryCapacity{self.filter}"),
+            query_prometheus_first_value(f"snmp_upsAdvOutputApparentPower{self.filter}"),
+            query_prometheus_first_value(f"snmp_upsHighPrecInputLineVoltage{self.filter}"),
+            query_prometheus_first_value(f"snmp_upsHighPrecOutputVoltage{self.filter}"),
+        )
+
+    def _fetch_exporter(self):
+        values = scrape_exporter_values(self.exporter_url, self.selectors)
+        return (
+            values["power"],
+            values["runtime"] / 6000,
+            values["capacity"],
+            values["apparent_power"],
+            values["input_voltage"],
+            values["output_voltage"],
+        )
 
     def update(self):
-        ups_power_res = query_prometheus_first_value(f"snmp_upsAdvOutputActivePower{self.filter}")
-        ups_runtime_res = query_prometheus_first_value(f"snmp_upsAdvBatteryRunTimeRemaining{self.filter} / 6000")
-        ups_capacity_res = query_prometheus_first_value(f"snmp_upsHighPrecBatteryCapacity{self.filter}")
-        ups_apparent_power_res = query_prometheus_first_value(f"snmp_upsAdvOutputApparentPower{self.filter}")
-        ups_input_voltage_res = query_prometheus_first_value(f"snmp_upsHighPrecInputLineVoltage{self.filter}")
-        ups_output_voltage_res = query_prometheus_first_value(f"snmp_upsHighPrecOutputVoltage{self.filter}")
-
-        self.set_line(1, f"PWR {ups_power_res:4.0f} W / {ups_apparent_power_res:4.0f} VA")
+        if self.exporter_url is not None:
+            fetch = self._fetch_exporter
+        else:
+            fetch = self._fetch_prometheus
+        ups_power_res, ups_runtime_res, ups_capacity_res, ups_apparent_power_res, ups_input_voltage_res, ups_output_voltage_res = fetch()
+
+        self.set_fields(power=ups_power_res, apparent_power=ups_apparent_power_res)
         self.set_led(1, self.calc_led_upper_threshhold(ups_power_res, 800, 1000).value)
-        self.set_line(2, f"BAT {ups_runtime_res:4.0f} m / {ups_capacity_res:4.0f} %")
+        self.set_fields(runtime=ups_runtime_res, capacity=ups_capacity_res)
         self.set_led(2, self.calc_led_lower_threshhold(ups_runtime_res, 15, 5).value)
-        self.set_line(3, f"VIO {ups_input_voltage_res:4.0f} V / {ups_output_voltage_res:4.0f} V")
+        self.set_fields(input_voltage=ups_input_voltage_res, output_voltage=ups_output_voltage_res)
         self.set_led(3, self.calc_led_lower_threshhold(ups_input_voltage_res, 100, 80).value)
 
 PAGE = UPSPowerLCDPage
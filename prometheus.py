@@ -1,13 +1,192 @@
-from requests import get
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from json import dumps, loads
+from threading import Lock, local
+from time import monotonic, sleep
+from typing import Optional
+from shared_cache import SharedCacheUnavailable
 
 PROMETHEUS_URL = "http://prometheus:9090/api/v1/query"
+PROMETHEUS_TIMEOUT = 5
+PROMETHEUS_HEDGE_DELAY = 0.2
+PROMETHEUS_STALE_MAX_AGE = 600.0
+PROMETHEUS_HEDGE_WORKERS = 16
 
-def query_prometheus(query):
-    res = get(PROMETHEUS_URL, params={"query": query}, timeout=5).json()
+SHARED_CACHE_MAX_AGE = 5.0
+SHARED_CACHE_POLL_INTERVAL = 0.05
+
+class PrometheusDeadlineExceeded(Exception):
+    pass
+
+class QueryScope():
+    __slots__ = ("deadline", "stale_age")
+    deadline: Optional[float]
+    stale_age: float
+
+    def __init__(self, deadline: Optional[float]):
+        self.deadline = deadline
+        self.stale_age = 0.0
+
+    def remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return self.deadline - monotonic()
+
+_urls = [PROMETHEUS_URL]
+_timeout = PROMETHEUS_TIMEOUT
+_hedge_delay = PROMETHEUS_HEDGE_DELAY
+_stale_max_age = PROMETHEUS_STALE_MAX_AGE
+
+_shared_cache = None
+_shared_cache_max_age = SHARED_CACHE_MAX_AGE
+
+_hedge_executor = None
+_hedge_executor_lock = Lock()
+
+# query -> (fetched at, data)
+_last_good: dict[str, tuple[float, dict]] = {}
+_local = local()
+
+def configure(prometheus_config) -> None:
+    global _urls, _timeout, _hedge_delay, _stale_max_age
+    if prometheus_config is None:
+        prometheus_config = {}
+    _urls = prometheus_config.get("urls", [PROMETHEUS_URL])
+    _timeout = prometheus_config.get("timeout", PROMETHEUS_TIMEOUT)
+    _hedge_delay = prometheus_config.get("hedge_delay", PROMETHEUS_HEDGE_DELAY)
+    _stale_max_age = prometheus_config.get("stale_max_age", PROMETHEUS_STALE_MAX_AGE)
+
+def use_shared_cache(cache, max_age: float = SHARED_CACHE_MAX_AGE) -> None:
+    global _shared_cache, _shared_cache_max_age
+    _shared_cache = cache
+    _shared_cache_max_age = max_age
+
+@contextmanager
+def query_scope(deadline: Optional[float] = None):
+    scope = QueryScope(None if deadline is None else monotonic() + deadline)
+    old_scope = getattr(_local, "scope", None)
+    _local.scope = scope
+    try:
+        yield scope
+    finally:
+        _local.scope = old_scope
+
+def _current_scope() -> Optional[QueryScope]:
+    return getattr(_local, "scope", None)
+
+def query_timeout() -> float:
+    scope = _current_scope()
+    if scope is None:
+        return _timeout
+    remaining = scope.remaining()
+    if remaining is None:
+        return _timeout
+    if remaining <= 0:
+        raise PrometheusDeadlineExceeded("Update deadline exceeded")
+    return min(_timeout, remaining)
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=PROMETHEUS_HEDGE_WORKERS, thread_name_prefix="Prometheus hedge")
+        return _hedge_executor
+
+def _query_prometheus_url(url: str, query, timeout: float):
+    # requests is slow to import, so only pay for it once a page actually queries
+    from requests import get
+    res = get(url, params={"query": query}, timeout=timeout).json()
     if res["status"] != "success":
         raise Exception(res)
     return res["data"]
 
+def _query_prometheus_direct(query):
+    timeout = query_timeout()
+    urls = _urls
+    if len(urls) == 1:
+        return _query_prometheus_url(urls[0], query, timeout)
+
+    # Hedge: ask the next replica if the previous ones are slow or failed, first good answer wins
+    executor = _get_hedge_executor()
+    end = monotonic() + timeout
+    pending = set()
+    next_url = 0
+    error = None
+    while True:
+        now = monotonic()
+        if now >= end:
+            raise PrometheusDeadlineExceeded(f"No Prometheus replica answered within {timeout:.1f}s") from error
+        if next_url < len(urls):
+            pending.add(executor.submit(_query_prometheus_url, urls[next_url], query, end - now))
+            next_url += 1
+        elif not pending:
+            raise error
+
+        wait_time = end - now
+        if next_url < len(urls):
+            wait_time = min(wait_time, _hedge_delay)
+        done, pending = wait(pending, timeout=wait_time, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+
+def _query_prometheus_shared(query):
+    cached = _shared_cache.get(query, _shared_cache_max_age)
+    if cached is not None:
+        return loads(cached)
+
+    deadline = monotonic() + query_timeout()
+    while True:
+        try:
+            if _shared_cache.claim(query, _timeout):
+                break
+        except SharedCacheUnavailable:
+            # A worker died holding the cache lock, so this one asks Prometheus itself
+            return _query_prometheus_direct(query)
+        # Another worker is already fetching this query
+        if monotonic() > deadline:
+            return _query_prometheus_direct(query)
+        sleep(SHARED_CACHE_POLL_INTERVAL)
+        cached = _shared_cache.get(query, _shared_cache_max_age)
+        if cached is not None:
+            return loads(cached)
+
+    stored = False
+    try:
+        data = _query_prometheus_direct(query)
+        stored = _shared_cache.put(query, dumps(data).encode("utf-8"))
+    finally:
+        if not stored:
+            # Failed or too large to share: the other workers should not wait on this claim
+            _shared_cache.release(query)
+    return data
+
+def fetch_with_last_good(key: str, fetch):
+    try:
+        data = fetch()
+    except Exception:
+        # Stale-while-revalidate: fall back to the last good answer and report its age
+        cached = _last_good.get(key)
+        if cached is None:
+            raise
+        age = monotonic() - cached[0]
+        if age > _stale_max_age:
+            raise
+        scope = _current_scope()
+        if scope is not None:
+            scope.stale_age = max(scope.stale_age, age)
+        return cached[1]
+
+    _last_good[key] = (monotonic(), data)
+    return data
+
+def query_prometheus(query):
+    if _shared_cache is not None:
+        return fetch_with_last_good(query, lambda: _query_prometheus_shared(query))
+    return fetch_with_last_good(query, lambda: _query_prometheus_direct(query))
+
 def query_prometheus_first_value(query):
     res = query_prometheus(query)
     return float(res["result"][0]["value"][1])
@@ -0,0 +1,100 @@
+from os.path import splitext
+from queue import SimpleQueue
+from struct import Struct
+from threading import Thread
+from time import monotonic_ns
+from typing import BinaryIO, Iterator, Optional
+from log import LOG
+
+RECORDING_MAGIC = b"LCDREC1\n"
+RECORDING_BUFFER_SIZE = 64 * 1024
+
+RECORD_WRITE = 0
+RECORD_READ = 1
+
+# nanoseconds since recording start, direction, length
+_RECORD_HEADER = Struct("<QBH")
+
+Record = tuple[int, int, bytes]
+
+class SerialRecorder():
+    path: str
+    _started_ns: int
+    _queue: SimpleQueue
+    _file: BinaryIO
+    _failed: bool
+    _writer_thread: Thread
+
+    def __init__(self, path: str):
+        self._file = self._open(path)
+        self._started_ns = monotonic_ns()
+        self._queue = SimpleQueue()
+        self._failed = False
+        self._writer_thread = Thread(name=f"LCD recorder {self.path}", target=self._writer, daemon=True)
+        self._writer_thread.start()
+
+    def _open(self, path: str) -> BinaryIO:
+        # Never overwrite an earlier recording, reopening within the same second gets a counter
+        base, extension = splitext(path)
+        attempt = 0
+        while True:
+            self.path = path if attempt == 0 else f"{base}-{attempt}{extension}"
+            try:
+                return open(self.path, "xb", buffering=RECORDING_BUFFER_SIZE)
+            except FileExistsError:
+                attempt += 1
+
+    def record(self, direction: int, data: bytes) -> None:
+        # Hot path: only timestamp and enqueue, the writer thread does the rest
+        if self._failed:
+            return
+        self._queue.put((monotonic_ns() - self._started_ns, direction, bytes(data)))
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._writer_thread.join()
+
+    def _writer(self) -> None:
+        try:
+            with self._file as f:
+                f.write(RECORDING_MAGIC)
+                while True:
+                    record = self._queue.get()
+                    if record is None:
+                        return
+                    timestamp, direction, data = record
+                    f.write(_RECORD_HEADER.pack(timestamp, direction, len(data)))
+                    f.write(data)
+                    # Only hit the disk once the queue runs dry
+                    if self._queue.empty():
+                        f.flush()
+        except OSError:
+            LOG.exception("Recording failed, no longer recording", path=self.path)
+            self._failed = True
+        # Whatever was queued before record() saw the failure is dropped, up to close()
+        while self._queue.get() is not None:
+            pass
+
+def read_recording(f: BinaryIO) -> Iterator[Record]:
+    magic = f.read(len(RECORDING_MAGIC))
+    if magic != RECORDING_MAGIC:
+        raise ValueError("Not an LCD serial recording")
+    while True:
+        header = f.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size:
+            return
+        timestamp, direction, length = _RECORD_HEADER.unpack(header)
+        data = f.read(length)
+        if len(data) < length:
+            return
+        yield timestamp, direction, data
+
+def load_recording(path: str) -> list[Record]:
+    with open(path, "rb") as f:
+        return list(read_recording(f))
+
+def recording_path(directory: str, port: str, suffix: Optional[str] = None) -> str:
+    name = port.strip("/").replace("/", "_")
+    if suffix is not None:
+        name = f"{name}-{suffix}"
+    return f"{directory}/{name}.lcdrec"
@@ -1,17 +1,109 @@
+from collections import deque
+from threading import Lock
+from typing import Optional
+
 DEFAULT_CHAR = ord(" ")
+DAMAGE_HISTORY_LEN = 16
+
+RenderableFrame = tuple[bytes, tuple[tuple[int, int], ...], int]
+DamageSpans = list[tuple[int, int]]
+
+# A transparent overlay drawn over the content of a Renderable. Cells are
+# opaque once written and transparent again once cleared, so the content
+# below is never touched and shows through as soon as the overlay goes away.
+class RenderLayer():
+    name: str
+    mem: bytearray
+    mask: bytearray
+    # Per row, the columns that may hold opaque cells
+    row_extents: list[Optional[tuple[int, int]]]
+    _owner: "Renderable"
+
+    def __init__(self, owner: "Renderable", name: str):
+        self.name = name
+        self._owner = owner
+        self.resize()
+
+    def resize(self) -> None:
+        self.mem = bytearray([DEFAULT_CHAR]) * self._owner.lcd_pixel_count
+        self.mask = bytearray(self._owner.lcd_pixel_count)
+        self.row_extents = [None] * self._owner.lcd_height
+
+    def _span(self, col: int, row: int, length: int) -> tuple[int, int]:
+        start = (row * self._owner.lcd_width) + col
+        end = start + length
+        if end > self._owner.lcd_pixel_count:
+            raise IndexError(f"Write past end of LCD memory ({end} > {self._owner.lcd_pixel_count})")
+        return start, end
+
+    def write_at(self, col: int, row: int, content: str) -> None:
+        content_bytes = content.encode("latin-1")
+        start, end = self._span(col, row, len(content_bytes))
+        if self.mem[start:end] == content_bytes and self.mask[start:end].count(0) == 0:
+            return
+        self.mem[start:end] = content_bytes
+        self.mask[start:end] = b"\x01" * (end - start)
+
+        width = self._owner.lcd_width
+        pos = start
+        while pos < end:
+            row = pos // width
+            row_base = row * width
+            col_start = pos - row_base
+            col_end = min(end - row_base, width)
+            old = self.row_extents[row]
+            if old is not None:
+                col_start = min(col_start, old[0])
+                col_end = max(col_end, old[1])
+            self.row_extents[row] = (col_start, col_end)
+            pos = row_base + width
+        self._owner.add_damage(start, end)
+
+    def clear_at(self, col: int, row: int, length: int) -> None:
+        start, end = self._span(col, row, length)
+        if self.mask[start:end].count(1) == 0:
+            return
+        self.mask[start:end] = bytes(end - start)
+        self._owner.add_damage(start, end)
+
+    def clear(self) -> None:
+        width = self._owner.lcd_width
+        for row, extent in enumerate(self.row_extents):
+            if extent is None:
+                continue
+            row_base = row * width
+            self.mask[row_base + extent[0]:row_base + extent[1]] = bytes(extent[1] - extent[0])
+            self.row_extents[row] = None
+            self._owner.add_damage(row_base + extent[0], row_base + extent[1])
 
 class Renderable():
     lcd_led_set: list[tuple[int, int]]
     lcd_mem_set: bytearray
+    layers: list[RenderLayer]
     dirty: bool
-    
+    generation: int
+
     lcd_height: int
     lcd_width: int
     lcd_led_count: int
     lcd_pixel_count: int
 
+    _front: Optional[RenderableFrame]
+    # Content layer without the overlays, committed together with its front frame
+    _front_content: Optional[tuple[bytes, RenderableFrame]]
+    _composed: bytearray
+    _commit_lock: Lock
+    _damage_rows: list[Optional[tuple[int, int]]]
+    _damage_history: deque[tuple[int, DamageSpans]]
+
     def __init__(self):
         self.dirty = False
+        self.generation = 0
+        self._front = None
+        self._front_content = None
+        self._commit_lock = Lock()
+        self._damage_history = deque(maxlen=DAMAGE_HISTORY_LEN)
+        self.layers = []
         self.init_arrays(0, 0, 0)
 
     def init_arrays(self, height: int, width: int, led_count: int):
@@ -20,20 +112,108 @@ class Renderable():
         self.lcd_pixel_count = height * width
         self.lcd_led_count = led_count
         self.lcd_led_set = [(0, 0)] * led_count
-        self.lcd_mem_set = bytearray(self.lcd_pixel_count)
-        for i in range(self.lcd_pixel_count):
-            self.lcd_mem_set[i] = DEFAULT_CHAR
+        self.lcd_mem_set = bytearray([DEFAULT_CHAR]) * self.lcd_pixel_count
+        self._composed = bytearray(self.lcd_mem_set)
+        for layer in self.layers:
+            layer.resize()
+        self._damage_rows = [None] * height
+        self.add_damage()
+
+    def add_layer(self, name: str) -> RenderLayer:
+        # Layers stack in the order they are added, each above the last
+        layer = RenderLayer(self, name)
+        self.layers.append(layer)
+        return layer
+
+    def add_damage(self, start: int = 0, end: int = None) -> None:
+        if end is None:
+            end = self.lcd_pixel_count
+        while start < end:
+            row = start // self.lcd_width
+            row_base = row * self.lcd_width
+            col_start = start - row_base
+            col_end = min(end - row_base, self.lcd_width)
+            old = self._damage_rows[row]
+            if old is not None:
+                col_start = min(col_start, old[0])
+                col_end = max(col_end, old[1])
+            self._damage_rows[row] = (col_start, col_end)
+            start = row_base + self.lcd_width
         self.dirty = True
 
+    def commit(self) -> int:
+        with self._commit_lock:
+            if self.dirty or self._front is None:
+                spans: DamageSpans = []
+                for row, damage in enumerate(self._damage_rows):
+                    if damage is None:
+                        continue
+                    row_base = row * self.lcd_width
+                    spans.append((row_base + damage[0], row_base + damage[1]))
+                    self._damage_rows[row] = None
+
+                self.dirty = False
+                self.generation += 1
+                self._damage_history.append((self.generation, spans))
+                self._compose(spans)
+                # Single reference assignment, so readers never see a half-updated frame
+                self._front = (bytes(self._composed), tuple(self.lcd_led_set), self.generation)
+                self._front_content = (bytes(self.lcd_mem_set), self._front)
+            return self.generation
+
+    def _compose(self, spans: DamageSpans) -> None:
+        # Only cells some layer touched since the last commit get composed again
+        composed = self._composed
+        content = self.lcd_mem_set
+        for start, end in spans:
+            composed[start:end] = content[start:end]
+            row = start // self.lcd_width
+            row_base = row * self.lcd_width
+            for layer in self.layers:
+                extent = layer.row_extents[row]
+                if extent is None:
+                    continue
+                mask = layer.mask
+                mem = layer.mem
+                for i in range(max(start, row_base + extent[0]), min(end, row_base + extent[1])):
+                    if mask[i]:
+                        composed[i] = mem[i]
+
+    def front(self) -> Optional[RenderableFrame]:
+        return self._front
+
+    def front_content(self) -> Optional[tuple[bytes, RenderableFrame]]:
+        return self._front_content
+
+    def damage_since(self, generation: int) -> Optional[DamageSpans]:
+        with self._commit_lock:
+            if generation < 0 or not self._damage_history:
+                return None
+            if self._damage_history[0][0] > generation + 1:
+                # History does not reach back far enough
+                return None
+            spans: DamageSpans = []
+            for damage_generation, damage in self._damage_history:
+                if damage_generation > generation:
+                    spans += damage
+            return spans
+
     def set_led(self, idx: int, color: tuple[int, int]) -> None:
+        if self.lcd_led_set[idx] == color:
+            return
         self.lcd_led_set[idx] = color
         self.dirty = True
 
     def write_at(self, col: int, row: int, content: str) -> None:
         content_bytes = content.encode("latin-1")
-        for i, c in enumerate(content_bytes):
-            self.lcd_mem_set[(row * self.lcd_width) + col + i] = c
-        self.dirty = True
+        start = (row * self.lcd_width) + col
+        end = start + len(content_bytes)
+        if end > self.lcd_pixel_count:
+            raise IndexError(f"Write past end of LCD memory ({end} > {self.lcd_pixel_count})")
+        if self.lcd_mem_set[start:end] == content_bytes:
+            return
+        self.lcd_mem_set[start:end] = content_bytes
+        self.add_damage(start, end)
 
     def set_line(self, idx: int, content: str) -> None:
         content_len = len(content)
@@ -44,6 +224,11 @@ class Renderable():
         self.write_at(0, idx, content)
 
     def clear(self) -> None:
-        for i in range(self.lcd_pixel_count):
-            self.lcd_mem_set[i] = DEFAULT_CHAR
-        self.dirty = True
+        blank_line = bytes([DEFAULT_CHAR]) * self.lcd_width
+        for row in range(self.lcd_height):
+            start = row * self.lcd_width
+            end = start + self.lcd_width
+            if self.lcd_mem_set[start:end] == blank_line:
+                continue
+            self.lcd_mem_set[start:end] = blank_line
+            self.add_damage(start, end)
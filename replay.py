@@ -0,0 +1,121 @@
+from argparse import ArgumentParser
+from time import monotonic, perf_counter, sleep
+from lcd import LCD, LCDKey, LCDKeyEvent
+from recorder import RECORD_READ, RECORD_WRITE, Record, load_recording
+
+class ReplaySerial():
+    _pending: bytes
+
+    def __init__(self):
+        self._pending = b""
+
+    def feed(self, data: bytes) -> None:
+        self._pending += data
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._pending)
+
+    def read(self, size: int = 1) -> bytes:
+        data = self._pending[:size]
+        self._pending = self._pending[size:]
+        return data
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+    def close(self) -> None:
+        pass
+
+class ReplayStats():
+    bytes_written: int
+    bytes_read: int
+    packets_written: int
+    responses: int
+    keys: int
+    elapsed: float
+
+    def __init__(self):
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.packets_written = 0
+        self.responses = 0
+        self.keys = 0
+        self.elapsed = 0.0
+
+    def key_handler(self, key: LCDKey, event: LCDKeyEvent, received_at: float) -> None:
+        self.keys += 1
+
+# Covers the read side only: recorded reads go through the packet parser and key dispatch,
+# recorded writes are counted but no LCDDriver renders or sends anything
+def replay(records: list[Record], realtime: bool = False) -> tuple[LCD, ReplayStats]:
+    # No reader thread: the parser is driven directly, so every run sees the same byte boundaries
+    lcd = LCD("replay")
+    serial = ReplaySerial()
+    lcd._serial = serial
+    stats = ReplayStats()
+    lcd.register_key_event_handler(stats.key_handler)
+    # Handlers run inline and long press and repeat timers follow the recorded timestamps,
+    # so key events come out the same on every run, whatever the replay speed
+    record_time = 0.0
+    lcd.keys.synchronous = True
+    lcd.keys.clock = lambda: record_time
+    lcd.reports.synchronous = True
+
+    start = perf_counter()
+    for timestamp, direction, data in records:
+        if realtime:
+            delay = timestamp / 1e9 - (perf_counter() - start)
+            if delay > 0:
+                sleep(delay)
+        record_time = timestamp / 1e9
+        lcd.keys.advance(record_time)
+
+        if direction == RECORD_WRITE:
+            stats.bytes_written += len(data)
+            stats.packets_written += 1
+            continue
+        if direction != RECORD_READ:
+            continue
+
+        stats.bytes_read += len(data)
+        serial.feed(data)
+        while True:
+            buffered = len(lcd._buffer) + serial.in_waiting
+            lcd._read()
+            if lcd._last_response is not None:
+                # Stand in for the sender that would normally consume the response
+                stats.responses += 1
+                lcd._last_response = None
+            if len(lcd._buffer) + serial.in_waiting >= buffered:
+                break
+
+    stats.elapsed = perf_counter() - start
+    return lcd, stats
+
+def main():
+    parser = ArgumentParser(description="Replay a recorded LCD serial session through the packet parser")
+    parser.add_argument("recording")
+    parser.add_argument("--realtime", action="store_true", help="Replay at the recorded speed instead of as fast as possible")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the recording this many times")
+    args = parser.parse_args()
+
+    load_start = monotonic()
+    records = load_recording(args.recording)
+    print(f"Loaded {len(records)} records in {monotonic() - load_start:.3f}s", flush=True)
+    if records:
+        print(f"Recording spans {records[-1][0] / 1e9:.3f}s", flush=True)
+
+    for run in range(args.repeat):
+        lcd, stats = replay(records, realtime=args.realtime)
+        rate = stats.bytes_read / stats.elapsed if stats.elapsed > 0 else 0.0
+        print(
+            f"Run {run + 1}: wrote {stats.packets_written} packets ({stats.bytes_written} bytes), "
+            f"read {stats.bytes_read} bytes, {stats.responses} responses, {stats.keys} key events, "
+            f"{lcd.resyncs} resyncs, {len(lcd._buffer)} bytes left over, "
+            f"{stats.elapsed:.3f}s ({rate / 1024:.1f} KiB/s parsed)",
+            flush=True,
+        )
+
+if __name__ == "__main__":
+    main()
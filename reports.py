@@ -0,0 +1,69 @@
+from threading import Condition, Thread
+from typing import Optional
+from log import LOG
+
+class ReportDispatcher():
+    name: str
+    reports_coalesced: int
+    # Replay drives the dispatcher inline, without the thread
+    synchronous: bool
+    # (kind, index) -> (handlers, report); a report is a reading, so only the newest one matters
+    _pending: dict
+    _cond: Condition
+    _should_run: bool
+    _thread: Optional[Thread]
+
+    def __init__(self, name: str):
+        self.name = name
+        self.reports_coalesced = 0
+        self.synchronous = False
+        self._pending = {}
+        self._cond = Condition()
+        self._should_run = False
+        self._thread = None
+
+    def start(self) -> None:
+        self.stop()
+        self._should_run = True
+        self._pending = {}
+        self._thread = Thread(name=f"LCD reports {self.name}", target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._should_run = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, kind: str, index: int, handlers: list, report) -> None:
+        # Called on the reader thread, so this only ever queues unless replay made it synchronous
+        if self.synchronous:
+            self._dispatch(kind, handlers, report)
+            return
+        with self._cond:
+            if (kind, index) in self._pending:
+                self.reports_coalesced += 1
+            self._pending[(kind, index)] = (handlers, report)
+            self._cond.notify()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while self._should_run and not self._pending:
+                    self._cond.wait()
+                if not self._should_run:
+                    return
+                pending = self._pending
+                self._pending = {}
+
+            for (kind, _), (handlers, report) in pending.items():
+                self._dispatch(kind, handlers, report)
+
+    def _dispatch(self, kind: str, handlers: list, report) -> None:
+        for handler in handlers:
+            try:
+                handler(report=report)
+            except Exception:
+                LOG.exception(f"Error in {kind} report handler", port=self.name, handler=handler)
@@ -0,0 +1,152 @@
+from contextlib import contextmanager
+from hashlib import blake2b
+from multiprocessing.shared_memory import SharedMemory
+from struct import Struct
+from time import sleep, time
+from typing import Optional
+
+SHARED_CACHE_SLOTS = 256
+SHARED_CACHE_PAYLOAD_SIZE = 4096
+SHARED_CACHE_PROBES = 8
+# A writer holds a slot for microseconds, past this many tries it is treated as a miss
+SHARED_CACHE_READ_RETRIES = 100
+# The lock is held for microseconds too; a worker killed while holding it never gives it back
+SHARED_CACHE_LOCK_TIMEOUT = 0.5
+
+# key hash, sequence, payload length, fetched at, claimed at
+_SLOT_HEADER = Struct("<QIIdd")
+_SLOT_SIZE = _SLOT_HEADER.size + SHARED_CACHE_PAYLOAD_SIZE
+
+class SharedCacheUnavailable(Exception):
+    pass
+
+class SharedQueryCache():
+    slots: int
+    _shm: SharedMemory
+    _lock: object
+    _owner: bool
+
+    def __init__(self, lock, slots: int = SHARED_CACHE_SLOTS, name: str = None):
+        self.slots = slots
+        self._lock = lock
+        self._owner = name is None
+        if self._owner:
+            self._shm = SharedMemory(create=True, size=slots * _SLOT_SIZE)
+            self._shm.buf[:] = bytes(len(self._shm.buf))
+        else:
+            self._shm = SharedMemory(name=name)
+
+    def name(self) -> str:
+        return self._shm.name
+
+    def close(self) -> None:
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    @contextmanager
+    def _locked(self):
+        if not self._lock.acquire(timeout=SHARED_CACHE_LOCK_TIMEOUT):
+            raise SharedCacheUnavailable("Timed out waiting for the shared query cache lock")
+        try:
+            yield
+        finally:
+            self._lock.release()
+
+    def _key_hash(self, key: str) -> int:
+        # 0 marks an empty slot
+        return int.from_bytes(blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+    def _slot_offset(self, key_hash: int, probe: int) -> int:
+        return ((key_hash + probe) % self.slots) * _SLOT_SIZE
+
+    def _read_slot(self, offset: int) -> tuple[int, int, int, float, float]:
+        return _SLOT_HEADER.unpack_from(self._shm.buf, offset)
+
+    def _find(self, key_hash: int, for_write: bool) -> Optional[int]:
+        oldest_offset = None
+        oldest_fetched_at = None
+        for probe in range(SHARED_CACHE_PROBES):
+            offset = self._slot_offset(key_hash, probe)
+            slot_hash, _, _, fetched_at, _ = self._read_slot(offset)
+            if slot_hash == key_hash:
+                return offset
+            if not for_write:
+                continue
+            if slot_hash == 0:
+                return offset
+            if oldest_fetched_at is None or fetched_at < oldest_fetched_at:
+                oldest_offset = offset
+                oldest_fetched_at = fetched_at
+        return oldest_offset
+
+    def get(self, key: str, max_age: float) -> Optional[bytes]:
+        key_hash = self._key_hash(key)
+        offset = self._find(key_hash, for_write=False)
+        if offset is None:
+            return None
+
+        # Seqlock read: retry while a writer is active or finished in between
+        for _ in range(SHARED_CACHE_READ_RETRIES):
+            slot_hash, seq, length, fetched_at, _ = self._read_slot(offset)
+            if not seq & 1:
+                payload = bytes(self._shm.buf[offset + _SLOT_HEADER.size:offset + _SLOT_HEADER.size + length])
+                if self._read_slot(offset)[1] == seq:
+                    break
+            # Let the writer, which may be on this core, finish
+            sleep(0)
+        else:
+            return None
+
+        if slot_hash != key_hash or length == 0:
+            return None
+        if time() - fetched_at > max_age:
+            return None
+        return payload
+
+    def claim(self, key: str, claim_timeout: float) -> bool:
+        # Raises SharedCacheUnavailable, so the caller can tell a stuck lock from another worker's claim
+        key_hash = self._key_hash(key)
+        with self._locked():
+            offset = self._find(key_hash, for_write=True)
+            slot_hash, seq, length, fetched_at, claimed_at = self._read_slot(offset)
+            now = time()
+            if slot_hash == key_hash and now - claimed_at < claim_timeout:
+                return False
+            if slot_hash != key_hash:
+                # Evicting another key, so drop its payload
+                length = 0
+                fetched_at = 0.0
+            _SLOT_HEADER.pack_into(self._shm.buf, offset, key_hash, seq, length, fetched_at, now)
+            return True
+
+    def release(self, key: str) -> None:
+        # Give up a claim without a result, so the next worker asks right away instead of waiting it out
+        key_hash = self._key_hash(key)
+        try:
+            with self._locked():
+                offset = self._find(key_hash, for_write=False)
+                if offset is None:
+                    return
+                slot_hash, seq, length, fetched_at, _ = self._read_slot(offset)
+                if slot_hash != key_hash:
+                    return
+                _SLOT_HEADER.pack_into(self._shm.buf, offset, slot_hash, seq, length, fetched_at, 0.0)
+        except SharedCacheUnavailable:
+            # The claim then simply times out
+            pass
+
+    def put(self, key: str, payload: bytes) -> bool:
+        if len(payload) > SHARED_CACHE_PAYLOAD_SIZE:
+            return False
+        key_hash = self._key_hash(key)
+        try:
+            with self._locked():
+                offset = self._find(key_hash, for_write=True)
+                seq = self._read_slot(offset)[1]
+                _SLOT_HEADER.pack_into(self._shm.buf, offset, key_hash, seq + 1, 0, 0.0, 0.0)
+                self._shm.buf[offset + _SLOT_HEADER.size:offset + _SLOT_HEADER.size + len(payload)] = payload
+                _SLOT_HEADER.pack_into(self._shm.buf, offset, key_hash, (seq + 2) & 0xFFFFFFFF, len(payload), time(), 0.0)
+                return True
+        except SharedCacheUnavailable:
+            return False
@@ -0,0 +1,107 @@
+from mmap import mmap
+from os import makedirs, path
+from struct import Struct
+from typing import Optional
+from renderable import DEFAULT_CHAR
+
+# tmpfs that the unprivileged container user can write to, unlike /run
+FRAMEBUFFER_DIR = "/dev/shm/lcdify"
+FRAMEBUFFER_MAGIC = b"LCDFB1\0\0"
+
+# magic, sequence, width, height, LED count, reserved
+_HEADER = Struct("<8sIBBBx")
+_SEQUENCE = Struct("<I")
+_SEQUENCE_OFFSET = len(FRAMEBUFFER_MAGIC)
+
+# Layout: header, width * height characters, then a red and green byte per LED.
+# Writers make the sequence odd, write, then make it even again; readers only
+# take frames whose even sequence did not change while copying.
+class SharedFramebuffer():
+    path: str
+    width: int
+    height: int
+    led_count: int
+    _file: object
+    _map: mmap
+
+    def __init__(self, file_path: str, width: int = None, height: int = None, led_count: int = None):
+        self.path = file_path
+        create = width is not None
+        if create:
+            size = _HEADER.size + width * height + led_count * 2
+            if not path.exists(file_path) or path.getsize(file_path) != size or not self._header_matches(file_path, width, height, led_count):
+                self._create(file_path, width, height, led_count)
+
+        self._file = open(file_path, "r+b")
+        self._map = mmap(self._file.fileno(), 0)
+        magic, _, self.width, self.height, self.led_count = _HEADER.unpack_from(self._map, 0)
+        if magic != FRAMEBUFFER_MAGIC:
+            self.close()
+            raise ValueError(f"{file_path} is not an LCD framebuffer")
+
+    @staticmethod
+    def _header_matches(file_path: str, width: int, height: int, led_count: int) -> bool:
+        with open(file_path, "rb") as f:
+            header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return False
+        magic, _, file_width, file_height, file_led_count = _HEADER.unpack(header)
+        return magic == FRAMEBUFFER_MAGIC and (file_width, file_height, file_led_count) == (width, height, led_count)
+
+    @staticmethod
+    def _create(file_path: str, width: int, height: int, led_count: int) -> None:
+        directory = path.dirname(file_path)
+        if directory:
+            makedirs(directory, exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(_HEADER.pack(FRAMEBUFFER_MAGIC, 0, width, height, led_count))
+            f.write(bytes([DEFAULT_CHAR]) * (width * height))
+            f.write(bytes(led_count * 2))
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def sequence(self) -> int:
+        return _SEQUENCE.unpack_from(self._map, _SEQUENCE_OFFSET)[0]
+
+    def read(self, last_sequence: int = -1) -> Optional[tuple[int, bytes, list[tuple[int, int]]]]:
+        # None if nothing changed since last_sequence or a writer is busy; the next poll picks it up
+        seq = self.sequence()
+        if seq == last_sequence or seq & 1:
+            return None
+        mem_end = _HEADER.size + self.width * self.height
+        mem = self._map[_HEADER.size:mem_end]
+        led_bytes = self._map[mem_end:mem_end + self.led_count * 2]
+        if self.sequence() != seq:
+            return None
+        leds = [(led_bytes[idx * 2], led_bytes[idx * 2 + 1]) for idx in range(self.led_count)]
+        return seq, mem, leds
+
+    def begin_write(self) -> memoryview:
+        _SEQUENCE.pack_into(self._map, _SEQUENCE_OFFSET, (self.sequence() | 1))
+        return memoryview(self._map)[_HEADER.size:]
+
+    def end_write(self) -> None:
+        _SEQUENCE.pack_into(self._map, _SEQUENCE_OFFSET, (self.sequence() + 1) & 0xFFFFFFFE)
+
+    def write_at(self, col: int, row: int, content: bytes) -> None:
+        start = row * self.width + col
+        view = self.begin_write()
+        try:
+            view[start:start + len(content)] = content
+        finally:
+            view.release()
+            self.end_write()
+
+    def set_led(self, idx: int, red: int, green: int) -> None:
+        offset = self.width * self.height + idx * 2
+        view = self.begin_write()
+        try:
+            view[offset:offset + 2] = bytes((red, green))
+        finally:
+            view.release()
+            self.end_write()
+
+def framebuffer_path(name: str) -> str:
+    return f"{FRAMEBUFFER_DIR}/{name.strip().lower().replace('/', '_').replace(' ', '_')}.lcdfb"
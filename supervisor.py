@@ -0,0 +1,186 @@
+import tracemalloc
+from multiprocessing import get_context
+from signal import SIGHUP, SIGTERM, SIG_IGN, signal
+from time import monotonic, sleep
+from typing import Optional
+import config
+from core import PortPool, create_driver, watch_config
+from log import LOG
+from memory import MemoryReporter, format_bytes, process_rss
+from mirror import MIRROR_PORT, create_mirror_server
+from prometheus import SHARED_CACHE_MAX_AGE, use_shared_cache
+from shared_cache import SharedQueryCache
+import page_state
+
+WORKER_RESTART_BACKOFF_MIN = 1.0
+WORKER_RESTART_BACKOFF_MAX = 60.0
+WORKER_HEALTHY_AFTER = 60.0
+WORKER_STOP_TIMEOUT = 5.0
+
+_CONTEXT = get_context("fork")
+
+def _worker_exit(signum, frame):
+    raise SystemExit(0)
+
+def _worker_main(display_config, ports: list[tuple[str, Optional[bytes]]], cache: SharedQueryCache, cache_max_age: float) -> None:
+    # Config reloads are handled by the supervisor, which stops workers with SIGTERM
+    signal(SIGHUP, SIG_IGN)
+    signal(SIGTERM, _worker_exit)
+    # Inherited from the supervisor's reporter, but only the supervisor reports; tracing would only slow the worker down
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    use_shared_cache(cache, cache_max_age)
+    # Each worker keeps its own file
+    page_state.configure(config.CONFIG.get("page_state"), f".{display_config['id']}")
+    mirror_config = config.CONFIG.get("mirror")
+    mirror_server = None
+    if mirror_config is not None:
+        # Each worker owns its framebuffer, so each serves its own mirror next to the configured port
+        mirror_server = create_mirror_server({**mirror_config, "port": mirror_config.get("port", MIRROR_PORT) + display_config["id"]})
+        mirror_server.start()
+    driver = create_driver(display_config, ports, mirror_server)
+    driver.start()
+    try:
+        while True:
+            sleep(1000)
+    finally:
+        # One last snapshot before the supervisor's terminate() takes the worker down
+        page_state.shutdown()
+
+class DisplayWorker():
+    display_config: dict
+    ports: list[str]
+    process: object
+    restarts: int
+    _cache: SharedQueryCache
+    _cache_max_age: float
+    _started_at: float
+    _backoff: float
+    _restart_at: Optional[float]
+
+    def __init__(self, display_config, ports: list[str], cache: SharedQueryCache, cache_max_age: float):
+        self.display_config = display_config
+        self.ports = ports
+        self.process = None
+        self.restarts = 0
+        self._cache = cache
+        self._cache_max_age = cache_max_age
+        self._started_at = 0.0
+        self._backoff = WORKER_RESTART_BACKOFF_MIN
+        self._restart_at = None
+
+    def name(self) -> str:
+        return f"{self.display_config['name']} (ID {self.display_config['id']})"
+
+    def start(self, splashes: Optional[list[Optional[bytes]]] = None) -> None:
+        if splashes is None:
+            splashes = [None] * len(self.ports)
+        self.process = _CONTEXT.Process(
+            name=f"LCD worker {self.display_config['id']}",
+            target=_worker_main,
+            args=(self.display_config, list(zip(self.ports, splashes)), self._cache, self._cache_max_age),
+            daemon=True,
+        )
+        self.process.start()
+        self._started_at = monotonic()
+        self._restart_at = None
+        print(f"Started worker for display {self.name()} on {', '.join(self.ports)} as PID {self.process.pid}", flush=True)
+
+    def stop(self) -> None:
+        if self.process is None:
+            return
+        self.process.terminate()
+        self.process.join(WORKER_STOP_TIMEOUT)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.process = None
+
+    def check(self) -> None:
+        if self.process is None or self.process.is_alive():
+            if self.process is not None and monotonic() - self._started_at > WORKER_HEALTHY_AFTER:
+                self._backoff = WORKER_RESTART_BACKOFF_MIN
+            return
+
+        now = monotonic()
+        if self._restart_at is None:
+            print(f"Worker for display {self.name()} exited with code {self.process.exitcode}, restarting in {self._backoff:.0f}s", flush=True)
+            self._restart_at = now + self._backoff
+            self._backoff = min(self._backoff * 2.0, WORKER_RESTART_BACKOFF_MAX)
+            return
+        if now < self._restart_at:
+            return
+
+        self.process.join()
+        self.restarts += 1
+        self.start()
+
+def serve_supervisor(port_pool: PortPool, memory_reporter: Optional[MemoryReporter] = None) -> None:
+    cache_max_age = config.CONFIG.get("shared_cache_max_age", SHARED_CACHE_MAX_AGE)
+    cache = SharedQueryCache(_CONTEXT.Lock())
+
+    # Display ID -> worker
+    workers: dict[int, DisplayWorker] = {}
+
+    def start_worker(display_config) -> bool:
+        ports = port_pool.assign_all(display_config)
+        if ports is None:
+            return False
+        worker = DisplayWorker(display_config, [port for port, _ in ports], cache, cache_max_age)
+        workers[display_config["id"]] = worker
+        worker.start([splash for _, splash in ports])
+        return True
+
+    def apply_config(displays) -> None:
+        new_ids = set(display_config["id"] for display_config in displays)
+        for id in list(workers.keys()):
+            if id not in new_ids:
+                print(f"Display ID {id} removed from config, stopping its worker", flush=True)
+                workers.pop(id).stop()
+
+        for display_config in displays:
+            id = display_config["id"]
+            if id not in workers:
+                print(f"Display {display_config['name']} (ID {id}) added to config", flush=True)
+                start_worker(display_config)
+                continue
+
+            worker = workers[id]
+            if worker.display_config == display_config:
+                continue
+            if worker.display_config.get("mirror_ids") != display_config.get("mirror_ids"):
+                print(f"Mirrors of display {worker.name()} changed, restarting its worker", flush=True)
+                workers.pop(id).stop()
+                start_worker(display_config)
+                continue
+            worker.display_config = display_config
+            if worker.process is not None:
+                print(f"Display {worker.name()} changed, restarting its worker", flush=True)
+                worker.stop()
+                worker.start()
+
+    def check_workers() -> None:
+        for worker in list(workers.values()):
+            worker.check()
+        if memory_reporter is not None and memory_reporter.due():
+            # Each worker is one display, so its RSS is that display's footprint
+            lines = [memory_reporter.report()]
+            for worker in workers.values():
+                if worker.process is None:
+                    continue
+                rss = process_rss(worker.process.pid)
+                if rss is not None:
+                    lines.append(f"  worker {worker.name()}: rss={format_bytes(rss)}")
+            LOG.info("\n".join(lines))
+
+    try:
+        for display_config in config.CONFIG["displays"]:
+            if not start_worker(display_config):
+                return
+        if memory_reporter is not None:
+            memory_reporter.rebase()
+        watch_config(apply_config, check_workers)
+    finally:
+        for worker in workers.values():
+            worker.stop()
+        cache.close()
@@ -0,0 +1,43 @@
+from contextlib import contextmanager
+from threading import Lock
+from time import monotonic
+
+class StartupTimer():
+    started_at: float
+    phases: list[tuple[str, float]]
+    marks: list[tuple[str, float]]
+    _lock: Lock
+
+    def __init__(self):
+        self.started_at = monotonic()
+        self.phases = []
+        self.marks = []
+        self._lock = Lock()
+
+    def elapsed(self) -> float:
+        return monotonic() - self.started_at
+
+    @contextmanager
+    def phase(self, name: str):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            duration = monotonic() - start
+            with self._lock:
+                self.phases.append((name, duration))
+            print(f"Startup: {name} took {duration * 1000:.1f}ms", flush=True)
+
+    def mark(self, name: str) -> None:
+        elapsed = self.elapsed()
+        with self._lock:
+            self.marks.append((name, elapsed))
+        print(f"Startup: {name} after {elapsed * 1000:.1f}ms", flush=True)
+
+    def report(self) -> str:
+        with self._lock:
+            lines = [f"{name}: {duration * 1000:.1f}ms" for name, duration in self.phases]
+            lines += [f"{name}: +{elapsed * 1000:.1f}ms" for name, elapsed in self.marks]
+        return "\n".join(lines)
+
+STARTUP = StartupTimer()
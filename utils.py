@@ -2,17 +2,29 @@ from sys import stderr, stdout
 from traceback import print_exc
 from enum import Enum
 from os import _exit
+from log import LOG
 
 def critical_call(func):
     try:
         return func()
     except Exception:
+        # Records still queued would explain what led up to this
+        LOG.flush()
         print("Fatal exception happened!", flush=True)
         print_exc()
         stderr.flush()
         stdout.flush()
         _exit(1)
 
+def format_age(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 60 * 60:
+        return f"{seconds // 60:.0f}m"
+    if seconds < 24 * 60 * 60:
+        return f"{seconds // (60 * 60):.0f}h"
+    return f"{min(seconds // (24 * 60 * 60), 99):.0f}d"
+
 class LEDColorPreset(Enum):
     OFF = (0, 0)
     NORMAL = (0, 100)